@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+import tlcconfig
+
+# Default location of the store
+store_path = "./annotation_store"
+
+# Annotation sources and types, stored as small integer codes
+sources = ["uv", "stain"]
+annotation_types = ["baseline", "solvent_line", "spots"]
+
+# Plates per image; with the sources this fixes the slots of the per-image index
+max_plates = len(tlcconfig.plate_names)
+slots_per_image = len(sources) * max_plates
+
+# Compact automatically when the journal holds this many events at close
+auto_compact_events = 10000
+
+# Columns of the compacted store, one .npy file each
+columns = {
+    "image": np.int32,
+    "source": np.int8,
+    "plate": np.int8,
+    "type": np.int8,
+    "x": np.float32,
+    "y": np.float32,
+}
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+# Annotation store. Every click is appended to a journal (JSON lines, flushed
+# and fsynced) as it happens. compact() folds the journal into columnar .npy
+# files sorted by image, source and plate, with an offsets array giving the
+# rows of each (image, source, plate) slot. Loading one image is then a slice
+# of memory-mapped arrays plus the few journal events since the last compaction.
+#
+# Besides points, the journal records the sessions of each (image, source):
+# plates started (so an empty plate keeps its place when a session is
+# resumed), sessions finished by the operator and resets that start over.
+#
+# Layout of the store directory:
+#   journal.jsonl     events since the last compaction
+#   CURRENT           name of the current compacted generation
+#   gen-<seq>/        columns, offsets.npy, images.json, sessions.json and meta.json
+class AnnotationStore:
+    def __init__(self, path=store_path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.journal_path = os.path.join(path, "journal.jsonl")
+        self._open_generation()
+        self._read_journal()
+        self.journal = open(self.journal_path, "a")
+
+    # Memory-map the current compacted generation, if there is one
+    def _open_generation(self):
+        self.generation = None
+        self.last_seq = 0
+        self.images = []
+        self.image_ids = {}
+        self.arrays = None
+        self.offsets = None
+        self.sessions = {}  # image -> {source: [plates started, finished]}
+        current_path = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current_path):
+            return
+        with open(current_path) as f:
+            self.generation = f.read().strip()
+        generation_path = os.path.join(self.path, self.generation)
+        with open(os.path.join(generation_path, "meta.json")) as f:
+            self.last_seq = json.load(f)["last_seq"]
+        with open(os.path.join(generation_path, "images.json")) as f:
+            self.images = json.load(f)
+        self.image_ids = {image: i for i, image in enumerate(self.images)}
+        sessions_path = os.path.join(generation_path, "sessions.json")
+        if os.path.exists(sessions_path):  # Generations written before sessions were recorded have none
+            with open(sessions_path) as f:
+                self.sessions = json.load(f)
+        self.arrays = {name: np.load(os.path.join(generation_path, name + ".npy"), mmap_mode="r") for name in columns}
+        self.offsets = np.load(os.path.join(generation_path, "offsets.npy"), mmap_mode="r")
+
+    # Read the journal events that are not in the compacted generation yet.
+    # Events already compacted (a crash between compaction and journal reset)
+    # and a torn last line are ignored.
+    def _read_journal(self):
+        self.tail = defaultdict(list)  # image -> events
+        self.tail_count = 0
+        self.next_seq = self.last_seq + 1
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event["seq"] <= self.last_seq:
+                    continue
+                self.tail[event["image"]].append(event)
+                self.tail_count += 1
+                self.next_seq = max(self.next_seq, event["seq"] + 1)
+
+    def _write(self, event):
+        event["seq"] = self.next_seq
+        self.next_seq += 1
+        self.journal.write(json.dumps(event) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.tail[event["image"]].append(event)
+        self.tail_count += 1
+
+    @staticmethod
+    def _check(source, plate=None, annotation_type=None):
+        if source not in sources:
+            raise ValueError(f"Unknown source {source!r}")
+        if plate is not None and not 0 <= plate < max_plates:
+            raise ValueError(f"Plate index {plate} out of range")
+        if annotation_type is not None and annotation_type not in annotation_types:
+            raise ValueError(f"Unknown annotation type {annotation_type!r}")
+
+    # Record a point
+    def append(self, image, source, plate, annotation_type, x, y):
+        self._check(source, plate, annotation_type)
+        self._write({"image": image, "source": source, "plate": plate, "type": annotation_type,
+                     "x": _number(x), "y": _number(y)})
+
+    # Remove the points of one annotation type of a plate (e.g. a baseline that is re-clicked)
+    def clear(self, image, source, plate, annotation_type):
+        self._check(source, plate, annotation_type)
+        self._write({"image": image, "source": source, "plate": plate, "type": annotation_type, "clear": True})
+
+    # Record that the operator started a plate, before any point is clicked
+    def start_plate(self, image, source, plate):
+        self._check(source, plate)
+        self._write({"image": image, "source": source, "plate": plate, "start": True})
+
+    # Mark the session of an image finished (the operator quit with 'q'); it is not resumed
+    def finish(self, image, source):
+        self._check(source)
+        self._write({"image": image, "source": source, "finish": True})
+
+    # Remove all annotations of an image, to start a new session over a finished one
+    def reset(self, image, source):
+        self._check(source)
+        self._write({"image": image, "source": source, "reset": True})
+
+    # Session of an image: (plates started, whether the session was finished)
+    def session(self, image, source="uv"):
+        plates, finished = self.sessions.get(image, {}).get(source, (0, False))
+        for event in self.tail.get(image, []):
+            if event["source"] != source:
+                continue
+            if event.get("reset"):
+                plates, finished = 0, False
+            elif event.get("finish"):
+                finished = True
+            else:
+                plates = max(plates, event["plate"] + 1)
+        return plates, finished
+
+    # Compacted points of one (image, source, plate) slot as (type, x, y) lists
+    def _compacted(self, image_id, source_code, plate):
+        slot = image_id * slots_per_image + source_code * max_plates + plate
+        start, stop = int(self.offsets[slot]), int(self.offsets[slot + 1])
+        return list(zip(self.arrays["type"][start:stop].tolist(),
+                        self.arrays["x"][start:stop].tolist(),
+                        self.arrays["y"][start:stop].tolist()))
+
+    # Apply journal events to per-plate point lists {plate: [(type, x, y)]}
+    @staticmethod
+    def _apply(points, events, source):
+        for event in events:
+            if event["source"] != source or event.get("finish"):
+                continue
+            if event.get("reset"):
+                for plate_points in points.values():
+                    plate_points.clear()
+                continue
+            plate_points = points.setdefault(event["plate"], [])
+            if event.get("start"):
+                continue
+            type_code = annotation_types.index(event["type"])
+            if event.get("clear"):
+                plate_points[:] = [p for p in plate_points if p[0] != type_code]
+            else:
+                plate_points.append((type_code, event["x"], event["y"]))
+
+    # Annotations of one image in the uvclick format: a list of plate dicts
+    def load(self, image, source="uv"):
+        source_code = sources.index(source)
+        points = {}
+        image_id = self.image_ids.get(image)
+        if image_id is not None:
+            for plate in range(max_plates):
+                plate_points = self._compacted(image_id, source_code, plate)
+                if plate_points:
+                    points[plate] = plate_points
+        self._apply(points, self.tail.get(image, []), source)
+
+        # Plates started but still empty count too, so the plates after them keep their index
+        points = {plate: plate_points for plate, plate_points in points.items() if plate_points}
+        plate_count = max(self.session(image, source)[0], max(points, default=-1) + 1)
+        plates = [{"baseline": [], "solvent_line": [], "spots": []} for _ in range(plate_count)]
+        for plate, plate_points in points.items():
+            for type_code, x, y in plate_points:
+                plates[plate][annotation_types[type_code]].append((_number(x), _number(y)))
+        return plates
+
+    # Names of all images in the store
+    def image_names(self):
+        names = list(self.images)
+        names.extend(image for image in self.tail if image not in self.image_ids)
+        return names
+
+    # Fold the journal into a new compacted generation
+    def compact(self):
+        if not self.tail_count:
+            return
+        images = list(self.images)
+        image_ids = dict(self.image_ids)
+        for image in self.tail:
+            if image not in image_ids:
+                image_ids[image] = len(images)
+                images.append(image)
+
+        # Slots touched by the journal are rebuilt; the rest are copied as they are
+        touched = {}
+        for image, events in self.tail.items():
+            image_id = image_ids[image]
+            for source_code, source in enumerate(sources):
+                points = {}
+                if image in self.image_ids:
+                    source_events = [e for e in events if e["source"] == source]
+                    if any(e.get("reset") for e in source_events):
+                        plates = range(max_plates)
+                    else:
+                        plates = {e["plate"] for e in source_events if "plate" in e}
+                    for plate in plates:
+                        points[plate] = self._compacted(image_id, source_code, plate)
+                self._apply(points, events, source)
+                for plate, plate_points in points.items():
+                    touched[image_id * slots_per_image + source_code * max_plates + plate] = plate_points
+
+        if self.arrays is not None:
+            old = {name: np.asarray(array) for name, array in self.arrays.items()}
+            slot = old["image"].astype(np.int64) * slots_per_image + old["source"] * max_plates + old["plate"]
+            keep = ~np.isin(slot, np.fromiter(touched, dtype=np.int64, count=len(touched)))
+            parts = {name: [array[keep]] for name, array in old.items()}
+        else:
+            parts = {name: [] for name in columns}
+        for slot, plate_points in touched.items():
+            count = len(plate_points)
+            image_id, rest = divmod(slot, slots_per_image)
+            source_code, plate = divmod(rest, max_plates)
+            parts["image"].append(np.full(count, image_id))
+            parts["source"].append(np.full(count, source_code))
+            parts["plate"].append(np.full(count, plate))
+            parts["type"].append(np.array([p[0] for p in plate_points]))
+            parts["x"].append(np.array([p[1] for p in plate_points], dtype=np.float64))
+            parts["y"].append(np.array([p[2] for p in plate_points], dtype=np.float64))
+        sessions = {image: dict(image_sessions) for image, image_sessions in self.sessions.items()}
+        for image in self.tail:
+            image_sessions = {source: self.session(image, source) for source in sources}
+            sessions[image] = {source: list(session) for source, session in image_sessions.items()
+                               if session != (0, False)}
+        sessions = {image: image_sessions for image, image_sessions in sessions.items() if image_sessions}
+        arrays = {name: np.concatenate(parts[name]).astype(dtype) if parts[name] else np.empty(0, dtype)
+                  for name, dtype in columns.items()}
+
+        # Sort by slot; the stable sort keeps the click order within a slot
+        slot = arrays["image"].astype(np.int64) * slots_per_image + arrays["source"] * max_plates + arrays["plate"]
+        order = np.argsort(slot, kind="stable")
+        arrays = {name: array[order] for name, array in arrays.items()}
+        offsets = np.searchsorted(slot[order], np.arange(len(images) * slots_per_image + 1)).astype(np.int64)
+
+        # Write the new generation, switch CURRENT to it, then reset the journal
+        last_seq = self.next_seq - 1
+        generation = f"gen-{last_seq}"
+        generation_path = os.path.join(self.path, generation)
+        os.makedirs(generation_path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(generation_path, name + ".npy"), array)
+        np.save(os.path.join(generation_path, "offsets.npy"), offsets)
+        with open(os.path.join(generation_path, "images.json"), "w") as f:
+            json.dump(images, f)
+        with open(os.path.join(generation_path, "sessions.json"), "w") as f:
+            json.dump(sessions, f)
+        with open(os.path.join(generation_path, "meta.json"), "w") as f:
+            json.dump({"last_seq": last_seq, "max_plates": max_plates}, f)
+        current_tmp = os.path.join(self.path, "CURRENT.tmp")
+        with open(current_tmp, "w") as f:
+            f.write(generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_tmp, os.path.join(self.path, "CURRENT"))
+
+        old_generation = self.generation
+        self.journal.close()
+        self.journal = open(self.journal_path, "w")
+        self.arrays = None
+        self._open_generation()
+        self.tail = defaultdict(list)
+        self.tail_count = 0
+        if old_generation and old_generation != self.generation:
+            shutil.rmtree(os.path.join(self.path, old_generation), ignore_errors=True)
+
+    def close(self, compact=None):
+        if compact or (compact is None and self.tail_count >= auto_compact_events):
+            self.compact()
+        self.journal.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the annotation store.")
+    parser.add_argument("command", choices=["compact", "export", "show"], help="compact the journal, export all images as JSON lines, or show one image")
+    parser.add_argument("image", nargs="?", help="Image to show")
+    parser.add_argument("--store", default=store_path, help="Store directory")
+    args = parser.parse_args()
+
+    store = AnnotationStore(args.store)
+    if args.command == "compact":
+        count = store.tail_count
+        store.compact()
+        print(f"Compacted {count} journal events into {store.generation}")
+    elif args.command == "export":
+        # Same records as spotdetect.py writes, readable by replay.py
+        for image in store.image_names():
+            record = {"image": image, "uv": store.load(image, "uv"), "stain": store.load(image, "stain")}
+            sys.stdout.write(json.dumps(record) + "\n")
+    elif args.command == "show":
+        print(json.dumps({"uv": store.load(args.image, "uv"), "stain": store.load(args.image, "stain")}, indent=2))
+    store.close(compact=False)
+
+
+if __name__ == "__main__":
+    main()
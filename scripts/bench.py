@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import tempfile
+
+import cv2
+import numpy as np
+
+import ratios
+import replay
+import synthtlc
+import tlcconfig
+import foldersort
+import spotdetect
+from segment import PlateSegmenter
+
+# Batch sizes (images) for the ratio benchmark
+ratio_batch_sizes = (1, 10, 100, 1000, 10000)
+
+# Repetitions of each image stage; the first pass only warms up
+repeats = 3
+
+
+# Latency summary of one stage: n timings (seconds), each covering `items` images
+def summarize(stage, times, items=1):
+    times = np.asarray(times)
+    total = times.sum()
+    return {
+        "stage": stage,
+        "n": int(times.size),
+        "items": items,
+        "mean_ms": round(float(times.mean()) * 1000, 3),
+        "p50_ms": round(float(np.percentile(times, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(times, 95)) * 1000, 3),
+        "images_per_s": round(times.size * items / total, 1) if total > 0 else float("inf"),
+    }
+
+
+# Time fn() once per item of `items`, `repeats` times, skipping the first (warm-up) pass
+def time_each(fn, items, repeats=repeats):
+    times = []
+    for rep in range(repeats):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            if rep > 0 or repeats == 1:
+                times.append(time.perf_counter() - start)
+    return times
+
+
+# Classification as done by foldersort.py: full decode versus reduced decode plus mean
+def bench_classify(paths):
+    return [
+        summarize("decode_full", time_each(cv2.imread, paths)),
+        summarize("classify", time_each(lambda p: foldersort.classify(foldersort.mean_intensity(p)), paths)),
+    ]
+
+
+# The segmentation steps of imageprocess.py / segment.py, one at a time, then whole
+def bench_segment(images):
+    segmenter = PlateSegmenter()
+    segmenter._allocate(images[0].shape[:2])
+    steps = [
+        ("segment.mask", segmenter._mask),
+        ("segment.gray", segmenter._gray),
+        ("segment.regions", lambda image: segmenter._regions()),
+        # Edges and contours are only drawn by imageprocess.py, not used by segment()
+        ("segment.equalize", lambda image: segmenter._equalize()),
+        ("segment.edges", lambda image: segmenter._edges()),
+        ("segment.contours", lambda image: segmenter._contours()),
+    ]
+    results = []
+    for stage, step in steps:
+        # Each step reads the buffers of the previous ones, so they are filled in order
+        results.append(summarize(stage, time_each(step, images)))
+    results.append(summarize("segment.total", time_each(segmenter.segment, images)))
+    return results
+
+
+def bench_annotate(images):
+    return [summarize("annotate", time_each(spotdetect.annotate_image, images))]
+
+
+# Ratio calculation for batches of images: uvclick's per-image call in a loop
+# versus the batched engine used by replay.py
+def bench_ratios(truths, sizes=ratio_batch_sizes):
+    pixels_to_cm = tlcconfig.pixels_to_cm_uv
+    results = []
+    for size in sizes:
+        records = [{"image": str(i), "uv": truths[i % len(truths)]["uv"], "stain": []} for i in range(size)]
+        reps = max(1, min(repeats, 10000 // size))
+        loop_times, batch_times = [], []
+        for _ in range(reps):
+            start = time.perf_counter()
+            for record in records:
+                ratios.calculate_ratios_single(record["uv"], pixels_to_cm)
+            loop_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in replay.replay_batch(records, pixels_to_cm):
+                pass
+            batch_times.append(time.perf_counter() - start)
+        results.append(summarize(f"ratios.loop[{size}]", loop_times, size))
+        results.append(summarize(f"ratios.batch[{size}]", batch_times, size))
+    return results
+
+
+# Detection accuracy against the ground truth: plates found, baseline and
+# solvent front row errors (px) and the share of plates with the right spot count
+def accuracy(images, truths):
+    found = 0
+    line_errors = []
+    spot_counts = []
+    for image, truth in zip(images, truths):
+        try:
+            _, annotations = spotdetect.annotate_image(image)
+        except ValueError:
+            continue
+        found += 1
+        for detected, plate, expected in zip(annotations, truth["plates"], truth["uv"]):
+            line_errors.append((abs(detected["baseline"][0][1] - plate["baseline_y"]),
+                                abs(detected["solvent_line"][0][1] - plate["solvent_y"])))
+            spot_counts.append(len(detected["spots"]) == len(expected["spots"]))
+    line_errors = np.array(line_errors, dtype=float).reshape(-1, 2)
+    return {
+        "segmented": f"{found}/{len(images)}",
+        "baseline_error_px": round(float(line_errors[:, 0].mean()), 2) if found else None,
+        "solvent_error_px": round(float(line_errors[:, 1].mean()), 2) if found else None,
+        "spot_count_exact": round(float(np.mean(spot_counts)), 3) if found else None,
+    }
+
+
+def print_table(results, previous=None):
+    previous = {r["stage"]: r for r in previous or []}
+    print(f"{'stage':24} {'n':>6} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'images/s':>12}"
+          + ("   vs previous" if previous else ""))
+    for r in results:
+        line = (f"{r['stage']:24} {r['n']:6d} {r['mean_ms']:10.3f} {r['p50_ms']:10.3f} "
+                f"{r['p95_ms']:10.3f} {r['images_per_s']:12.1f}")
+        if r["stage"] in previous:
+            line += f"   {previous[r['stage']]['mean_ms'] / r['mean_ms']:.2f}x" if r["mean_ms"] else ""
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic captures.")
+    parser.add_argument("--data", default=None, help="Folder written by synthtlc.py (default: generate a temporary one)")
+    parser.add_argument("--count", type=int, default=20, help="Capture pairs to generate")
+    parser.add_argument("--width", type=int, default=synthtlc.image_size[0])
+    parser.add_argument("--height", type=int, default=synthtlc.image_size[1])
+    parser.add_argument("--noise", type=float, default=4.0)
+    parser.add_argument("--stages", default="classify,segment,annotate,ratios",
+                        help="Comma-separated stage groups to run")
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        data = args.data
+        if data is None:
+            data = stack.enter_context(tempfile.TemporaryDirectory())
+            synthtlc.write_dataset(data, args.count, args.width, args.height, args.noise)
+        with open(os.path.join(data, "truth.jsonl")) as f:
+            truths = [json.loads(line) for line in f if line.strip()]
+        uv_paths = sorted(os.path.join(data, f) for f in os.listdir(data) if f.startswith("uv_"))
+        paths = sorted(os.path.join(data, f) for f in os.listdir(data) if f.lower().endswith(foldersort.image_extensions))
+        images = [cv2.imread(path) for path in uv_paths]
+        print(f"{len(uv_paths)} capture pairs, {images[0].shape[1]}x{images[0].shape[0]}", file=sys.stderr)
+
+        stages = args.stages.split(",")
+        results = []
+        if "classify" in stages:
+            results += bench_classify(paths)
+        if "segment" in stages:
+            results += bench_segment(images)
+        if "annotate" in stages:
+            results += bench_annotate(images)
+        if "ratios" in stages:
+            results += bench_ratios(truths)
+        quality = accuracy(images, truths)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["stages"]
+    print_table(results, previous)
+    print("accuracy: " + ", ".join(f"{k}={v}" for k, v in quality.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"stages": results, "accuracy": quality}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import replay
+import instrument
+import tlcconfig
+import foldersort
+import spotdetect
+from segment import plates_to_dicts
+from register import register, min_correlation
+
+# Pair buffers: the camera fills one while the previous pair is processed
+buffer_count = 2
+
+# Seconds between frames of the directory replay source (0: as fast as the files decode)
+replay_interval = 0.0
+
+
+# OpenCV capture device. The UV and normal-light exposures of a pair are two
+# consecutive frames; the rig switches the lamps between them.
+class CameraSource:
+    def __init__(self, device=0, width=None, height=None):
+        self.device = device
+        self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open camera {device}")
+        if width:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.count = 0
+
+    # Grab the next frame into `frame` when it has the right size (no new
+    # allocation). Returns (name, frame), or None when the device stops.
+    def read(self, frame=None):
+        ok, frame = self.capture.read(frame)
+        if not ok:
+            return None
+        self.count += 1
+        return f"camera{self.device}_{self.count:06d}.png", frame
+
+    def close(self):
+        self.capture.release()
+
+
+# Order of replayed files: by the numbers in the name, so the two captures of
+# a pair (uv_00001.jpg, stain_00001.jpg) are consecutive, then by name
+def _capture_order(filename):
+    return [int(n) for n in re.findall(r"\d+", filename)], filename
+
+
+# Replays the captures of a folder as a stand-in for the camera when testing
+# (e.g. on the output of synthtlc.py)
+class DirectorySource:
+    def __init__(self, folder, interval=replay_interval):
+        filenames = [f for f in os.listdir(folder) if f.lower().endswith(foldersort.image_extensions)]
+        self.paths = [os.path.join(folder, f) for f in sorted(filenames, key=_capture_order)]
+        self.interval = interval
+        self.index = 0
+        self.last_read = 0.0
+
+    def read(self, frame=None):
+        while self.index < len(self.paths):
+            path = self.paths[self.index]
+            self.index += 1
+            if self.interval:
+                time.sleep(max(0.0, self.last_read + self.interval - time.monotonic()))
+                self.last_read = time.monotonic()
+            image = cv2.imread(path)
+            if image is None:
+                print(f"{os.path.basename(path)}: could not load image. Skipping...")
+                continue
+            if frame is not None and frame.shape == image.shape:
+                np.copyto(frame, image)
+                image = frame
+            return os.path.basename(path), image
+        return None
+
+    def close(self):
+        pass
+
+
+# One UV/normal-light pair. The frame arrays are reused from pair to pair.
+class PairBuffer:
+    def __init__(self):
+        self.names = [None, None]
+        self.frames = [None, None]
+        self.captured = 0.0
+
+
+# Capture thread: read one frame of the source into a buffer slot
+def read_frame(source, buffer, i):
+    with instrument.stage("capture") as stage:
+        item = source.read(buffer.frames[i])
+        if item is not None:
+            stage.set_image(item[1])
+    if item is None:
+        return False
+    buffer.names[i], buffer.frames[i] = item
+    return True
+
+
+# Stain annotations on the plates found in the UV capture. The stain frame
+# must be in UV coordinates; baselines and fronts are taken from UV.
+def stain_spots(stain_frame, plates, annotations_uv):
+    annotations = []
+    for plate, uv_plate in zip(plates, annotations_uv):
+        roi = plate.crop(stain_frame)
+        baseline_y = uv_plate["baseline"][0][1] - plate.y
+        solvent_y = uv_plate["solvent_line"][0][1] - plate.y
+        with instrument.stage("spots", roi):
+            spots = spotdetect.detect_spots(roi, baseline_y, solvent_y, plate.mask)
+        annotations.append({
+            "baseline": list(uv_plate["baseline"]),
+            "solvent_line": list(uv_plate["solvent_line"]),
+            "spots": [(sx + plate.x, sy + plate.y) for sx, sy in spots],
+        })
+    return annotations
+
+
+# Stain annotations of a pair on the plates of its UV frame. The stain frame
+# has no green plates to segment: it is registered onto the UV frame and its
+# spots are searched on the UV plates, between the UV lines. Without a
+# registration the frames are taken as aligned (as on a fixed rig), after
+# resizing the stain frame to the UV frame when their sizes differ. Returns
+# the annotations, the stain-to-UV transform (None when registration failed)
+# and the stain frame in UV coordinates.
+def register_stain(uv_frame, stain_frame, plates, annotations_uv):
+    try:
+        registration = register(uv_frame, stain_frame)
+    except (ValueError, cv2.error):
+        registration = None
+    stain_to_uv = None
+    if registration is not None and registration.correlation >= min_correlation:
+        stain_to_uv = registration.stain_to_uv
+        with instrument.stage("warp", stain_frame):
+            stain_frame = cv2.warpAffine(stain_frame, stain_to_uv, uv_frame.shape[1::-1])
+    elif stain_frame.shape[:2] != uv_frame.shape[:2]:
+        stain_frame = cv2.resize(stain_frame, uv_frame.shape[1::-1], interpolation=cv2.INTER_AREA)
+    return stain_spots(stain_frame, plates, annotations_uv), stain_to_uv, stain_frame
+
+
+# Processing thread: classify both frames in memory, annotate the UV frame
+# and the spots of the stain frame. Returns the record of the pair.
+def process_pair(buffer, threshold, save=False):
+    means = [foldersort.frame_intensity(frame) for frame in buffer.frames]
+    labels = [foldersort.classify(mean, threshold) for mean in means]
+    record = {"image": buffer.names[0], "pair": list(buffer.names), "means": means, "labels": labels}
+    if save:
+        for name, frame, label in zip(buffer.names, buffer.frames, labels):
+            target_folder = foldersort.uv_folder if label == "uv" else foldersort.stain_folder
+            with instrument.stage("export", frame):
+                cv2.imwrite(os.path.join(target_folder, name), frame)
+    if sorted(labels) != ["stain", "uv"]:
+        record["error"] = f"pair has no UV/stain split (both {labels[0]})"
+        return record
+
+    uv_frame, stain_frame = buffer.frames if labels[0] == "uv" else buffer.frames[::-1]
+    record["image"] = buffer.names[labels.index("uv")]
+    try:
+        plates, annotations_uv = spotdetect.annotate_image(uv_frame)
+    except ValueError as e:
+        record["error"] = str(e)
+        return record
+    record["plates"] = plates_to_dicts(plates)
+    record["uv"] = annotations_uv
+
+    # A pair whose stain frame could not be registered is flagged, so its
+    # stain spots can be checked
+    annotations_stain, stain_to_uv, _ = register_stain(uv_frame, stain_frame, plates, annotations_uv)
+    if stain_to_uv is not None:
+        record["stain_to_uv"] = stain_to_uv.tolist()
+    else:
+        record["registration_failed"] = True
+    record["stain"] = annotations_stain
+
+    with contextlib.redirect_stdout(sys.stderr):
+        for _, results, error in replay.replay_batch([{"image": record["image"], "uv": annotations_uv,
+                                                        "stain": annotations_stain}], tlcconfig.pixels_to_cm_uv):
+            record["results"] = [result for _, result in results]
+            if error:
+                record["error"] = error
+    return record
+
+
+# Acquire pairs into free buffers until the source ends, `stop` is set or
+# `max_pairs` pairs have been captured. A None in `filled` ends the processing.
+async def capture_pairs(source, reader, free, filled, stop, max_pairs=None):
+    loop = asyncio.get_running_loop()
+    count = 0
+    while not stop.is_set() and (max_pairs is None or count < max_pairs):
+        buffer = await free.get()
+        complete = True
+        for i in range(2):
+            complete = await loop.run_in_executor(reader, read_frame, source, buffer, i)
+            if not complete:
+                break
+        if not complete:
+            break
+        buffer.captured = time.perf_counter()
+        await filled.put(buffer)
+        count += 1
+    await filled.put(None)
+
+
+# Process filled buffers one at a time and return each to the free queue
+# as soon as its frames are no longer needed. A pair that raises is written
+# as an error record and the next pairs are still processed.
+async def process_pairs(worker, free, filled, out, threshold, save, latencies):
+    loop = asyncio.get_running_loop()
+    while True:
+        buffer = await filled.get()
+        if buffer is None:
+            return
+        names = list(buffer.names)
+        try:
+            record = await loop.run_in_executor(worker, process_pair, buffer, threshold, save)
+        except Exception as e:
+            record = {"image": names[0], "pair": names, "error": str(e)}
+        finally:
+            free.put_nowait(buffer)
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+        latencies.append(time.perf_counter() - buffer.captured)
+        status = record.get("error") or f"{len(record.get('results', []))} plates"
+        if record.get("registration_failed"):
+            status += " (stain not registered)"
+        print(f"{record['image']}: {status}")
+
+
+async def _run(source, out, threshold, save, max_pairs):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    with contextlib.suppress(NotImplementedError):
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    free, filled = asyncio.Queue(), asyncio.Queue()
+    for _ in range(buffer_count):
+        free.put_nowait(PairBuffer())
+    latencies = []
+    # One thread owns the device and one processes, so capture never waits for
+    # processing unless both buffers are full
+    with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as worker:
+        await asyncio.gather(capture_pairs(source, reader, free, filled, stop, max_pairs),
+                             process_pairs(worker, free, filled, out, threshold, save, latencies))
+    return latencies
+
+
+# Capture and process pairs from a source; returns the capture-to-record
+# latency of each pair
+def run(source, out, threshold=foldersort.uv_threshold, save=False, max_pairs=None):
+    try:
+        return asyncio.run(_run(source, out, threshold, save, max_pairs))
+    finally:
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture UV/normal-light pairs and annotate them as they are acquired.")
+    parser.add_argument("--camera", type=int, default=0, help="OpenCV camera index")
+    parser.add_argument("--replay", default=None, help="Replay the captures of a folder instead of using the camera")
+    parser.add_argument("--interval", type=float, default=replay_interval, help="Seconds between replayed frames")
+    parser.add_argument("--width", type=int, default=None, help="Camera frame width")
+    parser.add_argument("--height", type=int, default=None, help="Camera frame height")
+    parser.add_argument("--pairs", type=int, default=None, help="Stop after this many pairs")
+    parser.add_argument("--threshold", type=float, default=foldersort.uv_threshold, help="Mean intensity below which an image is UV")
+    parser.add_argument("--save", action="store_true", help="Also save the frames into the sorted UV and stain folders")
+    parser.add_argument("--output", default="./annotations/capture.jsonl", help="JSON lines output")
+    args = parser.parse_args()
+
+    if args.replay:
+        source = DirectorySource(args.replay, args.interval)
+    else:
+        source = CameraSource(args.camera, args.width, args.height)
+    if args.save:
+        os.makedirs(foldersort.uv_folder, exist_ok=True)
+        os.makedirs(foldersort.stain_folder, exist_ok=True)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+
+    print("Capturing pairs. Press Ctrl+C to stop.")
+    start = time.perf_counter()
+    with open(args.output, "a") as out:
+        latencies = run(source, out, args.threshold, args.save, args.pairs)
+    elapsed = time.perf_counter() - start
+    if latencies:
+        latencies.sort()
+        print(f"Processed {len(latencies)} pairs in {elapsed:.1f} s ({len(latencies) / elapsed:.2f} pairs/s), "
+              f"latency p50 {latencies[len(latencies) // 2]:.2f} s, max {latencies[-1]:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
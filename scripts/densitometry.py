@@ -0,0 +1,186 @@
+import os
+import json
+import argparse
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import instrument
+import tlcconfig
+import foldersort
+import spotdetect
+from linedetect import profile_band
+from spotdetect import line_margin
+
+# Box smoothing of the lane profiles (pixels), against sensor noise
+smooth_size = 3
+
+# Width of the background estimate as a fraction of the longest lane: dips
+# narrower than this are spots, slower changes are plate background
+background_fraction = 0.25
+
+# Peaks lower than this many robust noise levels, or this many grey levels, are ignored
+min_snr = 4.0
+min_height = 2.0
+
+
+# Stack the lanes of all plates into one zero-padded array and reduce each
+# to a row profile with a single mean over the columns. A lane is the
+# central band of the plate (away from its edges) between the solvent front
+# and the baseline; the plate mask is not applied, since it leaves out the
+# dark spots themselves. Lines are (baseline_y, solvent_y) per plate in plate
+# rows. Returns the profiles (plates x rows), which rows belong to a lane,
+# and the plate row of the first profile row of each lane.
+def lane_profiles(gray, plates, lines):
+    boxes = []
+    for plate, (baseline_y, solvent_y) in zip(plates, lines):
+        top, bottom = sorted((int(round(solvent_y)), int(round(baseline_y))))
+        margin = int((bottom - top) * line_margin)
+        x0 = int(plate.w * (1 - profile_band) / 2)
+        boxes.append((top + margin, max(top + margin, bottom - margin), x0, max(x0 + 1, plate.w - x0)))
+    lengths = np.array([bottom - top for top, bottom, _, _ in boxes], dtype=np.int64)
+    widths = np.array([x1 - x0 for _, _, x0, x1 in boxes], dtype=np.float32)
+    stack = np.zeros((len(plates), max(lengths.max(initial=0), 1), int(widths.max(initial=1))), dtype=np.float32)
+    for p, (plate, (top, bottom, x0, x1)) in enumerate(zip(plates, boxes)):
+        stack[p, :bottom - top, :x1 - x0] = plate.crop(gray)[top:bottom, x0:x1]
+
+    profiles = stack.sum(axis=2) / widths[:, None]
+    valid = np.arange(stack.shape[1])[None, :] < lengths[:, None]
+    tops = np.array([top for top, _, _, _ in boxes], dtype=np.float64)
+    return profiles, valid, tops
+
+
+# Spot signal of the lane profiles: darkening below the local background.
+# The background is a grey closing of each profile (dips narrower than the
+# window are removed), computed for all lanes at once.
+def lane_signal(profiles, valid):
+    lanes = profiles.copy()
+    # Invalid rows take the lane's brightest level so they do not look like spots
+    fill = np.where(valid, lanes, -np.inf).max(axis=1, initial=0.0)
+    lanes[~valid] = np.broadcast_to(fill[:, None], lanes.shape)[~valid]
+
+    window = max(3, int(lanes.shape[1] * background_fraction)) | 1
+    smooth = cv2.blur(lanes, (smooth_size, 1), borderType=cv2.BORDER_REPLICATE)
+    background = cv2.morphologyEx(smooth, cv2.MORPH_CLOSE, np.ones((1, window), np.uint8),
+                                  borderType=cv2.BORDER_REPLICATE)
+    signal = np.maximum(background - smooth, 0)
+    signal[~valid] = 0
+    return signal
+
+
+# Peaks of the lane signals with sub-pixel positions (parabola through the
+# peak and its neighbours) and integrated areas (signal summed between the
+# minima on either side). Returns flat columns: lane, row, height, area.
+def find_peaks(signal, valid):
+    lanes, length = signal.shape
+    if length < 3:
+        return (np.empty(0, np.int64), np.empty(0), np.empty(0), np.empty(0))
+
+    # Robust noise level per lane from the median absolute deviation
+    masked = np.where(valid, signal, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # Lanes without plate pixels
+        median = np.nanmedian(masked, axis=1, keepdims=True)
+        noise = 1.4826 * np.nanmedian(np.abs(masked - median), axis=1, keepdims=True)
+    threshold = np.maximum(np.nan_to_num(median + min_snr * noise), min_height)
+
+    left, centre, right = signal[:, :-2], signal[:, 1:-1], signal[:, 2:]
+    is_peak = (centre > left) & (centre >= right) & (centre > threshold) & valid[:, 1:-1]
+    lane, index = np.nonzero(is_peak)
+    index = index + 1
+    a, b, c = signal[lane, index - 1], signal[lane, index], signal[lane, index + 1]
+    curvature = a - 2 * b + c
+    offset = np.divide(0.5 * (a - c), curvature, out=np.zeros_like(b), where=curvature < 0)
+    position = index + np.clip(offset, -0.5, 0.5)
+    height = b - 0.25 * (a - c) * offset
+
+    # Peak regions end at local minima, at zero signal and at the lane ends.
+    # With the lanes laid end to end, the nearest boundary on each side comes
+    # from a running maximum/minimum of the boundary indices.
+    boundary = np.zeros_like(valid)
+    boundary[:, 1:-1] = (centre <= left) & (centre < right)
+    boundary |= signal <= 0
+    boundary[:, 0] = boundary[:, -1] = True
+    flat = np.arange(signal.size).reshape(signal.shape)
+    lefts = np.maximum.accumulate(np.where(boundary, flat, 0).ravel())
+    rights = np.minimum.accumulate(np.where(boundary, flat, signal.size - 1).ravel()[::-1])[::-1]
+    cumulative = np.concatenate([[0.0], np.cumsum(signal.ravel(), dtype=np.float64)])
+    peak = flat[lane, index]
+    area = cumulative[rights[peak] + 1] - cumulative[lefts[peak]]
+    return lane, position, height, area
+
+
+# Densitometry of one capture: per plate, the peaks of its lane between the
+# baseline and solvent front with image y, Rf, distance, height and area
+# (grey levels x pixels) and their share of the lane's total area. Lines
+# come from uvclick-style annotations in image coordinates.
+def measure(image, plates, annotations, pixels_to_cm=tlcconfig.pixels_to_cm_uv):
+    with instrument.stage("densitometry", image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        lines = [(plate_annotations["baseline"][0][1] - plate.y, plate_annotations["solvent_line"][0][1] - plate.y)
+                 for plate, plate_annotations in zip(plates, annotations)]
+        profiles, valid, tops = lane_profiles(gray, plates, lines)
+        signal = lane_signal(profiles, valid)
+        lane, position, height, area = find_peaks(signal, valid)
+
+    lane_totals = np.bincount(lane, weights=area, minlength=len(plates))
+    results = []
+    for p, (plate, (baseline_y, solvent_y)) in enumerate(zip(plates, lines)):
+        front = baseline_y - solvent_y
+        peaks = []
+        for i in np.flatnonzero(lane == p):
+            y = tops[p] + position[i]
+            distance = baseline_y - y
+            peaks.append({
+                "y": round(float(y + plate.y), 2),
+                "distance_cm": round(float(distance * pixels_to_cm), 3),
+                "rf": round(float(distance / front), 3) if front else None,
+                "height": round(float(height[i]), 1),
+                "area": round(float(area[i]), 1),
+                "area_percent": round(float(100 * area[i] / lane_totals[p]), 1) if lane_totals[p] else 0.0,
+            })
+        # Nearest the baseline first, like the components of the ratio results
+        peaks.sort(key=lambda peak: peak["distance_cm"])
+        results.append({"plate": plate.name, "x": plate.x + plate.w // 2, "peaks": peaks})
+    return results
+
+
+# Worker task: detect the plates and lines of one image and measure its lanes
+def process_file(image_path):
+    with instrument.stage("decode") as stage:
+        image = cv2.imread(image_path)
+        stage.set_image(image)
+    if image is None:
+        return image_path, None, "could not load image"
+    try:
+        plates, annotations = spotdetect.annotate_image(image)
+    except ValueError as e:
+        return image_path, None, str(e)
+    return image_path, measure(image, plates, annotations), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lane densitometry: sub-pixel spot positions and integrated areas per plate.")
+    parser.add_argument("input", help="Folder with captures")
+    parser.add_argument("--output", default="./annotations/densitometry.jsonl", help="JSON lines output")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    paths = sorted(os.path.join(args.input, f) for f in os.listdir(args.input)
+                   if f.lower().endswith(foldersort.image_extensions))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, open(args.output, "w") as out:
+        for image_path, plates, error in pool.map(process_file, paths):
+            filename = os.path.basename(image_path)
+            if error is not None:
+                print(f"{filename}: {error}. Skipping...")
+                continue
+            out.write(json.dumps({"image": image_path, "plates": plates}) + "\n")
+            print(f"{filename}: {sum(len(p['peaks']) for p in plates)} peaks on {len(plates)} plates")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,89 @@
 #image processing
-import cv2
-import numpy as np
-import matplotlib.pyplot as plt
-from skimage.filters import threshold_otsu
-
-# Load the image
-image_path = './images/TLC1.png'  # Ensure this is the correct path
-image = cv2.imread(image_path)
-
-# Convert the image to the HSV color space
-hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-# Define the refined range for detecting low green pixels (TLC plates)
-lower_green = np.array([35, 30, 30])  # Adjust for clearer low green
-upper_green = np.array([85, 255, 255])  # Define the upper boundary for green
-
-# Create a mask for the TLC plate (low green pixels)
-plate_mask = cv2.inRange(hsv_image, lower_green, upper_green)
-
-# Apply morphological operations to clean up the mask
-kernel = np.ones((3, 3), np.uint8)
-plate_mask = cv2.morphologyEx(plate_mask, cv2.MORPH_CLOSE, kernel)  # Fill small holes
-plate_mask = cv2.morphologyEx(plate_mask, cv2.MORPH_OPEN, kernel)   # Remove small noise
-
-# Enhance contrast using adaptive histogram equalization on the masked area
-gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-equalized_image = cv2.equalizeHist(gray_image)
-masked_equalized = cv2.bitwise_and(equalized_image, equalized_image, mask=plate_mask)
-
-# Apply edge detection (try Canny on contrast-enhanced image)
-edges = cv2.Canny(masked_equalized, 50, 150)
+import os
+import argparse
 
-# Find contours based on the edges detected
-contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-# Draw white contours (lines) on the original image
-image_with_contours = image.copy()
-cv2.drawContours(image_with_contours, contours, -1, (255, 255, 255), 2)  # White color, thickness=2
-
-# Convert BGR to RGB for displaying with matplotlib
-image_with_contours_rgb = cv2.cvtColor(image_with_contours, cv2.COLOR_BGR2RGB)
-
-# Plotting the results
-plt.figure(figsize=(10, 5))
-
-# Display the original image with white lines around contours
-plt.subplot(1, 2, 1)
-plt.imshow(image_with_contours_rgb)
-plt.title('TLC Plates with White Line Contours')
-plt.axis('off')
-
-# Display the dilated edges detected
-plt.subplot(1, 2, 2)
-plt.imshow(edges, cmap='gray')
-plt.title('Detected Edges')
-plt.axis('off')
-
-# Show all plots
-plt.tight_layout()
-plt.show()
-
-# Optionally, save the final image with contours
-cv2.imwrite('/mnt/data/tlc_white_line_contours_enhanced.jpg', image_with_contours)
+import cv2
 
+import instrument
+from segment import PlateSegmenter
+from stagecache import StageCache
+
+
+# Show the contours and edges side by side. matplotlib is imported here so
+# headless runs (--no-show) do not pay for it.
+def show_results(image_with_contours, edges):
+    import matplotlib.pyplot as plt
+
+    # Convert BGR to RGB for displaying with matplotlib
+    image_with_contours_rgb = cv2.cvtColor(image_with_contours, cv2.COLOR_BGR2RGB)
+
+    # Plotting the results
+    plt.figure(figsize=(10, 5))
+
+    # Display the original image with white lines around contours
+    plt.subplot(1, 2, 1)
+    plt.imshow(image_with_contours_rgb)
+    plt.title('TLC Plates with White Line Contours')
+    plt.axis('off')
+
+    # Display the dilated edges detected
+    plt.subplot(1, 2, 2)
+    plt.imshow(edges, cmap='gray')
+    plt.title('Detected Edges')
+    plt.axis('off')
+
+    # Show all plots
+    plt.tight_layout()
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect the plates of one capture and show their contours and edges.")
+    parser.add_argument("image", nargs="?", default='./images/TLC1.png', help="Capture to process")
+    parser.add_argument("--output", default='./output/tlc_white_line_contours_enhanced.jpg',
+                        help="Where to save the image with contours")
+    parser.add_argument("--no-show", action="store_true", help="Only save the result (no matplotlib window)")
+    args = parser.parse_args()
+
+    # Load the image
+    with instrument.stage("decode") as stage:
+        image = cv2.imread(args.image)
+        stage.set_image(image)
+    if image is None:
+        print(f"Error: Could not load image at {args.image}")
+        return
+
+    # HSV mask, morphology and plate boxes, then the equalized Canny edges and
+    # contours drawn below (see segment.py). Stage outputs are cached, so
+    # re-running after changing only the Canny thresholds in tlcconfig.py
+    # reuses the plate mask and regions.
+    cache = StageCache()
+    segmenter = PlateSegmenter(cache=cache)
+    try:
+        plates = segmenter.segment(image)
+    except ValueError as e:
+        print(f"Plate detection failed: {e}")
+        plates = []
+    contours = segmenter.detect_edges()
+    edges = segmenter.edges
+    cache.print_report()
+
+    # Report the plate boxes, left to right
+    for plate in plates:
+        print(f"Plate {plate.name}: x={plate.x}, y={plate.y}, w={plate.w}, h={plate.h}")
+
+    # Draw white contours (lines) on the original image
+    image_with_contours = image.copy()
+    cv2.drawContours(image_with_contours, contours, -1, (255, 255, 255), 2)  # White color, thickness=2
+
+    if not args.no_show:
+        show_results(image_with_contours, edges)
+
+    # Optionally, save the final image with contours
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with instrument.stage("export", image_with_contours):
+        cv2.imwrite(args.output, image_with_contours)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+# Profiling is off unless TLC_PROFILE names a JSON lines file, e.g.
+#   TLC_PROFILE=./profile.jsonl python scripts/imageprocess.py
+# Every process (including pool workers) appends its stage records to that
+# file as they complete. TLC_PROFILE_MEMORY=0 skips the peak memory tracking
+# (tracemalloc), which slows down Python-level allocations.
+profile_path = os.environ.get("TLC_PROFILE") or None
+track_memory = os.environ.get("TLC_PROFILE_MEMORY", "1") != "0"
+
+
+# Shared do-nothing context returned by stage() when profiling is off
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_image(self, image):
+        pass
+
+
+_null_stage = _NullStage()
+_open_stages = []  # Stages currently running in this process, innermost last
+_sink = None
+_sink_pid = None
+
+
+# One timed stage. Peak memory is the highest traced allocation above the
+# level at entry; nested stages hand their peak on to the enclosing stage.
+class _Stage:
+    __slots__ = ("name", "shape", "labels", "start", "base", "peak")
+
+    def __init__(self, name, shape, labels):
+        self.name = name
+        self.shape = shape
+        self.labels = labels
+
+    def __enter__(self):
+        if track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if _open_stages:
+                _open_stages[-1].peak = max(_open_stages[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        _open_stages.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        _open_stages.pop()
+        record = {"stage": self.name, "wall_ms": round(wall * 1000, 4), "pid": os.getpid(), "time": time.time()}
+        if track_memory:
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record["peak_bytes"] = peak - self.base
+            if _open_stages:
+                _open_stages[-1].peak = max(_open_stages[-1].peak, peak)
+        if self.shape is not None:
+            record["height"], record["width"] = self.shape[:2]
+        record.update(self.labels)
+        _write(record)
+        return False
+
+    # Record the dimensions of an image only known inside the stage (e.g. after decoding)
+    def set_image(self, image):
+        if image is not None:
+            self.shape = image.shape
+
+
+def _write(record):
+    global _sink, _sink_pid
+    # Pool workers forked after the first record open their own handle
+    if _sink is None or _sink_pid != os.getpid():
+        _sink = open(profile_path, "a", buffering=1)
+        _sink_pid = os.getpid()
+    _sink.write(json.dumps(record) + "\n")
+
+
+# Context manager timing a pipeline stage. `image` (an array) adds its
+# dimensions to the record; keyword labels are stored as extra fields.
+#   with instrument.stage("canny", image):
+#       ...
+def stage(name, image=None, **labels):
+    if profile_path is None:
+        return _null_stage
+    return _Stage(name, None if image is None else image.shape, labels)
+
+
+# Turn profiling on from code (scripts otherwise use TLC_PROFILE)
+def enable(path, memory=True):
+    global profile_path, track_memory
+    profile_path = path
+    track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+if profile_path is not None and track_memory:
+    tracemalloc.start()
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Per-stage totals: count, wall time sum and max, largest peak and image size
+def summarize(records):
+    stages = defaultdict(lambda: {"count": 0, "wall_ms_sum": 0.0, "wall_ms_max": 0.0,
+                                  "peak_bytes_max": 0, "pixels_sum": 0})
+    for record in records:
+        s = stages[record["stage"]]
+        s["count"] += 1
+        s["wall_ms_sum"] += record["wall_ms"]
+        s["wall_ms_max"] = max(s["wall_ms_max"], record["wall_ms"])
+        s["peak_bytes_max"] = max(s["peak_bytes_max"], record.get("peak_bytes", 0))
+        s["pixels_sum"] += record.get("width", 0) * record.get("height", 0)
+    return dict(stages)
+
+
+# Prometheus text exposition format (e.g. for the node exporter textfile collector)
+def prometheus_text(records, prefix="tlc_stage"):
+    summary = summarize(records)
+    lines = []
+    metrics = [
+        ("seconds_sum", "counter", "Total wall time of the stage", lambda s: s["wall_ms_sum"] / 1000),
+        ("seconds_count", "counter", "Number of times the stage ran", lambda s: s["count"]),
+        ("seconds_max", "gauge", "Longest single run of the stage", lambda s: s["wall_ms_max"] / 1000),
+        ("peak_bytes", "gauge", "Largest peak of traced memory during the stage", lambda s: s["peak_bytes_max"]),
+        ("pixels_total", "counter", "Image pixels processed by the stage", lambda s: s["pixels_sum"]),
+    ]
+    for suffix, kind, help_text, value in metrics:
+        name = f"{prefix}_{suffix}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for stage_name in sorted(summary):
+            lines.append(f'{name}{{stage="{stage_name}"}} {value(summary[stage_name]):g}')
+    return "\n".join(lines) + "\n"
+
+
+def print_summary(records, out=sys.stdout):
+    summary = summarize(records)
+    print(f"{'stage':20} {'count':>7} {'total ms':>11} {'mean ms':>9} {'max ms':>9} {'peak MB':>9}", file=out)
+    for stage_name, s in sorted(summary.items(), key=lambda item: -item[1]["wall_ms_sum"]):
+        print(f"{stage_name:20} {s['count']:7d} {s['wall_ms_sum']:11.2f} {s['wall_ms_sum'] / s['count']:9.3f} "
+              f"{s['wall_ms_max']:9.3f} {s['peak_bytes_max'] / 1024 ** 2:9.2f}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise a stage profile written with TLC_PROFILE.")
+    parser.add_argument("profile", help="JSON lines profile")
+    parser.add_argument("--prometheus", default=None, help="Also write the totals in Prometheus text format to this file")
+    args = parser.parse_args()
+
+    records = read_records(args.profile)
+    print_summary(records)
+    if args.prometheus:
+        tmp_path = args.prometheus + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(prometheus_text(records))
+        os.replace(tmp_path, args.prometheus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Fraction of the plate width (centred) used for the row profile, away from the plate edges
+profile_band = 0.6
+
+# Rows at the top and bottom of the plate ignored (plate edge)
+edge_margin = 0.06
+
+# The baseline is searched in the lower part of the plate and the solvent
+# front in the upper part (fractions of the plate height from the top)
+baseline_search = (0.55, 1.0)
+solvent_search = (0.0, 0.5)
+
+# Signal-to-noise ratios mapped to confidence 0 and 1
+snr_low = 3.0
+snr_high = 12.0
+
+# Detections below this confidence are not trusted without an operator's check
+min_confidence = 0.5
+
+# Baseline and solvent front y-coordinates with a confidence between 0 and 1
+LineDetection = namedtuple("LineDetection", ["baseline_y", "solvent_y", "confidence",
+                                             "baseline_confidence", "solvent_confidence"])
+
+
+# Box smoothing of a 1-D profile, same length as the input
+def _smooth(profile, size):
+    size = max(1, int(size)) | 1
+    kernel = np.full(size, 1.0 / size, dtype=np.float32)
+    padded = np.pad(profile, size // 2, mode="edge")
+    return np.convolve(padded, kernel, mode="valid")
+
+
+# Peak position in a search window and its confidence from the peak's height
+# above the window's median, in units of the robust noise level
+def _peak(signal, start, stop):
+    window = signal[start:stop]
+    if window.size < 3:
+        return start, 0.0
+    offset = int(np.argmax(window))
+    median = np.median(window)
+    noise = 1.4826 * np.median(np.abs(window - median)) + 1e-6
+    snr = (window[offset] - median) / noise
+    confidence = float(np.clip((snr - snr_low) / (snr_high - snr_low), 0.0, 1.0))
+    return start + offset, confidence
+
+
+# Row intensity profile of a plate: mean of the central columns of each row,
+# restricted to the plate mask when one is given
+def row_profile(plate_image, mask=None):
+    gray = plate_image if plate_image.ndim == 2 else cv2.cvtColor(plate_image, cv2.COLOR_BGR2GRAY)
+    width = gray.shape[1]
+    x0 = int(width * (1 - profile_band) / 2)
+    x1 = max(x0 + 1, width - x0)
+    band = gray[:, x0:x1].astype(np.float32)
+    if mask is None:
+        return band.mean(axis=1)
+    weights = (mask[:, x0:x1] > 0).astype(np.float32)
+    counts = weights.sum(axis=1)
+    sums = (band * weights).sum(axis=1)
+    profile = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    # Rows outside the mask take the mean of the masked rows so they do not create edges
+    if (counts == 0).any() and (counts > 0).any():
+        profile[counts == 0] = profile[counts > 0].mean()
+    return profile
+
+
+# Detect the baseline and solvent front of one plate ROI. The baseline is the
+# strongest thin dark line in the lower part of the plate (pencil line), the
+# solvent front the strongest intensity step in the upper part. Coordinates
+# are rows of `plate_image`.
+def detect_lines(plate_image, mask=None):
+    profile = row_profile(plate_image, mask)
+    height = profile.size
+    line_width = max(3, height // 150)
+
+    smooth = _smooth(profile, line_width)
+    background = _smooth(profile, line_width * 8)
+    dip = background - smooth                 # Thin dark lines
+    step = np.abs(np.gradient(_smooth(profile, line_width * 2)))  # Intensity steps
+
+    margin = int(height * edge_margin)
+    b_start = max(margin, int(height * baseline_search[0]))
+    b_stop = min(height - margin, int(height * baseline_search[1]))
+    s_start = max(margin, int(height * solvent_search[0]))
+    s_stop = min(height - margin, int(height * solvent_search[1]))
+
+    baseline_y, baseline_confidence = _peak(dip, b_start, b_stop)
+    solvent_y, solvent_confidence = _peak(step, s_start, s_stop)
+    return LineDetection(baseline_y, solvent_y, min(baseline_confidence, solvent_confidence),
+                         baseline_confidence, solvent_confidence)
+
+
+# Detect the lines of a segmented plate (segment.PlateROI) in full-image coordinates
+def detect_plate_lines(image, plate):
+    detection = detect_lines(plate.crop(image), plate.mask)
+    return detection._replace(baseline_y=detection.baseline_y + plate.y,
+                              solvent_y=detection.solvent_y + plate.y)
+
+
+# Propose the baseline and solvent line of a plate in the uvclick scripts: both
+# are added to the plate's annotation dict (at the plate's centre column) when
+# detected with at least min_confidence. Returns the annotation types filled
+# in; the operator clicks them when detection is unsure.
+def auto_annotate_plate(image, plate, annotation):
+    detection = detect_plate_lines(image, plate)
+    if detection.confidence < min_confidence:
+        print(f"Automatic detection unsure (confidence {detection.confidence:.2f}). "
+              "Annotate the baseline ('b') and solvent line ('s').")
+        return set()
+
+    x = plate.x + plate.w // 2
+    annotation["baseline"].append((x, detection.baseline_y))
+    annotation["solvent_line"].append((x, detection.solvent_y))
+    print(f"Baseline (y={detection.baseline_y}) and solvent line (y={detection.solvent_y}) detected "
+          f"automatically (confidence {detection.confidence:.2f}). Press 'b' or 's' to click them instead.")
+    return {"baseline", "solvent_line"}
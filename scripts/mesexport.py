@@ -0,0 +1,333 @@
+import os
+import ssl
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+import tlcconfig
+
+# Default MES endpoint (the mock server in mockmes.py listens here)
+mes_url = "http://127.0.0.1:8765/results"
+
+# Records per request, and the longest a partial batch waits before being sent
+batch_size = 200
+flush_interval = 0.5
+
+# Open HTTP connections kept to the MES
+pool_size = 4
+
+# Records held in memory; beyond this they go straight to the retry spool
+queue_size = 20000
+
+# Retry spool: one JSON file per failed batch, retried oldest first. Records
+# that overflow the queue are appended to one JSON lines file in the spool,
+# which the retrier splits into batches.
+spool_path = "./mes_spool"
+overflow_name = "overflow.jsonl"
+retry_interval = 2.0
+max_retry_interval = 60.0
+
+# Seconds before a request is considered failed
+request_timeout = 10.0
+
+
+# MES records of the results of one image: one record per plate, with the
+# plate dict from calculate_ratios and the image and plate it belongs to
+def records_from_results(image, results, plates=None):
+    records = []
+    for i, result in enumerate(results):
+        plate = plates[i] if plates is not None else tlcconfig.plate_names[i]
+        records.append({"image": image, "plate": plate, **result})
+    return records
+
+
+class HTTPError(Exception):
+    pass
+
+
+# Default ports of the supported URL schemes
+default_ports = {"http": 80, "https": 443}
+
+
+# Minimal HTTP/1.1 client connection with keep-alive, enough to POST JSON.
+# With an SSL context the connection uses TLS (https).
+class Connection:
+    def __init__(self, host, port, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.reader = None
+        self.writer = None
+
+    async def post(self, path, body, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+        extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        request = (f"POST {path} HTTP/1.1\r\n"
+                   f"Host: {self.host}:{self.port}\r\n"
+                   "Content-Type: application/json\r\n"
+                   f"Content-Length: {len(body)}\r\n"
+                   f"{extra}"
+                   "Connection: keep-alive\r\n\r\n").encode() + body
+        self.writer.write(request)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HTTPError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        response = await self._read_body(status, headers)
+        if headers.get("connection", "").lower() == "close" or not self._delimited(status, headers):
+            self.close()
+        if status >= 300:
+            raise HTTPError(f"HTTP {status}: {response[:200].decode(errors='replace')}")
+        return response
+
+    @staticmethod
+    def _delimited(status, headers):
+        return ("content-length" in headers or status in (204, 304)
+                or "chunked" in headers.get("transfer-encoding", "").lower())
+
+    # Response body framed by Content-Length or chunked encoding; without
+    # either, the body runs until the server closes the connection
+    async def _read_body(self, status, headers):
+        if status in (204, 304):
+            return b""
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)  # CRLF after each chunk
+            while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Trailer fields
+            return b"".join(chunks)
+        if "content-length" in headers:
+            return await self.reader.readexactly(int(headers["content-length"]))
+        return await self.reader.read()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# Batched asynchronous MES writer. submit() never blocks: records go to a
+# bounded in-memory queue, or to the on-disk spool when the queue is full.
+# Sender tasks post batches over a pool of keep-alive connections; failed
+# batches are spooled and retried with backoff until the MES accepts them.
+# Every batch carries an Idempotency-Key header with its batch id, kept
+# across retries, so the MES can drop a batch it already stored (e.g. when
+# the response to the first attempt was lost).
+class MESWriter:
+    def __init__(self, url=mes_url, batch_size=batch_size, pool_size=pool_size,
+                 queue_size=queue_size, spool_path=spool_path):
+        parts = urlsplit(url)
+        if parts.scheme not in default_ports:
+            raise ValueError(f"Unsupported MES URL scheme {parts.scheme!r} (use http or https)")
+        self.host = parts.hostname
+        self.port = parts.port or default_ports[parts.scheme]
+        self.ssl_context = ssl.create_default_context() if parts.scheme == "https" else None
+        self.path = parts.path or "/"
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.spool_path = spool_path
+        os.makedirs(spool_path, exist_ok=True)
+        self.overflow_path = os.path.join(spool_path, overflow_name)
+        self.overflow = None
+        self.sent = 0
+        self.failed_batches = 0
+        self.started = None
+        self.tasks = []
+        self.spool_counter = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.connections = asyncio.Queue()
+        for _ in range(self.pool_size):
+            self.connections.put_nowait(Connection(self.host, self.port, self.ssl_context))
+        self.started = time.monotonic()
+        self.tasks = [asyncio.create_task(self._sender()) for _ in range(self.pool_size)]
+        self.tasks.append(asyncio.create_task(self._retrier()))
+
+    # Queue a record for the MES without waiting. When the queue is full the
+    # record is appended to the overflow file (flushed, not fsynced: the
+    # retrier fsyncs it as spooled batches).
+    def submit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            if self.overflow is None:
+                self.overflow = open(self.overflow_path, "a")
+            self.overflow.write(json.dumps(record) + "\n")
+            self.overflow.flush()
+
+    # Send everything queued and make a last pass over the spool, then stop.
+    # Records that still could not be sent stay in the spool for the next run.
+    async def close(self):
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self._resend_spool()
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+
+    async def _post(self, records, batch_id):
+        body = json.dumps({"batch_id": batch_id, "records": records}).encode()
+        connection = await self.connections.get()
+        try:
+            await asyncio.wait_for(connection.post(self.path, body, {"Idempotency-Key": batch_id}), request_timeout)
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            self.connections.put_nowait(connection)
+
+    # Take up to batch_size records, waiting at most flush_interval for a batch to fill
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _sender(self):
+        while True:
+            batch = await self._next_batch()
+            batch_id = uuid.uuid4().hex
+            try:
+                await self._post(batch, batch_id)
+                self.sent += len(batch)
+            except (OSError, asyncio.TimeoutError, HTTPError, asyncio.IncompleteReadError, ValueError) as e:
+                self.failed_batches += 1
+                print(f"MES export failed ({e}); {len(batch)} records spooled for retry", file=sys.stderr)
+                self._spool(batch, batch_id)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    # Write a batch to the spool (fsynced, so it survives a crash)
+    def _spool(self, records, batch_id):
+        self.spool_counter += 1
+        name = f"{time.time_ns()}-{os.getpid()}-{self.spool_counter}.json"
+        tmp_path = os.path.join(self.spool_path, name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"batch_id": batch_id, "records": records}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.spool_path, name))
+
+    # Split the overflow file (also one left by an earlier run) into spooled batches
+    def _spool_overflow(self):
+        if self.overflow is not None:
+            self.overflow.close()
+            self.overflow = None
+        if not os.path.exists(self.overflow_path):
+            return
+        records = []
+        with open(self.overflow_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Torn last line
+        for start in range(0, len(records), self.batch_size):
+            self._spool(records[start:start + self.batch_size], uuid.uuid4().hex)
+        os.remove(self.overflow_path)
+
+    def spool_files(self):
+        return sorted(f for f in os.listdir(self.spool_path) if f.endswith(".json"))
+
+    # Resend spooled batches, oldest first. Returns False if the MES failed again.
+    async def _resend_spool(self):
+        self._spool_overflow()
+        for name in self.spool_files():
+            path = os.path.join(self.spool_path, name)
+            with open(path) as f:
+                batch = json.load(f)
+            if isinstance(batch, list):
+                # Spooled before batches had ids: the file name is unique too
+                batch = {"batch_id": name[:-len(".json")], "records": batch}
+            records = batch["records"]
+            try:
+                await self._post(records, batch["batch_id"])
+            except (OSError, asyncio.TimeoutError, HTTPError, asyncio.IncompleteReadError, ValueError):
+                return False
+            os.remove(path)
+            self.sent += len(records)
+        return True
+
+    # Retry the spool periodically, backing off while the MES is down
+    async def _retrier(self):
+        delay = retry_interval
+        while True:
+            await asyncio.sleep(delay)
+            if await self._resend_spool():
+                delay = retry_interval
+            else:
+                delay = min(delay * 2, max_retry_interval)
+
+    # Throughput and queue depths
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "sent": self.sent,
+            "records_per_s": round(self.sent / elapsed, 1) if elapsed > 0 else 0.0,
+            "queue_depth": self.queue.qsize() if self.started else 0,
+            "spool_files": len(self.spool_files()) + os.path.exists(self.overflow_path),
+            "failed_batches": self.failed_batches,
+        }
+
+
+# Export the results in JSON lines (as written by replay.py) to the MES
+async def export_jsonl(lines, url, report_interval=5.0):
+    writer = MESWriter(url)
+    await writer.start()
+    last_report = time.monotonic()
+    for line in lines:
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        for record in records_from_results(data["image"], data["results"], data.get("plates")):
+            writer.submit(record)
+        if time.monotonic() - last_report >= report_interval:
+            print(json.dumps(writer.stats()), file=sys.stderr)
+            last_report = time.monotonic()
+        await asyncio.sleep(0)  # Let the senders run while reading
+    await writer.close()
+    print(json.dumps(writer.stats()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send ratio results (JSON lines from replay.py) to the MES.")
+    parser.add_argument("input", nargs="?", default="-", help="JSON lines file (default: standard input)")
+    parser.add_argument("--url", default=mes_url, help="MES endpoint")
+    args = parser.parse_args()
+
+    lines = sys.stdin if args.input == "-" else open(args.input)
+    asyncio.run(export_jsonl(lines, args.url))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# Local stand-in for the MES: accepts POST /results with {"records": [...]}
+# over keep-alive HTTP/1.1 and answers GET /stats with its counters. Latency
+# and a failure rate can be injected to test the exporter's retry spool.
+# Batches repeated with the same Idempotency-Key are acknowledged but not
+# stored again.
+host = "127.0.0.1"
+port = 8765
+
+
+class MockMES:
+    def __init__(self, latency=0.0, fail_rate=0.0, output=None, chunked=False):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.chunked = chunked
+        self.output = open(output, "a") if output else None
+        self.records = 0
+        self.requests = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.batch_ids = set()
+        self.started = time.monotonic()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {"records": self.records, "requests": self.requests, "rejected": self.rejected,
+                "duplicates": self.duplicates,
+                "records_per_s": round(self.records / elapsed, 1) if elapsed > 0 else 0.0}
+
+    async def respond(self, writer, status, body):
+        reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}.get(status, "Error")
+        data = json.dumps(body).encode()
+        if self.chunked:
+            # Two chunks, to exercise the client's chunked decoding
+            half = len(data) // 2
+            framed = b"".join(b"%x\r\n%s\r\n" % (len(part), part) for part in (data[:half], data[half:]) if part)
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                         "Transfer-Encoding: chunked\r\n\r\n".encode() + framed + b"0\r\n\r\n")
+        else:
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "GET" and path == "/stats":
+                    await self.respond(writer, 200, self.stats())
+                    continue
+                if method != "POST" or path != "/results":
+                    await self.respond(writer, 404, {"error": "not found"})
+                    continue
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if random.random() < self.fail_rate:
+                    self.rejected += 1
+                    await self.respond(writer, 503, {"error": "unavailable"})
+                    continue
+                records = json.loads(body)["records"]
+                batch_id = headers.get("idempotency-key")
+                if batch_id is not None and batch_id in self.batch_ids:
+                    self.duplicates += 1
+                    await self.respond(writer, 200, {"accepted": 0, "duplicate": True})
+                    continue
+                if batch_id is not None:
+                    self.batch_ids.add(batch_id)
+                self.records += len(records)
+                if self.output:
+                    for record in records:
+                        self.output.write(json.dumps(record) + "\n")
+                    self.output.flush()
+                await self.respond(writer, 200, {"accepted": len(records)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(mes, host=host, port=port, report_interval=5.0):
+    server = await asyncio.start_server(mes.handle, host, port)
+    print(f"Mock MES listening on http://{host}:{port}/results")
+    async with server:
+        while True:
+            await asyncio.sleep(report_interval)
+            print(json.dumps(mes.stats()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock MES for testing the exporter.")
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--output", default=None, help="Append received records to this JSON lines file")
+    parser.add_argument("--chunked", action="store_true", help="Send responses with chunked transfer encoding")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(MockMES(args.latency, args.fail_rate, args.output, args.chunked), port=args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+
+import replay
+import capture
+import instrument
+import tlcconfig
+import foldersort
+import spotdetect
+import densitometry
+from segment import plates_to_dicts
+
+# Frame slots per worker: one being decoded while another is analysed
+slots_per_worker = 2
+
+# Images whose ratios are computed together (see replay.replay_batch)
+ratio_batch_size = 500
+
+
+# Pool of fixed-size frame slots in one shared memory block. Decoded captures
+# are written into a slot once; every later stage, in any process, works on a
+# NumPy view of that slot instead of a pickled or re-decoded copy. Slots are
+# handed out and recycled by the process that owns the pool.
+class FramePool:
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free = deque(range(slots))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self):
+        return self.free.popleft() if self.free else None
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Shared memory blocks attached in this process, by name
+_attached = {}
+
+
+# View of the frame in a slot of a pool (attached on first use in each process)
+def frame_view(pool_name, slot_bytes, slot, shape):
+    shm = _attached.get(pool_name)
+    if shm is None:
+        shm = _attached[pool_name] = shared_memory.SharedMemory(name=pool_name)
+    return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+
+
+# Width and height of a capture read from its file header (PNG, JPEG, BMP),
+# or None for other formats. Decoded captures have three 8-bit channels.
+def header_size(image_path):
+    with open(image_path, "rb") as f:
+        head = f.read(26)
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+        if head.startswith(b"BM"):
+            return int.from_bytes(head[18:22], "little", signed=True), abs(int.from_bytes(head[22:26], "little", signed=True))
+        if not head.startswith(b"\xff\xd8"):
+            return None
+        # JPEG: walk the marker segments to the start-of-frame header
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            code = marker[1]
+            if code == 0xFF or code == 0x01 or 0xD0 <= code <= 0xD8:
+                if code == 0xFF:
+                    f.seek(-1, 1)  # Fill byte
+                continue
+            length = int.from_bytes(f.read(2), "big")
+            if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                frame = f.read(5)
+                return int.from_bytes(frame[3:5], "big"), int.from_bytes(frame[1:3], "big")
+            f.seek(length - 2, 1)
+
+
+# Worker task: shape of a decoded capture, for formats without a readable header
+def frame_shape(image_path):
+    image = cv2.imread(image_path)
+    return None if image is None else image.shape
+
+
+# Bytes of a slot that fits the largest of the captures. Sizes come from the
+# file headers; captures in other formats are decoded once in the executor
+# for their shape.
+def largest_frame_bytes(paths, executor):
+    sizes = []
+    unknown = []
+    for path in paths:
+        try:
+            size = header_size(path)
+        except OSError:
+            continue  # Gone; reported when it is decoded
+        if size is None:
+            unknown.append(path)
+        else:
+            sizes.append(size[0] * size[1] * 3)
+    sizes.extend(int(np.prod(shape)) for shape in executor.map(frame_shape, unknown) if shape is not None)
+    return max(sizes, default=0)
+
+
+# Group capture paths into UV/stain pairs by the numbers in their names
+# (uv_00001.jpg and stain_00001.jpg, 102038UV.jpg and 102038TAIN.jpg). A
+# capture without exactly one partner is analysed on its own.
+def pair_captures(paths):
+    groups = {}
+    for path in paths:
+        key = tuple(int(n) for n in re.findall(r"\d+", os.path.basename(path)))
+        groups.setdefault(key or path, []).append(path)
+    units = []
+    for group in groups.values():
+        if len(group) == 2:
+            units.append(tuple(group))
+        else:
+            units.extend((path,) for path in group)
+    return units
+
+
+# Stage 1 (worker): decode a capture into a slot. Returns the frame shape, or
+# None when the file cannot be decoded or does not fit a slot.
+def decode_into_slot(pool_name, slot_bytes, slot, image_path):
+    with instrument.stage("decode") as stage:
+        image = cv2.imread(image_path)
+        stage.set_image(image)
+    if image is None or image.nbytes > slot_bytes:
+        return None
+    frame = frame_view(pool_name, slot_bytes, slot, image.shape)
+    np.copyto(frame, image)
+    return image.shape
+
+
+# Segment and detect on one frame, and optionally measure its lanes.
+# Returns (record, error).
+def analyze_frame(frame, path, label, avg_intensity, lanes):
+    try:
+        plates, annotations = spotdetect.annotate_image(frame)
+    except ValueError as e:
+        return None, str(e)
+    record = {"image": path, "source": label, "mean": avg_intensity,
+              "plates": plates_to_dicts(plates), label: annotations}
+    if lanes:
+        record["densitometry"] = densitometry.measure(frame, plates, annotations)
+    return record, None
+
+
+# Annotate the UV frame of a pair and measure the stain frame on its plates
+# (see capture.register_stain), lanes included: the stain lanes are profiled
+# on the stain frame in UV coordinates between the UV lines. Returns one
+# record for the pair, or an error.
+def analyze_pair(uv_frame, stain_frame, uv_path, stain_path, means, lanes):
+    try:
+        plates, annotations_uv = spotdetect.annotate_image(uv_frame)
+    except ValueError as e:
+        return None, str(e)
+    annotations_stain, stain_to_uv, stain_in_uv = capture.register_stain(uv_frame, stain_frame, plates, annotations_uv)
+    record = {"image": uv_path, "pair": [uv_path, stain_path], "source": "uv", "mean": means[0],
+              "stain_mean": means[1], "plates": plates_to_dicts(plates), "uv": annotations_uv,
+              "stain": annotations_stain}
+    if stain_to_uv is not None:
+        record["stain_to_uv"] = stain_to_uv.tolist()
+    else:
+        record["registration_failed"] = True
+    if lanes:
+        record["densitometry"] = densitometry.measure(uv_frame, plates, annotations_uv)
+        record["stain_densitometry"] = densitometry.measure(stain_in_uv, plates, annotations_stain)
+    return record, None
+
+
+# Stage 2 (worker): sort the frames of one capture or capture pair in their
+# slots, then segment and detect. A UV/stain pair is measured together on
+# the UV plates; other frames are analysed on their own. Plate ROIs are views
+# of the shared frames, so nothing is copied. Returns the label of each path,
+# the records and the errors as (path, label, error).
+def analyze_slots(pool_name, slot_bytes, slots, shapes, paths, threshold, lanes=False):
+    frames = [frame_view(pool_name, slot_bytes, slot, shape) for slot, shape in zip(slots, shapes)]
+    means = [foldersort.frame_intensity(frame) for frame in frames]
+    labels = [foldersort.classify(mean, threshold) for mean in means]
+    if sorted(labels) == ["stain", "uv"]:
+        uv, stain = (0, 1) if labels[0] == "uv" else (1, 0)
+        record, error = analyze_pair(frames[uv], frames[stain], paths[uv], paths[stain],
+                                     (means[uv], means[stain]), lanes)
+        if error is not None:
+            return list(zip(paths, labels)), [], [(paths[uv], "uv", error), (paths[stain], "stain", error)]
+        return list(zip(paths, labels)), [record], []
+
+    records, errors = [], []
+    for frame, path, label, avg_intensity in zip(frames, paths, labels, means):
+        record, error = analyze_frame(frame, path, label, avg_intensity, lanes)
+        if error is not None:
+            errors.append((path, label, error))
+        else:
+            records.append(record)
+    return list(zip(paths, labels)), records, errors
+
+
+# Stage 3 (main process): ratios of the UV captures in one batch, written as JSON lines
+def write_records(out, records):
+    uv_records = [{"image": r["image"], "uv": r["uv"], "stain": r.get("stain", [])} for r in records if "uv" in r]
+    results = {}
+    with contextlib.redirect_stdout(sys.stderr):
+        for record, plate_results, error in replay.replay_batch(uv_records, tlcconfig.pixels_to_cm_uv):
+            results[record["image"]] = [result for _, result in plate_results], error
+    for record in records:
+        if record["image"] in results:
+            record["results"], error = results[record["image"]]
+            if error:
+                record["error"] = error
+        out.write(json.dumps(record) + "\n")
+
+
+# Move the captures of a unit to their sorted folders. Returns the new path
+# of each capture (the old one when it could not be moved).
+def move_captures(labels):
+    moved = {}
+    for path, label in labels:
+        try:
+            moved[path] = foldersort.move_image(path, label)
+        except OSError as e:
+            print(f"Could not move {os.path.basename(path)} ({e})")
+            moved[path] = path
+    return moved
+
+
+# Run the decode -> sort/segment/detect -> ratio pipeline over image paths.
+# The captures of a UV/stain pair are decoded into two slots and analysed
+# together. At most `slots` captures are in memory at once; slots are
+# recycled as soon as their captures have been analysed. A capture that
+# fails in a worker is reported and skipped.
+def run(paths, out, workers=None, threshold=foldersort.uv_threshold, move=False, slot_bytes=None, lanes=False):
+    workers = workers or os.cpu_count() or 1
+    units = deque(pair_captures(paths))
+    if not units:
+        return 0
+
+    processed = 0
+    batch = []
+    in_flight = {}
+    pool = None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if slot_bytes is None:
+                # Size the slots for the largest capture
+                slot_bytes = largest_frame_bytes([path for unit in units for path in unit], executor)
+            pool = FramePool(workers * slots_per_worker, max(slot_bytes, 1))
+
+            while units or in_flight:
+                # Start decoding every unit that free slots are left for
+                while units and len(pool.free) >= len(units[0]):
+                    unit = units.popleft()
+                    state = {"slots": [], "shapes": [], "decoded": [], "pending": len(unit)}
+                    for path in unit:
+                        slot = pool.acquire()
+                        future = executor.submit(decode_into_slot, pool.name, pool.slot_bytes, slot, path)
+                        in_flight[future] = ("decode", slot, path, state)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, slot, path, state = in_flight.pop(future)
+                    if stage == "decode":
+                        state["pending"] -= 1
+                        try:
+                            shape = future.result()
+                            error = "could not load image or larger than a frame slot"
+                        except Exception as e:
+                            shape, error = None, str(e)
+                        if shape is None:
+                            print(f"{os.path.basename(path)}: {error}. Skipping...")
+                            pool.release(slot)
+                        else:
+                            state["slots"].append(slot)
+                            state["shapes"].append(shape)
+                            state["decoded"].append(path)
+                        if state["pending"] == 0 and state["slots"]:
+                            future = executor.submit(analyze_slots, pool.name, pool.slot_bytes, state["slots"],
+                                                     state["shapes"], state["decoded"], threshold, lanes)
+                            in_flight[future] = ("analyze", None, None, state)
+                        continue
+
+                    for slot in state["slots"]:
+                        pool.release(slot)
+                    try:
+                        labels, records, errors = future.result()
+                    except Exception as e:
+                        for path in state["decoded"]:
+                            print(f"{os.path.basename(path)}: {type(e).__name__}: {e}. Skipping...")
+                        continue
+                    moved = move_captures(labels) if move else {path: path for path, _ in labels}
+                    for path, label, error in errors:
+                        print(f"{os.path.basename(path)} ({label.upper()}): {error}. Skipping...")
+                    for record in records:
+                        record["image"] = moved[record["image"]]
+                        if "pair" in record:
+                            record["pair"] = [moved[path] for path in record["pair"]]
+                        batch.append(record)
+                        processed += len(record.get("pair", [record["image"]]))
+                    if len(batch) >= ratio_batch_size:
+                        write_records(out, batch)
+                        batch = []
+        write_records(out, batch)
+    finally:
+        if pool is not None:
+            pool.close()
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sort, segment and annotate captures in one pass, decoding each image once.")
+    parser.add_argument("input", help="Folder with captures")
+    parser.add_argument("--output", default="./annotations/pipeline.jsonl", help="JSON lines output")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--threshold", type=float, default=foldersort.uv_threshold, help="Mean intensity below which an image is UV")
+    parser.add_argument("--move", action="store_true", help="Move the captures into the sorted UV and stain folders")
+    parser.add_argument("--densitometry", action="store_true", help="Also measure lane profiles, peak positions and areas")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.input, f) for f in os.listdir(args.input)
+                   if f.lower().endswith(foldersort.image_extensions))
+    if args.move:
+        os.makedirs(foldersort.uv_folder, exist_ok=True)
+        os.makedirs(foldersort.stain_folder, exist_ok=True)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+
+    start = time.perf_counter()
+    with open(args.output, "w") as out:
+        processed = run(paths, out, args.workers, args.threshold, args.move, lanes=args.densitometry)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} of {len(paths)} images in {elapsed:.1f} s "
+          f"({len(paths) / elapsed if elapsed > 0 else 0:.1f} images/s)")
+
+
+if __name__ == "__main__":
+    main()
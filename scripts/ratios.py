@@ -0,0 +1,255 @@
+from collections import namedtuple
+
+import numpy as np
+
+import instrument
+
+# Spot sources
+SOURCE_UV = 0
+SOURCE_STAIN = 1
+
+# Flat input of a whole batch. Plate columns (one row per plate): index of the
+# plate in its annotation list, UV baseline and solvent line y, stain baseline
+# and solvent line y (NaN when the stain image has none). Spot columns (one row
+# per spot): row of its plate in the plate columns, source, x, y.
+SpotBatch = namedtuple("SpotBatch", ["plate", "baseline_y", "solvent_y", "stain_baseline_y", "stain_solvent_y",
+                                     "spot_plate", "source", "x", "y"])
+
+# Columnar result. Plate columns: plate index and solvent front distance (cm).
+# Spot columns, grouped by plate: row of the plate, component number, x, y (UV
+# coordinates), distance to the baseline in pixels and in cm, Rf and CV.
+RatioTable = namedtuple("RatioTable", ["plate", "solvent_front_distance_cm",
+                                       "spot_plate", "component", "x", "y", "distance_px", "distance_cm", "rf", "cv"])
+
+
+# Flatten uvclick-style annotations (lists of plate dicts with "baseline",
+# "solvent_line" and "spots" point lists) into a SpotBatch. With stain
+# annotations, plates are paired with zip() as in uvclick1.1.py. Plates
+# without baseline or solvent line are left out; their indices are returned.
+def flatten_annotations(annotations_uv, annotations_stain=None):
+    if annotations_stain is None:
+        pairs = ((plate, None) for plate in annotations_uv)
+    else:
+        pairs = zip(annotations_uv, annotations_stain)
+
+    plates, baselines, solvents, stain_baselines, stain_solvents = [], [], [], [], []
+    spot_plate, sources, xs, ys = [], [], [], []
+    missing = []
+    for i, (plate_uv, plate_stain) in enumerate(pairs):
+        baseline = plate_uv.get("baseline")
+        solvent_line = plate_uv.get("solvent_line")
+        if not baseline or not solvent_line:
+            missing.append(i)
+            continue
+
+        row = len(plates)
+        plates.append(i)
+        baselines.append(baseline[0][1])
+        solvents.append(solvent_line[0][1])
+        for spot in plate_uv.get("spots", []):
+            spot_plate.append(row)
+            sources.append(SOURCE_UV)
+            xs.append(spot[0])
+            ys.append(spot[1])
+
+        stain_baseline = stain_solvent = np.nan
+        if plate_stain:
+            baseline = plate_stain.get("baseline")
+            solvent_line = plate_stain.get("solvent_line")
+            if baseline and solvent_line:
+                stain_baseline = baseline[0][1]
+                stain_solvent = solvent_line[0][1]
+                for spot in plate_stain.get("spots", []):
+                    spot_plate.append(row)
+                    sources.append(SOURCE_STAIN)
+                    xs.append(spot[0])
+                    ys.append(spot[1])
+        stain_baselines.append(stain_baseline)
+        stain_solvents.append(stain_solvent)
+
+    batch = SpotBatch(
+        np.array(plates, dtype=np.int64),
+        np.array(baselines, dtype=np.float64),
+        np.array(solvents, dtype=np.float64),
+        np.array(stain_baselines, dtype=np.float64),
+        np.array(stain_solvents, dtype=np.float64),
+        np.array(spot_plate, dtype=np.int64),
+        np.array(sources, dtype=np.int8),
+        np.array(xs, dtype=np.float64),
+        np.array(ys, dtype=np.float64),
+    )
+    return batch, missing
+
+
+# Round like Python's round(). np.round rounds value * 10**decimals, which can
+# fall on the other side of .5 than the exact decimal value round() uses, so
+# the few values close to a tie are redone with round().
+def _round(values, decimals):
+    rounded = np.round(values, decimals)
+    scaled = values * 10.0 ** decimals
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie):
+        rounded[i] = round(float(values[i]), decimals)
+    return rounded
+
+
+# Start index of each run of equal values in a sorted group column
+def _group_starts(groups):
+    return np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if groups.size else groups
+
+
+# Greedy deduplication of values sorted ascending within each group: a value
+# is dropped when it is within `tolerance` of the last value kept in its
+# group. This gives the same result as comparing against every kept value.
+# Values further than the tolerance from their predecessor start a new run
+# and are always kept; only runs of three or more need the sequential scan.
+def _greedy_unique(values, groups, tolerance):
+    n = values.size
+    keep = np.ones(n, dtype=bool)
+    if n < 2:
+        return keep
+    close = ((values[1:] - values[:-1]) <= tolerance) & (groups[1:] == groups[:-1])
+    keep[1:] = ~close
+
+    run_starts = np.flatnonzero(np.r_[True, ~close])
+    run_lengths = np.diff(np.r_[run_starts, n])
+    for start, length in zip(run_starts[run_lengths > 2], run_lengths[run_lengths > 2]):
+        last = values[start]
+        for k in range(start + 1, start + length):
+            if values[k] - last > tolerance:
+                keep[k] = True
+                last = values[k]
+    return keep
+
+
+# Compute distances, Rf and CV for all spots of a batch in one pass.
+#   dedup_px: merge spots within this many pixels (uvclick1.1.py uses 2)
+#   sort_by_distance: number components by distance instead of by y
+#   merge_cm: drop components within this distance (cm) of the previous one
+#   on_zero_front: "skip" drops the spots of plates whose solvent front is on
+#       the baseline (uvclick.py), "raise" raises ZeroDivisionError (uvclick1.1.py)
+def compute_ratios(batch, pixels_to_cm, dedup_px=None, sort_by_distance=False, merge_cm=None, on_zero_front="skip"):
+    with instrument.stage("ratios", plates=int(batch.plate.size), spots=int(batch.x.size)):
+        return _compute_ratios(batch, pixels_to_cm, dedup_px, sort_by_distance, merge_cm, on_zero_front)
+
+
+def _compute_ratios(batch, pixels_to_cm, dedup_px, sort_by_distance, merge_cm, on_zero_front):
+    baseline = batch.baseline_y
+    front_px = np.abs(batch.solvent_y - baseline)
+    front_cm = _round(front_px * pixels_to_cm, 1)
+
+    spot_plate = batch.spot_plate
+    x = batch.x
+    y = batch.y
+
+    # Rescale stain spots onto the UV baseline and solvent line
+    is_stain = batch.source == SOURCE_STAIN
+    if is_stain.any():
+        stain_baseline = batch.stain_baseline_y[spot_plate]
+        stain_px = np.abs(batch.stain_solvent_y[spot_plate] - stain_baseline)
+        scale = np.ones_like(stain_px)
+        np.divide(front_px[spot_plate], stain_px, out=scale, where=stain_px > 0)
+        y = np.where(is_stain, baseline[spot_plate] + scale * (y - stain_baseline), y)
+        keep = ~is_stain | ~np.isnan(stain_px)
+        spot_plate, x, y = spot_plate[keep], x[keep], y[keep]
+
+    # Sort by plate then y; ties keep their input order (UV before stain)
+    order = np.lexsort((np.arange(y.size), y, spot_plate))
+    spot_plate, x, y = spot_plate[order], x[order], y[order]
+
+    if dedup_px is not None:
+        keep = _greedy_unique(y, spot_plate, dedup_px)
+        spot_plate, x, y = spot_plate[keep], x[keep], y[keep]
+
+    # Plates whose solvent front is on the baseline have no defined Rf
+    zero_front = front_px[spot_plate] == 0
+    if zero_front.any():
+        if on_zero_front == "raise":
+            raise ZeroDivisionError("division by zero")
+        for row in spot_plate[zero_front]:
+            print(f"Error: Solvent to baseline distance is zero for Plate {batch.plate[row] + 1}.")
+
+    distance_px = np.abs(y - baseline[spot_plate])
+    distance_cm = _round(distance_px * pixels_to_cm, 1)
+    rf = np.zeros_like(distance_px)
+    np.divide(distance_px, front_px[spot_plate], out=rf, where=~zero_front)
+    cv = np.zeros_like(rf)
+    np.divide(1.0, rf, out=cv, where=rf != 0)
+    rf = _round(rf, 2)
+    cv = _round(cv, 1)
+
+    # Component numbers follow y, or the rounded distance when sorting by distance
+    if sort_by_distance:
+        order = np.lexsort((np.arange(spot_plate.size), distance_cm, spot_plate))
+        spot_plate, x, y, distance_px, distance_cm, rf, cv, zero_front = (
+            a[order] for a in (spot_plate, x, y, distance_px, distance_cm, rf, cv, zero_front))
+    starts = _group_starts(spot_plate)
+    counts = np.diff(np.r_[starts, spot_plate.size])
+    component = np.arange(spot_plate.size) - np.repeat(starts, counts) + 1
+
+    keep = ~zero_front
+    if merge_cm is not None:
+        # Components are in ascending distance here, as merge_cm expects
+        kept = np.flatnonzero(keep)
+        keep[kept] = _greedy_unique(distance_cm[kept], spot_plate[kept], merge_cm)
+
+    return RatioTable(batch.plate, front_cm, spot_plate[keep], component[keep], x[keep], y[keep],
+                      distance_px[keep], distance_cm[keep], rf[keep], cv[keep])
+
+
+# Convert a RatioTable to the list of plate dicts printed by the uvclick
+# scripts. `layout` selects the key order of uvclick.py ("single") or
+# uvclick1.1.py ("uv_stain").
+def to_results(table, layout="uv_stain"):
+    bounds = np.searchsorted(table.spot_plate, np.arange(table.plate.size + 1))
+    front_cm = table.solvent_front_distance_cm.tolist()
+    component = table.component.tolist()
+    distance_cm = table.distance_cm.tolist()
+    rf = table.rf.tolist()
+    cv = table.cv.tolist()
+    on_baseline = (table.distance_px == 0).tolist()
+
+    results = []
+    for row in range(table.plate.size):
+        components = []
+        for k in range(bounds[row], bounds[row + 1]):
+            name = f"Component {component[k]}"
+            spot_cv = 0 if on_baseline[k] else cv[k]  # CV of a spot on the baseline is the integer 0
+            if layout == "single":
+                components.append({"component": name, "distance_cm": distance_cm[k], "rf": rf[k], "cv": spot_cv})
+            else:
+                components.append({"distance_cm": distance_cm[k], "rf": rf[k], "cv": spot_cv, "component": name})
+        results.append({"components": components, "solvent_front_distance_cm": front_cm[row]})
+    return results
+
+
+# Drop-in for calculate_ratios in uvclick.py
+def calculate_ratios_single(annotations, pixels_to_cm):
+    batch, missing = flatten_annotations(annotations)
+    for i in missing:
+        print(f"Error: Plate {i + 1} is missing baseline or solvent line.")
+    table = compute_ratios(batch, pixels_to_cm)
+    return to_results(table, layout="single")
+
+
+# Drop-in for calculate_ratios in uvclick1.1.py; merge_cm=0.1 also applies the
+# duplicate filter its main() runs on the results
+def calculate_ratios_uv_stain(annotations_uv, annotations_stain, pixels_to_cm, merge_cm=None):
+    batch, missing = flatten_annotations(annotations_uv, annotations_stain)
+    for i in missing:
+        print(f"Error: Plate {i + 1} UV image is missing baseline or solvent line.")
+    table = compute_ratios(batch, pixels_to_cm, dedup_px=2, sort_by_distance=True,
+                           merge_cm=merge_cm, on_zero_front="raise")
+    return to_results(table, layout="uv_stain")
+
+
+# Stack several SpotBatches into one. Returns the batch and, for each plate
+# row, the index of the batch it came from.
+def stack_batches(batches):
+    if not batches:
+        return flatten_annotations([])[0], np.empty(0, dtype=np.int64)
+    offsets = np.cumsum([0] + [b.plate.size for b in batches])
+    stacked = SpotBatch(*(np.concatenate([getattr(b, field) for b in batches]) for field in SpotBatch._fields))
+    spot_plate = np.concatenate([b.spot_plate + offset for b, offset in zip(batches, offsets)])
+    plate_batch = np.repeat(np.arange(len(batches)), np.diff(offsets))
+    return stacked._replace(spot_plate=spot_plate), plate_batch
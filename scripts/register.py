@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import argparse
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Width of the coarsest pyramid level (phase correlation) and of the finest
+# level refined with ECC. Registering at ~1000 px keeps a pair of 20 MP
+# captures well under a second; the transform is scaled up to full resolution.
+coarse_width = 200
+fine_width = 1000
+
+# ECC iterations and convergence threshold per pyramid level
+ecc_iterations = 50
+ecc_epsilon = 1e-4
+
+# Correlation below which a registration is reported as failed
+min_correlation = 0.5
+
+# Captures whose aspect ratios differ by more than this fraction are not registered
+max_aspect_difference = 0.01
+
+# Affine transforms (2x3) between the captures in full-resolution pixels and
+# the ECC correlation of the finest level (1 is a perfect match)
+Registration = namedtuple("Registration", ["uv_to_stain", "stain_to_uv", "correlation"])
+
+
+# Edge strength image used for matching. UV and stain captures differ in
+# colour and contrast, but the plate outlines, pencil lines and fronts are
+# edges in both.
+def _edges(gray):
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    gx = cv2.Sobel(blurred, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(blurred, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = cv2.magnitude(gx, gy)
+    cv2.normalize(magnitude, magnitude, 0, 1, cv2.NORM_MINMAX)
+    return magnitude
+
+
+# Grey pyramid of an image from the finest registration level, resized to
+# `size` (width, height), down to coarse_width. Returns the x and y scales of
+# the finest level and the levels.
+def _pyramid(image, size):
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = (size[0] / gray.shape[1], size[1] / gray.shape[0])
+    if gray.shape[1::-1] != size:
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    levels = [gray]
+    while levels[-1].shape[1] // 2 >= coarse_width:
+        levels.append(cv2.pyrDown(levels[-1]))
+    return scale, [_edges(level.astype(np.float32)) for level in levels]
+
+
+# Estimate the rigid (rotation + translation) transform between a UV and a
+# stain capture of the same plates: phase correlation on the coarsest
+# pyramid level for the shift, then ECC refinement level by level. Captures
+# of different resolutions are registered at one common size and the
+# transform accounts for both scales.
+def register(uv_image, stain_image):
+    uv_height, uv_width = uv_image.shape[:2]
+    stain_height, stain_width = stain_image.shape[:2]
+    uv_aspect = uv_width / uv_height
+    if abs(stain_width / stain_height - uv_aspect) > max_aspect_difference * uv_aspect:
+        raise ValueError("UV and stain captures have different aspect ratios")
+    width = min(fine_width, uv_width, stain_width)
+    size = (width, max(1, round(width / uv_aspect)))
+    uv_scale, uv_levels = _pyramid(uv_image, size)
+    stain_scale, stain_levels = _pyramid(stain_image, size)
+
+    # Coarse shift; phase correlation gives the stain position relative to UV
+    coarse_uv, coarse_stain = uv_levels[-1], stain_levels[-1]
+    window = cv2.createHanningWindow(coarse_uv.shape[::-1], cv2.CV_32F)
+    (dx, dy), _ = cv2.phaseCorrelate(coarse_uv, coarse_stain, window)
+    warp = np.float32([[1, 0, dx], [0, 1, dy]])
+
+    correlation = 0.0
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, ecc_iterations, ecc_epsilon)
+    for level in range(len(uv_levels) - 1, -1, -1):
+        try:
+            correlation, warp = cv2.findTransformECC(uv_levels[level], stain_levels[level], warp,
+                                                     cv2.MOTION_EUCLIDEAN, criteria, None, 5)
+        except cv2.error:
+            # No convergence on this level; keep the estimate of the level above
+            pass
+        if level > 0:
+            warp[:, 2] *= 2  # Translation in the pixels of the next (finer) level
+
+    # The warp maps UV pixels of the finest level to stain pixels of the finest
+    # level; compose it with the scales of both captures for full resolution
+    uv_to_stain = np.diag([1 / stain_scale[0], 1 / stain_scale[1]]) @ warp.astype(np.float64) \
+        @ np.diag([uv_scale[0], uv_scale[1], 1.0])
+    stain_to_uv = cv2.invertAffineTransform(uv_to_stain)
+    return Registration(uv_to_stain, stain_to_uv, float(correlation))
+
+
+# Apply a 2x3 affine transform to an (N, 2) array of points
+def transform_points(points, matrix):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ matrix[:, :2].T + matrix[:, 2]
+
+
+# Stain annotations in UV coordinates: every stain point is mapped with one
+# transform, and each plate takes the UV baseline and solvent line, so the
+# stain baseline and front no longer need to be clicked.
+def stain_annotations_in_uv(annotations_uv, annotations_stain, stain_to_uv):
+    spots = [plate.get("spots", []) for plate in annotations_stain]
+    counts = [len(s) for s in spots]
+    mapped = np.rint(transform_points([p for s in spots for p in s], stain_to_uv)).astype(int).tolist()
+    bounds = np.cumsum([0] + counts)
+
+    annotations = []
+    for i, plate in enumerate(annotations_stain):
+        uv_plate = annotations_uv[i] if i < len(annotations_uv) else {}
+        annotations.append({
+            "baseline": list(uv_plate.get("baseline", [])),
+            "solvent_line": list(uv_plate.get("solvent_line", [])),
+            "spots": [tuple(p) for p in mapped[bounds[i]:bounds[i + 1]]],
+        })
+    return annotations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register stain captures onto their UV captures.")
+    parser.add_argument("uv", help="UV capture, or a folder of UV captures")
+    parser.add_argument("stain", help="Stain capture, or a folder of stain captures (paired by sorted order)")
+    parser.add_argument("--output", default=None, help="Write the transforms as JSON lines to this file")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.uv):
+        uv_paths = sorted(os.path.join(args.uv, f) for f in os.listdir(args.uv))
+        stain_paths = sorted(os.path.join(args.stain, f) for f in os.listdir(args.stain))
+    else:
+        uv_paths, stain_paths = [args.uv], [args.stain]
+
+    out = open(args.output, "w") if args.output else None
+    for uv_path, stain_path in zip(uv_paths, stain_paths):
+        uv_image, stain_image = cv2.imread(uv_path), cv2.imread(stain_path)
+        if uv_image is None or stain_image is None:
+            print(f"{uv_path}: could not load the pair. Skipping...")
+            continue
+        start = time.perf_counter()
+        registration = register(uv_image, stain_image)
+        elapsed = time.perf_counter() - start
+        (dx, dy) = registration.stain_to_uv[:, 2]
+        angle = np.degrees(np.arctan2(registration.stain_to_uv[1, 0], registration.stain_to_uv[0, 0]))
+        status = "ok" if registration.correlation >= min_correlation else "FAILED"
+        print(f"{os.path.basename(uv_path)}: shift ({dx:.1f}, {dy:.1f}) px, rotation {angle:.2f} deg, "
+              f"correlation {registration.correlation:.3f} {status} ({elapsed * 1000:.0f} ms)")
+        if out:
+            out.write(json.dumps({"uv": uv_path, "stain": stain_path,
+                                  "stain_to_uv": registration.stain_to_uv.tolist(),
+                                  "correlation": registration.correlation}) + "\n")
+    if out:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
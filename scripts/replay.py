@@ -0,0 +1,182 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import contextlib
+from collections import defaultdict
+
+import numpy as np
+
+import ratios
+import tlcconfig
+
+# Annotation file extensions read from directories
+annotation_extensions = (".json", ".jsonl", ".csv")
+
+# Images processed per batch; results are written after each batch
+batch_size = 5000
+
+# Columns of the CSV input (one row per clicked point) and output (one row per component)
+csv_input_columns = ["image", "source", "plate", "type", "x", "y"]
+csv_output_columns = ["image", "plate", "name", "solvent_front_distance_cm", "component", "distance_cm", "rf", "cv"]
+
+
+# Normalise an annotation record: {"image": ..., "uv": [plates], "stain": [plates]}.
+# Files written by spotdetect.py already have this shape; a bare list of plates
+# is taken as UV annotations.
+def _record(data, default_image):
+    if isinstance(data, list):
+        return {"image": default_image, "uv": data, "stain": []}
+    return {"image": data.get("image", default_image),
+            "uv": data.get("uv", data.get("annotations", [])),
+            "stain": data.get("stain", [])}
+
+
+# Read the point rows of a CSV file into records, keeping the row order of the points
+def _read_csv(path):
+    records = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            record = records.setdefault(row["image"], {"image": row["image"], "uv": [], "stain": []})
+            plates = record[row["source"]]
+            plate = int(row["plate"])
+            while len(plates) <= plate:
+                plates.append({"baseline": [], "solvent_line": [], "spots": []})
+            plates[plate][row["type"]].append((float(row["x"]), float(row["y"])))
+    return list(records.values())
+
+
+# Yield annotation records from files and directories
+def read_annotations(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(annotation_extensions))
+            yield from read_annotations(files)
+            continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if path.lower().endswith(".csv"):
+            yield from _read_csv(path)
+        elif path.lower().endswith(".jsonl"):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        yield _record(json.loads(line), stem)
+        else:
+            with open(path) as f:
+                data = json.load(f)
+            if isinstance(data, list) and data and "image" in data[0]:
+                for item in data:
+                    yield _record(item, stem)
+            else:
+                yield _record(data, stem)
+
+
+# Run the ratio engine on the UV-only records and on the UV + stain records
+def _compute(single, uv_stain, pixels_to_cm):
+    output = []
+    if single:
+        batch, plate_batch = ratios.stack_batches([ratios.flatten_annotations(r["uv"])[0] for r in single])
+        table = ratios.compute_ratios(batch, pixels_to_cm)
+        output.append((single, plate_batch, table, "single", set()))
+    if uv_stain:
+        batch, plate_batch = ratios.stack_batches([ratios.flatten_annotations(r["uv"], r["stain"])[0] for r in uv_stain])
+        # uvclick1.1.py gives no results for an image with spots on a plate whose
+        # solvent front is on the baseline; the batch skips those plates instead
+        # and the images are reported as errors
+        front_px = np.abs(batch.solvent_y - batch.baseline_y)
+        failed = set(plate_batch[batch.spot_plate[front_px[batch.spot_plate] == 0]].tolist())
+        table = ratios.compute_ratios(batch, pixels_to_cm, dedup_px=2, sort_by_distance=True, merge_cm=0.1)
+        output.append((uv_stain, plate_batch, table, "uv_stain", failed))
+    return output
+
+
+# Compute the ratios of a batch of records. Records with stain annotations use
+# the UV + stain rules of uvclick1.1.py (including its 0.1 cm merge), the
+# others the UV-only rules of uvclick.py. Yields (record, results, error)
+# where results is a list of (plate index, plate result dict).
+def replay_batch(records, pixels_to_cm):
+    single, uv_stain = [], []
+    for record in records:
+        (uv_stain if record["stain"] else single).append(record)
+
+    # Errors printed by the ratio engine go to stderr, away from the results
+    with contextlib.redirect_stdout(sys.stderr):
+        output = _compute(single, uv_stain, pixels_to_cm)
+
+    for group, plate_batch, table, layout, failed in output:
+        per_record = defaultdict(list)
+        for record_index, plate, result in zip(plate_batch.tolist(), table.plate.tolist(),
+                                               ratios.to_results(table, layout=layout)):
+            per_record[record_index].append((plate, result))
+        for i, record in enumerate(group):
+            if i in failed:
+                yield record, [], "division by zero"
+            else:
+                yield record, per_record.get(i, []), None
+
+
+# Write results as JSON lines: one line per image with the plate results in
+# the uvclick dict format
+def write_jsonl(out, replayed):
+    for record, results, error in replayed:
+        line = {"image": record["image"],
+                "plates": [tlcconfig.plate_names[plate] for plate, _ in results],
+                "results": [result for _, result in results]}
+        if error:
+            line["error"] = error
+        out.write(json.dumps(line) + "\n")
+
+
+# Write results as CSV: one row per component
+def write_csv(writer, replayed):
+    for record, results, error in replayed:
+        if error:
+            print(f"{record['image']}: {error}", file=sys.stderr)
+        for plate, result in results:
+            for component in result["components"]:
+                writer.writerow([record["image"], plate, tlcconfig.plate_names[plate], result["solvent_front_distance_cm"],
+                                 component["component"], component["distance_cm"], component["rf"], component["cv"]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute Rf/CV from saved annotations without the GUI.")
+    parser.add_argument("paths", nargs="+", help="Annotation files (.json, .jsonl, .csv) or folders of them")
+    parser.add_argument("--pixels-to-cm", type=float, default=tlcconfig.pixels_to_cm_uv, help="UV calibration (cm per pixel)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="Output format")
+    parser.add_argument("--output", default="-", help="Output file (default: standard output)")
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    writer = None
+    if args.format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(csv_output_columns)
+
+    def flush(records):
+        replayed = replay_batch(records, args.pixels_to_cm)
+        if writer is not None:
+            write_csv(writer, replayed)
+        else:
+            write_jsonl(out, replayed)
+
+    records = []
+    count = 0
+    try:
+        for record in read_annotations(args.paths):
+            records.append(record)
+            if len(records) >= batch_size:
+                flush(records)
+                count += len(records)
+                records = []
+        if records:
+            flush(records)
+            count += len(records)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Replayed {count} images", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
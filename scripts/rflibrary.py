@@ -0,0 +1,322 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+import numpy as np
+
+import tlcconfig
+
+# Library file: Rf fingerprints with one column per solvent system of tlcconfig.plate_names
+library_path = "./rf_library.npz"
+
+# Largest Rf difference at which a component matches a library entry
+match_tolerance = 0.03
+
+# Entry kinds: known compounds (usually an Rf in every system) and components
+# of past runs (an Rf in the system of their plate only)
+KIND_KNOWN = "known"
+KIND_RUN = "run"
+
+# Queries compared at once against the whole library by the brute-force search
+query_chunk = 16
+
+
+# Reference library of Rf fingerprints: one row per entry with its Rf in each
+# solvent system (NaN when not measured). Each system has a sorted index, so
+# a batch of Rf values is matched with one binary search per value. Whole
+# fingerprints are matched with a KD-tree (scipy, when installed) over the
+# entries with an Rf in every system.
+class RfLibrary:
+    def __init__(self, path=library_path):
+        self.path = path
+        self.systems = len(tlcconfig.plate_names)
+        self.names = np.empty(0, dtype=str)
+        self.kinds = np.empty(0, dtype=str)
+        self.rf = np.empty((0, self.systems), dtype=np.float32)
+        self._order = None
+        self._tree = None
+        if os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            self.names = data["names"]
+            self.kinds = data["kinds"]
+            self.rf = data["rf"]
+            order = data["order"]
+        if self.rf.shape[1] != self.systems:
+            raise ValueError(f"{self.path} has {self.rf.shape[1]} solvent systems, tlcconfig has {self.systems}")
+        self._order = order if order.shape == self.rf.T.shape else None
+        self._tree = None
+
+    # Write the library and its sorted index atomically, so readers never see a partial file
+    def save(self):
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, names=self.names, kinds=self.kinds, rf=self.rf, order=self.order)
+        os.replace(tmp_path, self.path)
+
+    # Append entries: names (N), Rf fingerprints (N x systems, NaN when unknown)
+    def add(self, names, rf, kind):
+        rf = np.asarray(rf, dtype=np.float32).reshape(-1, self.systems)
+        self.names = np.concatenate([self.names, np.asarray(names, dtype=str)])
+        self.kinds = np.concatenate([self.kinds, np.full(len(rf), kind)])
+        self.rf = np.concatenate([self.rf, rf])
+        self._order = None
+        self._tree = None
+
+    # Entry numbers sorted by Rf, per system (systems x N); the NaNs sort last
+    @property
+    def order(self):
+        if self._order is None:
+            self._order = np.argsort(self.rf, axis=0, kind="stable").T.astype(np.int32)
+        return self._order
+
+    # Nearest entry to each Rf value measured in one system. Returns the entry
+    # number (-1 when the system has no entries), the Rf difference and the
+    # number of entries within the tolerance.
+    def match(self, system, values, tolerance=match_tolerance):
+        values = np.asarray(values, dtype=np.float32)
+        order = self.order[system]
+        known = int(np.count_nonzero(~np.isnan(self.rf[:, system])))
+        if known == 0:
+            return (np.full(values.shape, -1), np.full(values.shape, np.inf, dtype=np.float32),
+                    np.zeros(values.shape, dtype=np.int64))
+        order = order[:known]
+        sorted_rf = self.rf[order, system]
+
+        # The nearest entry is on one side of the insertion point
+        right = np.clip(np.searchsorted(sorted_rf, values), 0, known - 1)
+        left = np.clip(right - 1, 0, known - 1)
+        take_left = np.abs(sorted_rf[left] - values) <= np.abs(sorted_rf[right] - values)
+        nearest = np.where(take_left, left, right)
+        difference = np.abs(sorted_rf[nearest] - values)
+        within = (np.searchsorted(sorted_rf, values + tolerance, side="right")
+                  - np.searchsorted(sorted_rf, values - tolerance, side="left"))
+        return order[nearest], difference, within
+
+    # Entries with an Rf in every system, and their KD-tree (None without scipy)
+    def _complete(self):
+        if self._tree is None:
+            complete = np.flatnonzero(~np.isnan(self.rf).any(axis=1))
+            try:
+                from scipy.spatial import cKDTree
+            except ImportError:
+                tree = None
+            else:
+                tree = cKDTree(self.rf[complete]) if complete.size else None
+            self._tree = (complete, tree)
+        return self._tree
+
+    # Nearest complete fingerprints to each query fingerprint (Q x systems).
+    # Systems missing from a query (NaN) are left out of its distance, the
+    # root mean square Rf difference. Returns entry numbers and distances (Q x k).
+    def nearest(self, fingerprints, k=1):
+        fingerprints = np.asarray(fingerprints, dtype=np.float32).reshape(-1, self.systems)
+        complete, tree = self._complete()
+        k = min(k, complete.size)
+        entries = np.full((len(fingerprints), k), -1)
+        distances = np.full((len(fingerprints), k), np.inf, dtype=np.float32)
+        if k == 0:
+            return entries, distances
+
+        present = ~np.isnan(fingerprints)
+        full = present.all(axis=1)
+        if tree is not None and full.any():
+            d, i = tree.query(fingerprints[full], k=k)
+            entries[full] = complete[np.reshape(i, (-1, k))]
+            distances[full] = np.reshape(d, (-1, k)) / np.sqrt(self.systems)
+            rest = np.flatnonzero(~full)
+        else:
+            rest = np.arange(len(fingerprints))
+
+        # Brute force over the complete entries, a chunk of queries at a time
+        library = self.rf[complete]
+        for start in range(0, rest.size, query_chunk):
+            rows = rest[start:start + query_chunk]
+            squared = np.zeros((rows.size, len(library)), dtype=np.float32)
+            for system in range(self.systems):
+                queried = present[rows, system]
+                if queried.any():
+                    squared[queried] += (library[:, system] - fingerprints[rows[queried], system, None]) ** 2
+            counts = np.maximum(present[rows].sum(axis=1), 1)
+            rms = np.sqrt(squared / counts[:, None])
+            best = np.argsort(rms, axis=1)[:, :k]
+            entries[rows] = complete[best]
+            distances[rows] = np.take_along_axis(rms, best, axis=1)
+        return entries, distances
+
+
+# Solvent system of each plate result in a record: "plates" is a list of
+# plate names (replay.py) or plate dicts (pipeline.py, capture.py). None when
+# the plates do not line up with the results.
+def record_systems(record):
+    plates = record.get("plates") or []
+    results = record.get("results") or []
+    systems = [plate["index"] if isinstance(plate, dict) else tlcconfig.plate_names.index(plate) for plate in plates]
+    if len(systems) != len(results):
+        return None
+    return systems
+
+
+# Components of result records as flat columns: record number, system,
+# component name and Rf
+def components(records):
+    record_rows, systems, names, values = [], [], [], []
+    for row, record in enumerate(records):
+        if not record.get("results"):
+            continue
+        plate_systems = record_systems(record)
+        if plate_systems is None:
+            print(f"{record.get('image')}: plates and results do not line up. Skipping...")
+            continue
+        for system, result in zip(plate_systems, record["results"]):
+            for component in result["components"]:
+                if component.get("rf") is None:
+                    continue
+                record_rows.append(row)
+                systems.append(system)
+                names.append(component["component"])
+                values.append(component["rf"])
+    return (np.array(record_rows, dtype=np.int64), np.array(systems, dtype=np.int64),
+            names, np.array(values, dtype=np.float32))
+
+
+# Add the components of result records as run entries, one per component with
+# the Rf in the system of its plate
+def add_runs(library, records):
+    record_rows, systems, names, values = components(records)
+    rf = np.full((len(values), library.systems), np.nan, dtype=np.float32)
+    rf[np.arange(len(values)), systems] = values
+    entry_names = [f"{records[row].get('image')}:{tlcconfig.plate_names[system][0]}:{name}"
+                   for row, system, name in zip(record_rows.tolist(), systems.tolist(), names)]
+    library.add(entry_names, rf, KIND_RUN)
+    return len(values)
+
+
+# Add known compounds from a CSV file: name, then one Rf column per solvent
+# system in plate order (empty when not measured)
+def add_known(library, path):
+    names, rows = [], []
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if len(header) != library.systems + 1:
+            raise ValueError(f"{path}: expected a name and {library.systems} Rf columns")
+        for row in reader:
+            if not row:
+                continue
+            names.append(row[0])
+            rows.append([float(v) if v.strip() else np.nan for v in row[1:]])
+    library.add(names, rows, KIND_KNOWN)
+    return len(names)
+
+
+# Match every component of a batch of result records against the library,
+# with one vectorized search per solvent system. Yields one report per
+# record; components with no entry within the tolerance are flagged as
+# unmatched (possible impurities).
+def match_records(library, records, tolerance=match_tolerance):
+    record_rows, systems, names, values = components(records)
+    nearest = np.full(len(values), -1)
+    difference = np.full(len(values), np.inf, dtype=np.float32)
+    within = np.zeros(len(values), dtype=np.int64)
+    for system in np.unique(systems):
+        rows = np.flatnonzero(systems == system)
+        nearest[rows], difference[rows], within[rows] = library.match(system, values[rows], tolerance)
+
+    reports = [{"image": record.get("image"), "components": [], "unmatched": 0} for record in records]
+    for i in range(len(values)):
+        report = reports[record_rows[i]]
+        matched = bool(within[i])
+        report["components"].append({
+            "plate": tlcconfig.plate_names[systems[i]],
+            "component": names[i],
+            "rf": round(float(values[i]), 3),
+            "nearest": str(library.names[nearest[i]]) if matched else None,
+            "difference": round(float(difference[i]), 3) if matched else None,
+            "matches": int(within[i]),
+        })
+        report["unmatched"] += not matched
+    return reports
+
+
+# Read result records from JSON lines files ("-" for standard input)
+def read_records(paths):
+    records = []
+    for path in paths:
+        f = sys.stdin if path == "-" else open(path)
+        with f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reference library of Rf fingerprints for matching components.")
+    parser.add_argument("--library", default=library_path, help="Library file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    known = commands.add_parser("add-known", help="Add known compounds from a CSV file (name, one Rf per system)")
+    known.add_argument("csv")
+    runs = commands.add_parser("add-runs", help="Add the components of result JSON lines as past runs")
+    runs.add_argument("results", nargs="+")
+    match = commands.add_parser("match", help="Match the components of result JSON lines against the library")
+    match.add_argument("results", nargs="+")
+    match.add_argument("--tolerance", type=float, default=match_tolerance, help="Largest Rf difference of a match")
+    match.add_argument("--output", default=None, help="Write the match reports as JSON lines to this file")
+    lookup = commands.add_parser("nearest", help="Nearest known fingerprints of Rf values (NaN for a missing system)")
+    lookup.add_argument("rf", type=float, nargs="+")
+    lookup.add_argument("-k", type=int, default=3)
+    commands.add_parser("info", help="Show the number of entries per kind and system")
+    args = parser.parse_args()
+
+    library = RfLibrary(args.library)
+
+    if args.command == "add-known":
+        added = add_known(library, args.csv)
+        library.save()
+        print(f"Added {added} known compounds ({len(library)} entries)")
+    elif args.command == "add-runs":
+        added = add_runs(library, read_records(args.results))
+        library.save()
+        print(f"Added {added} run components ({len(library)} entries)")
+    elif args.command == "match":
+        records = read_records(args.results)
+        start = time.perf_counter()
+        reports = match_records(library, records, args.tolerance)
+        elapsed = time.perf_counter() - start
+        out = open(args.output, "w") if args.output else None
+        for report in reports:
+            if out:
+                out.write(json.dumps(report) + "\n")
+            for component in report["components"]:
+                if component["nearest"] is None:
+                    print(f"{report['image']}: {component['plate']} {component['component']} "
+                          f"(Rf {component['rf']}) has no match")
+        if out:
+            out.close()
+        count = sum(len(r["components"]) for r in reports)
+        unmatched = sum(r["unmatched"] for r in reports)
+        print(f"Matched {count} components of {len(reports)} images against {len(library)} entries "
+              f"in {elapsed * 1000:.1f} ms; {unmatched} unmatched")
+    elif args.command == "nearest":
+        if len(args.rf) != library.systems:
+            parser.error(f"expected {library.systems} Rf values")
+        entries, distances = library.nearest([args.rf], args.k)
+        for entry, distance in zip(entries[0], distances[0]):
+            if entry >= 0:
+                print(f"{library.names[entry]}: RMS difference {distance:.3f}")
+    else:
+        print(f"{len(library)} entries in {args.library}")
+        for kind in (KIND_KNOWN, KIND_RUN):
+            print(f"  {kind}: {int(np.count_nonzero(library.kinds == kind))}")
+        for system, name in enumerate(tlcconfig.plate_names):
+            print(f"  {name}: {int(np.count_nonzero(~np.isnan(library.rf[:, system])))} Rf values")
+
+
+if __name__ == "__main__":
+    main()
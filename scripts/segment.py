@@ -0,0 +1,286 @@
+import os
+import json
+import argparse
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import instrument
+import tlcconfig
+from stagecache import StageCache, array_hash, stage_key
+
+# Fraction of the image area below which a region cannot be a plate
+min_plate_area_fraction = 0.005
+
+# Opening applied to the bright plate regions to cut thin bridges between plates
+region_kernel_size = 5
+
+
+# One segmented plate: its position in the A-F order, bounding box and mask
+class PlateROI(namedtuple("PlateROI", ["index", "name", "x", "y", "w", "h", "mask"])):
+    __slots__ = ()
+
+    # Bounding box as (x, y, w, h)
+    @property
+    def box(self):
+        return self.x, self.y, self.w, self.h
+
+    # View of the plate region in a full image (no copy)
+    def crop(self, image):
+        return image[self.y:self.y + self.h, self.x:self.x + self.w]
+
+
+# Plate segmentation engine. Work buffers are allocated once per image size and
+# reused across calls, so segmenting a batch of same-sized captures does not
+# allocate full-size arrays for each image.
+class PlateSegmenter:
+    def __init__(self, lower_green=tlcconfig.lower_green, upper_green=tlcconfig.upper_green,
+                 canny_low=tlcconfig.canny_low, canny_high=tlcconfig.canny_high,
+                 kernel_size=tlcconfig.morph_kernel_size, plate_names=tlcconfig.plate_names, cache=None):
+        self.lower_green = np.asarray(lower_green, dtype=np.uint8)
+        self.upper_green = np.asarray(upper_green, dtype=np.uint8)
+        self.canny_low = canny_low
+        self.canny_high = canny_high
+        self.kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        self.region_kernel = np.ones((region_kernel_size, region_kernel_size), np.uint8)
+        self.plate_names = plate_names
+        self.cache = cache  # Optional stagecache.StageCache
+        self.shape = None
+
+    # (Re)allocate the work buffers when the image size changes
+    def _allocate(self, shape):
+        if self.shape == shape:
+            return
+        height, width = shape
+        self.hsv = np.empty((height, width, 3), np.uint8)
+        self.plate_mask = np.empty((height, width), np.uint8)
+        self.scratch = np.empty((height, width), np.uint8)
+        self.gray = np.empty((height, width), np.uint8)
+        self.equalized = np.empty((height, width), np.uint8)
+        self.masked_equalized = np.empty((height, width), np.uint8)
+        self.edges = np.empty((height, width), np.uint8)
+        self.regions = np.empty((height, width), np.uint8)
+        self.labels = np.empty((height, width), np.int32)
+        self.shape = shape
+
+    # Plate mask, grey image and bright plate regions: everything segment()
+    # reads. With a cache, the mask and the regions are looked up by the
+    # image content and the parameters of their step and the steps before it.
+    def prepare(self, image):
+        self._allocate(image.shape[:2])
+        self._gray(image)
+        if self.cache is None:
+            self._mask(image)
+            self._regions()
+            return
+
+        self.image_key = array_hash(image)
+        self.mask_key = stage_key(self.image_key, "mask", {"lower_green": self.lower_green.tolist(),
+                                                           "upper_green": self.upper_green.tolist(),
+                                                           "kernel": self.kernel.shape[0]})
+        regions_key = stage_key(self.mask_key, "regions", {"kernel": self.region_kernel.shape[0]})
+        self._cached("mask", self.mask_key, lambda: self._mask(image), self.plate_mask)
+        self._cached("regions", regions_key, self._regions, self.regions)
+
+    # Equalized edges of the plate area and their external contours, for
+    # drawing (imageprocess.py); plate selection does not use them. Reads the
+    # buffers of the last prepare() or segment() call, and leaves the edge
+    # image in self.edges.
+    def detect_edges(self):
+        if self.cache is None:
+            self._equalize()
+            self._edges()
+            return self._contours()
+
+        equalize_key = stage_key(self.image_key, "equalize", {})
+        edges_key = stage_key(self.mask_key + equalize_key, "edges", {"canny_low": self.canny_low,
+                                                                     "canny_high": self.canny_high})
+        contours_key = stage_key(edges_key, "contours", {"mode": "external"})
+        self._cached("equalize", equalize_key, self._equalize, self.equalized)
+        self._cached("edges", edges_key, self._edges, self.edges)
+        contours = self.cache.get("contours", contours_key)
+        if contours is None:
+            contours = self._contours()
+            self.cache.put(contours_key, contours)
+        return contours
+
+    # All steps, edges included; returns the edge contours
+    def run(self, image):
+        self.prepare(image)
+        return self.detect_edges()
+
+    # Fill the buffers of a stage from the cache, or compute and store them
+    def _cached(self, stage, key, compute, *buffers):
+        cached = self.cache.get(stage, key)
+        if cached is None:
+            compute()
+            self.cache.put(key, buffers)
+        else:
+            for buffer, array in zip(buffers, cached):
+                np.copyto(buffer, array)
+
+    # Mask the low green pixels of the plates
+    def _mask(self, image):
+        with instrument.stage("hsv", image):
+            cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=self.hsv)
+        with instrument.stage("in_range", image):
+            cv2.inRange(self.hsv, self.lower_green, self.upper_green, dst=self.plate_mask)
+
+        # Apply morphological operations to clean up the mask
+        with instrument.stage("morphology", image):
+            cv2.morphologyEx(self.plate_mask, cv2.MORPH_CLOSE, self.kernel, dst=self.scratch)  # Fill small holes
+            cv2.morphologyEx(self.scratch, cv2.MORPH_OPEN, self.kernel, dst=self.plate_mask)   # Remove small noise
+
+    def _gray(self, image):
+        with instrument.stage("gray", image):
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+    # Enhance contrast using histogram equalization
+    def _equalize(self):
+        with instrument.stage("equalize", self.gray):
+            cv2.equalizeHist(self.gray, dst=self.equalized)
+
+    # Keep only the plate area and detect edges. The mask is 0/255, so a plain
+    # AND gives the same result as a masked copy onto zeros.
+    def _edges(self):
+        with instrument.stage("canny", self.edges):
+            cv2.bitwise_and(self.equalized, self.plate_mask, dst=self.masked_equalized)
+            cv2.Canny(self.masked_equalized, self.canny_low, self.canny_high, edges=self.edges)
+
+    def _contours(self):
+        with instrument.stage("contours", self.edges):
+            contours, _ = cv2.findContours(self.edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return list(contours)
+
+    # Plate regions: the bright part of the plate mask. The green HSV range
+    # also accepts dim background, so the masked pixels are split with an
+    # Otsu threshold on the gray image.
+    def _regions(self):
+        with instrument.stage("plate_regions", self.gray):
+            pixels = self.gray[self.plate_mask > 0]
+            if pixels.size == 0:
+                self.regions[:] = 0
+                return
+            threshold, _ = cv2.threshold(pixels.reshape(1, -1), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            cv2.threshold(self.gray, threshold, 255, cv2.THRESH_BINARY, dst=self.scratch)
+            cv2.bitwise_and(self.scratch, self.plate_mask, dst=self.scratch)
+            cv2.morphologyEx(self.scratch, cv2.MORPH_OPEN, self.region_kernel, dst=self.regions)
+
+    # Segment the image into the plates, sorted left to right. Only the mask
+    # and region steps run; call detect_edges() afterwards for the edges.
+    def segment(self, image):
+        self.prepare(image)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(self.regions, labels=self.labels, connectivity=4)
+
+        # Pencil lines and spots cut plates into stacked pieces; pieces in the same column are joined
+        min_piece_area = min_plate_area_fraction * image.shape[0] * image.shape[1] / 10
+        pieces = [(tuple(stats[label, :4].tolist()), [label]) for label in range(1, count)
+                  if stats[label, cv2.CC_STAT_AREA] >= min_piece_area]
+        regions = dict(merge_columns(pieces))
+
+        selected = select_plates(list(regions), image.shape[:2], len(self.plate_names))
+        plates = []
+        for index, (x, y, w, h) in enumerate(selected):
+            labels = regions[(x, y, w, h)]
+            mask = np.isin(self.labels[y:y + h, x:x + w], labels).astype(np.uint8) * 255
+            plates.append(PlateROI(index, self.plate_names[index], x, y, w, h, mask))
+        return plates
+
+
+# Join (box, labels) pieces whose horizontal extents overlap by at least half
+# of the narrower one; returns the joined (box, labels) regions
+def merge_columns(pieces):
+    regions = []
+    for box, labels in sorted(pieces, key=lambda piece: piece[0][0]):
+        for i, (other, other_labels) in enumerate(regions):
+            overlap = min(box[0] + box[2], other[0] + other[2]) - max(box[0], other[0])
+            if overlap >= 0.5 * min(box[2], other[2]):
+                x0 = min(box[0], other[0])
+                y0 = min(box[1], other[1])
+                x1 = max(box[0] + box[2], other[0] + other[2])
+                y1 = max(box[1] + box[3], other[1] + other[3])
+                regions[i] = ((x0, y0, x1 - x0, y1 - y0), other_labels + labels)
+                break
+        else:
+            regions.append((box, labels))
+    return regions
+
+
+# Pick the plates out of candidate (x, y, w, h) boxes: boxes smaller than
+# min_plate_area_fraction of the image are dropped, and the `count` largest
+# are returned sorted left to right
+def select_plates(boxes, shape, count=len(tlcconfig.plate_names)):
+    min_area = min_plate_area_fraction * shape[0] * shape[1]
+    boxes = [b for b in boxes if b[2] * b[3] >= min_area]
+    if len(boxes) < count:
+        raise ValueError(f"Expected {count} plates, found {len(boxes)}")
+    boxes = sorted(boxes, key=lambda b: b[2] * b[3], reverse=True)[:count]
+    return sorted(boxes, key=lambda b: b[0])
+
+
+# Shared segmenter for callers that do not manage their own
+_default_segmenter = None
+
+
+def segment_plates(image):
+    global _default_segmenter
+    if _default_segmenter is None:
+        _default_segmenter = PlateSegmenter()
+    return _default_segmenter.segment(image)
+
+
+# Plate boxes as JSON-serialisable dicts
+def plates_to_dicts(plates):
+    return [{"index": p.index, "name": p.name, "x": p.x, "y": p.y, "w": p.w, "h": p.h} for p in plates]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment the six TLC plates in every image of a folder (headless).")
+    parser.add_argument("input", help="Folder with captures")
+    parser.add_argument("--output", default="./segmented", help="Folder for the plate boxes and optional images")
+    parser.add_argument("--overlay", action="store_true", help="Also write the image with plate boxes drawn")
+    parser.add_argument("--crops", action="store_true", help="Also write one image per plate")
+    parser.add_argument("--cache", default=None, help="Cache folder for the stage outputs (default: no cache)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    cache = StageCache(args.cache) if args.cache else None
+    segmenter = PlateSegmenter(cache=cache)
+
+    for filename in sorted(os.listdir(args.input)):
+        with instrument.stage("decode") as stage:
+            image = cv2.imread(os.path.join(args.input, filename))
+            stage.set_image(image)
+        if image is None:
+            continue
+        stem = os.path.splitext(filename)[0]
+        try:
+            plates = segmenter.segment(image)
+        except ValueError as e:
+            print(f"{filename}: {e}. Skipping...")
+            continue
+
+        with instrument.stage("export", image):
+            with open(os.path.join(args.output, stem + ".json"), "w") as f:
+                json.dump({"image": filename, "plates": plates_to_dicts(plates)}, f, indent=2)
+
+            if args.crops:
+                for p in plates:
+                    cv2.imwrite(os.path.join(args.output, f"{stem}_{p.name[0]}.jpg"), p.crop(image))
+
+            if args.overlay:
+                for p in plates:
+                    cv2.rectangle(image, (p.x, p.y), (p.x + p.w, p.y + p.h), (255, 255, 255), 2)
+                    cv2.putText(image, p.name[0], (p.x + 5, p.y + 25), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+                cv2.imwrite(os.path.join(args.output, stem + "_plates.jpg"), image)
+
+        print(f"{filename}: {len(plates)} plates")
+
+    if cache is not None:
+        print("Stage cache:")
+        cache.print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import instrument
+import tlcconfig
+import foldersort
+from segment import segment_plates, plates_to_dicts
+from linedetect import detect_lines, min_confidence
+from ratios import calculate_ratios_single
+
+# Spot area limits as fractions of the plate area
+min_spot_area = 0.0005
+max_spot_area = 0.05
+
+# Rows next to the baseline and solvent front excluded from the search (fraction of their distance),
+# so the pencil line and the front itself are not reported as spots
+line_margin = 0.04
+
+# Gaussian blur applied before thresholding to merge speckle noise
+blur_size = 5
+
+# Width of the band along the plate outline (fraction of the plate width, at
+# least 2 pixels) where the shaded plate edges are; components reaching into
+# it are not spots
+edge_margin = 0.06
+
+
+# Find spot centroids on one plate ROI between the baseline and the solvent
+# front (rows of the ROI). Spots are dark on the plate both under UV light
+# (fluorescence quenching) and after staining, so they are the foreground of
+# an inverted Otsu threshold. Components reaching into the band along the
+# plate outline are the shaded plate edges, not spots. Returns (x, y) tuples
+# in ROI coordinates.
+def detect_spots(plate_image, baseline_y, solvent_y, mask=None):
+    gray = plate_image if plate_image.ndim == 2 else cv2.cvtColor(plate_image, cv2.COLOR_BGR2GRAY)
+    top, bottom = sorted((solvent_y, baseline_y))
+    margin = int((bottom - top) * line_margin)
+    top += margin
+    bottom -= margin
+    if bottom - top < 3:
+        return []
+
+    lane = cv2.GaussianBlur(gray[top:bottom], (blur_size, blur_size), 0)
+    lane_mask = None if mask is None else mask[top:bottom]
+
+    # Otsu threshold computed on the plate pixels only
+    pixels = lane if lane_mask is None else lane[lane_mask > 0]
+    if pixels.size == 0:
+        return []
+    threshold, _ = cv2.threshold(pixels.reshape(1, -1), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, binary = cv2.threshold(lane, threshold, 255, cv2.THRESH_BINARY_INV)
+    if lane_mask is not None:
+        cv2.bitwise_and(binary, lane_mask, dst=binary)
+
+    # Band along the plate outline (the ROI box without a mask). Holes in the
+    # mask, such as dark spots, are filled so only the outer edge is banded.
+    outline = np.full(gray.shape, 255, np.uint8)
+    if mask is not None:
+        outline[:] = 0
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(outline, contours, -1, 255, cv2.FILLED)
+    size = 2 * max(2, int(round(gray.shape[1] * edge_margin))) + 1
+    inner = cv2.erode(outline, np.ones((size, size), np.uint8),
+                      borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    edge = cv2.subtract(outline, inner)[top:bottom]
+
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    plate_area = gray.shape[0] * gray.shape[1]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = (areas >= min_spot_area * plate_area) & (areas <= max_spot_area * plate_area)
+    keep &= ~np.isin(np.arange(1, count), labels[edge > 0])
+    centroids = centroids[1:][keep]
+    return [(int(round(x)), int(round(y)) + top) for x, y in centroids]
+
+
+# Headless annotation of a whole capture: plates, baseline, solvent line and
+# spots in the same dict format the uvclick scripts build from clicks. Plates
+# whose lines were detected with less than linedetect.min_confidence are
+# flagged "low_confidence" for an operator to check.
+def annotate_image(image):
+    annotations = []
+    plates = segment_plates(image)
+    for plate in plates:
+        roi = plate.crop(image)
+        with instrument.stage("lines", roi):
+            lines = detect_lines(roi, plate.mask)
+        with instrument.stage("spots", roi):
+            spots = detect_spots(roi, lines.baseline_y, lines.solvent_y, plate.mask)
+        x = plate.x + plate.w // 2
+        plate_annotations = {
+            "baseline": [(x, lines.baseline_y + plate.y)],
+            "solvent_line": [(x, lines.solvent_y + plate.y)],
+            "spots": [(sx + plate.x, sy + plate.y) for sx, sy in spots],
+            "confidence": round(lines.confidence, 3),
+        }
+        if lines.confidence < min_confidence:
+            plate_annotations["low_confidence"] = True
+        annotations.append(plate_annotations)
+    return plates, annotations
+
+
+# Carry the low-confidence flag of each plate's annotations over to its
+# ratio results (one result per plate, in order)
+def flag_results(annotations, results):
+    for plate_annotations, result in zip(annotations, results):
+        if plate_annotations.get("low_confidence"):
+            result["low_confidence"] = True
+    return results
+
+
+# Worker task: annotate one image file
+def process_file(image_path):
+    with instrument.stage("decode") as stage:
+        image = cv2.imread(image_path)
+        stage.set_image(image)
+    if image is None:
+        return image_path, None, "could not load image"
+    try:
+        plates, annotations = annotate_image(image)
+    except ValueError as e:
+        return image_path, None, str(e)
+    return image_path, {"plates": plates_to_dicts(plates), "annotations": annotations}, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect baselines, solvent fronts and spots in a folder of UV captures (headless).")
+    parser.add_argument("input", help="Folder with UV captures")
+    parser.add_argument("--output", default="./annotations", help="Folder for the annotation files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    paths = sorted(os.path.join(args.input, f) for f in os.listdir(args.input)
+                   if f.lower().endswith(foldersort.image_extensions))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for image_path, result, error in pool.map(process_file, paths):
+            filename = os.path.basename(image_path)
+            if error is not None:
+                print(f"{filename}: {error}. Skipping...")
+                continue
+
+            annotations = result["annotations"]
+            results = calculate_ratios_single(annotations, tlcconfig.pixels_to_cm_uv)
+            record = {
+                "image": image_path,
+                "plates": result["plates"],
+                "uv": annotations,
+                "results": flag_results(annotations, results),
+            }
+            stem = os.path.splitext(filename)[0]
+            with instrument.stage("export"), open(os.path.join(args.output, stem + ".json"), "w") as f:
+                json.dump(record, f, indent=2)
+            spot_count = sum(len(a["spots"]) for a in annotations)
+            print(f"{filename}: {spot_count} spots on {len(annotations)} plates")
+            unsure = [str(i + 1) for i, a in enumerate(annotations) if a.get("low_confidence")]
+            if unsure:
+                print(f"{filename}: lines of plate(s) {', '.join(unsure)} detected with low confidence. Check them in uvclick.")
+
+
+if __name__ == "__main__":
+    main()
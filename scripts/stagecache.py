@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+# Default cache location and size limit
+cache_path = "./.tlc_cache"
+cache_size_limit = 2 * 1024 ** 3  # 2 GB
+
+
+# Hash of an image's pixels (shape and dtype included)
+def array_hash(array):
+    digest = hashlib.sha1()
+    digest.update(f"{array.shape}{array.dtype}".encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+# Key of a stage output: the key of its input plus the stage name and parameters.
+# Chaining keys this way means a changed parameter only invalidates its own
+# stage and the stages after it.
+def stage_key(upstream_key, stage, params):
+    digest = hashlib.sha1()
+    digest.update(upstream_key.encode())
+    digest.update(stage.encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+# On-disk cache of pipeline stage outputs (lists of arrays) with a
+# total size limit and least-recently-used eviction. Each entry is one .npz
+# file; its mtime is refreshed on every hit and used as the LRU order.
+class StageCache:
+    def __init__(self, path=cache_path, size_limit=cache_size_limit):
+        self.path = path
+        self.size_limit = size_limit
+        os.makedirs(path, exist_ok=True)
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.entries = {}  # key -> (size, last use)
+        for entry in os.scandir(path):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                self.entries[entry.name[:-4]] = (stat.st_size, stat.st_mtime)
+        self.size = sum(size for size, _ in self.entries.values())
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    # Cached output of `stage` as a list of arrays, or None
+    def get(self, stage, key):
+        if key not in self.entries:
+            self.misses[stage] += 1
+            return None
+        try:
+            with np.load(self._file(key)) as data:
+                arrays = [data[f"arr_{i}"] for i in range(len(data.files))]
+        except (OSError, ValueError):
+            self._remove(key)
+            self.misses[stage] += 1
+            return None
+        os.utime(self._file(key))
+        self.entries[key] = (self.entries[key][0], os.path.getmtime(self._file(key)))
+        self.hits[stage] += 1
+        return arrays
+
+    # Store the output of a stage as a list of arrays
+    def put(self, key, arrays):
+        tmp_path = self._file(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, *arrays)
+        os.replace(tmp_path, self._file(key))
+        size = os.path.getsize(self._file(key))
+        if key in self.entries:
+            self.size -= self.entries[key][0]
+        self.entries[key] = (size, os.path.getmtime(self._file(key)))
+        self.size += size
+        self._evict()
+
+    def _remove(self, key):
+        size, _ = self.entries.pop(key, (0, 0))
+        self.size -= size
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    # Remove least recently used entries until the cache fits its size limit
+    def _evict(self):
+        if self.size <= self.size_limit:
+            return
+        for key, _ in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.size <= self.size_limit:
+                break
+            self._remove(key)
+
+    # Hits and misses per stage
+    def report(self):
+        stages = sorted(set(self.hits) | set(self.misses))
+        return {stage: {"hits": self.hits[stage], "misses": self.misses[stage]} for stage in stages}
+
+    def print_report(self):
+        for stage, counts in self.report().items():
+            print(f"  {stage}: {counts['hits']} hits, {counts['misses']} misses")
+        print(f"  cache size: {self.size / 1024 ** 2:.1f} MB of {self.size_limit / 1024 ** 2:.0f} MB")
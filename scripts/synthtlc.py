@@ -0,0 +1,160 @@
+import os
+import json
+import argparse
+
+import cv2
+import numpy as np
+
+import tlcconfig
+
+# Default capture size (width, height); TLC1.png is 504x305
+image_size = (1008, 610)
+
+# Plate size as fractions of the image width and height, and the horizontal
+# band the six plates are spread over
+plate_size = (0.11, 0.52)
+plate_band = (0.06, 0.94)
+
+# Baseline and solvent front as fractions of the plate height from the top
+baseline_range = (0.82, 0.9)
+solvent_range = (0.08, 0.16)
+
+# Spots per plate and their radius as a fraction of the plate width
+spot_count_range = (1, 4)
+spot_radius_range = (0.07, 0.12)
+
+# Largest stain capture misalignment with misalign=True: rotation (degrees)
+# and shift (fraction of the image size)
+max_rotation = 2.0
+max_shift = 0.04
+
+# Colours (BGR) per source: background, plate, pencil line, spots
+colors = {
+    "uv": {"background": (70, 45, 25), "plate": (40, 235, 60), "line": (30, 120, 40), "spot": (30, 110, 40)},
+    "stain": {"background": (200, 200, 195), "plate": (235, 240, 240), "line": (120, 120, 120), "spot": (150, 70, 130)},
+}
+
+
+# Random layout shared by the UV and stain captures of one set of plates:
+# plate boxes, baseline and solvent front rows and spot ellipses, in
+# full-image coordinates
+def random_layout(rng, width, height, plate_names=tlcconfig.plate_names):
+    count = len(plate_names)
+    pitch = width * (plate_band[1] - plate_band[0]) / count
+    plates = []
+    for i, name in enumerate(plate_names):
+        w = int(width * plate_size[0] * rng.uniform(0.9, 1.1))
+        h = int(height * plate_size[1] * rng.uniform(0.95, 1.05))
+        x = int(width * plate_band[0] + pitch * i + (pitch - w) / 2 + rng.uniform(-0.03, 0.03) * w)
+        y = int(height * 0.33 + rng.uniform(-0.02, 0.02) * height)
+        baseline_y = y + int(h * rng.uniform(*baseline_range))
+        solvent_y = y + int(h * rng.uniform(*solvent_range))
+
+        spots = []
+        for _ in range(rng.integers(spot_count_range[0], spot_count_range[1] + 1)):
+            rf = rng.uniform(0.1, 0.9)
+            rx = w * rng.uniform(*spot_radius_range)
+            spots.append([x + w / 2 + rng.uniform(-0.15, 0.15) * w,
+                          baseline_y - rf * (baseline_y - solvent_y),
+                          rx, rx * rng.uniform(0.6, 1.0)])
+        plates.append({"name": name, "x": x, "y": y, "w": w, "h": h,
+                       "baseline_y": baseline_y, "solvent_y": solvent_y, "spots": spots})
+    return plates
+
+
+# Render one capture of a layout. `noise` is the standard deviation of the
+# Gaussian sensor noise in grey levels.
+def render(layout, width, height, source="uv", noise=4.0, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    palette = colors[source]
+    image = np.empty((height, width, 3), np.float32)
+    image[:] = palette["background"]
+    # Uneven illumination across the frame
+    image *= np.linspace(0.8, 1.1, width, dtype=np.float32)[None, :, None]
+
+    for plate in layout:
+        x, y, w, h = plate["x"], plate["y"], plate["w"], plate["h"]
+        image[y:y + h, x:x + w] = palette["plate"]
+        # The eluted part of the plate is slightly darker than the dry part above the front
+        image[plate["solvent_y"]:y + h, x:x + w] *= 0.9
+        thickness = max(1, h // 150)
+        cv2.line(image, (x, plate["baseline_y"]), (x + w - 1, plate["baseline_y"]), palette["line"], thickness)
+        for sx, sy, rx, ry in plate["spots"]:
+            cv2.ellipse(image, (int(round(sx)), int(round(sy))), (int(round(rx)), int(round(ry))),
+                        0, 0, 360, palette["spot"], -1, cv2.LINE_AA)
+
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    if noise > 0:
+        image += rng.normal(0, noise, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+# Ground truth of a layout as uvclick annotations (one dict per plate)
+def layout_annotations(layout):
+    annotations = []
+    for plate in layout:
+        x = plate["x"] + plate["w"] // 2
+        annotations.append({
+            "baseline": [(x, plate["baseline_y"])],
+            "solvent_line": [(x, plate["solvent_y"])],
+            "spots": [(int(round(sx)), int(round(sy))) for sx, sy, _, _ in plate["spots"]],
+        })
+    return annotations
+
+
+# Render a UV/stain capture pair with its ground truth record. With
+# misalign, the stain capture is rotated and shifted as if the plates moved
+# between the captures; the truth then holds the stain annotations in stain
+# coordinates and the stain-to-UV transform.
+def generate_pair(seed, width=image_size[0], height=image_size[1], noise=4.0, misalign=False):
+    rng = np.random.default_rng(seed)
+    layout = random_layout(rng, width, height)
+    uv = render(layout, width, height, "uv", noise, rng)
+    stain = render(layout, width, height, "stain", noise, rng)
+    annotations = layout_annotations(layout)
+    truth = {"plates": layout, "uv": annotations, "stain": annotations}
+    if misalign:
+        angle = rng.uniform(-max_rotation, max_rotation)
+        uv_to_stain = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        uv_to_stain[:, 2] += rng.uniform(-max_shift, max_shift, 2) * (width, height)
+        stain = cv2.warpAffine(stain, uv_to_stain, (width, height), borderMode=cv2.BORDER_REPLICATE)
+
+        def to_stain(points):
+            return [tuple(int(round(v)) for v in uv_to_stain[:, :2] @ p + uv_to_stain[:, 2]) for p in points]
+        truth["stain"] = [{key: to_stain(points) for key, points in plate.items()} for plate in annotations]
+        truth["stain_to_uv"] = cv2.invertAffineTransform(uv_to_stain).tolist()
+    return uv, stain, truth
+
+
+# Write `count` capture pairs and truth.jsonl (one record per pair, readable by replay.py)
+def write_dataset(output, count, width=image_size[0], height=image_size[1], noise=4.0, seed=0, extension=".jpg",
+                  misalign=False):
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, "truth.jsonl"), "w") as f:
+        for i in range(count):
+            uv, stain, truth = generate_pair(seed + i, width, height, noise, misalign)
+            stem = f"{i:05d}"
+            cv2.imwrite(os.path.join(output, f"uv_{stem}{extension}"), uv)
+            cv2.imwrite(os.path.join(output, f"stain_{stem}{extension}"), stain)
+            f.write(json.dumps({"image": stem, **truth}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render synthetic UV and stain TLC captures with ground truth.")
+    parser.add_argument("--output", default="./images/synthetic", help="Output folder")
+    parser.add_argument("--count", type=int, default=20, help="Number of UV/stain capture pairs")
+    parser.add_argument("--width", type=int, default=image_size[0])
+    parser.add_argument("--height", type=int, default=image_size[1])
+    parser.add_argument("--noise", type=float, default=4.0, help="Sensor noise (standard deviation in grey levels)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["jpg", "png"], default="jpg")
+    parser.add_argument("--misalign", action="store_true", help="Rotate and shift the stain captures")
+    args = parser.parse_args()
+
+    write_dataset(args.output, args.count, args.width, args.height, args.noise, args.seed, "." + args.format,
+                  args.misalign)
+    print(f"Wrote {args.count} capture pairs to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
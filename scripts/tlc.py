@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import importlib
+import importlib.util
+
+# Single entry point for the TLC tools: `tlc <command> [options]`.
+# Each command runs the main() of one script. Only tlc itself is imported at
+# startup; the script (and numpy, OpenCV, matplotlib...) is imported when
+# its command runs, so short cron and watch jobs only pay for what they use.
+commands = {
+    "capture": ("capture", "Capture UV/normal-light pairs and annotate them as they arrive"),
+    "sort": ("foldersort", "Sort captures into UV and stain folders"),
+    "watch": ("watchsort", "Sort captures continuously as they arrive"),
+    "segment": ("segment", "Detect the six plates in a folder of captures"),
+    "preview": ("imageprocess", "Show the plate contours and edges of one capture"),
+    "detect": ("spotdetect", "Detect baselines, solvent fronts and spots (headless)"),
+    "densitometry": ("densitometry", "Measure lane profiles, sub-pixel peak positions and areas"),
+    "annotate": ("uvclick", "Annotate a UV capture by clicking"),
+    "annotate-pair": ("uvclick1.1", "Annotate a UV capture and its stain capture by clicking"),
+    "pipeline": ("pipeline", "Sort, segment and detect in one pass with shared-memory frames"),
+    "register": ("register", "Register stain captures onto UV captures"),
+    "ratios": ("replay", "Recompute distances, Rf and CV from saved annotations"),
+    "export": ("mesexport", "Send ratio results to the MES"),
+    "library": ("rflibrary", "Build and match against the Rf reference library"),
+    "store": ("annotationstore", "Compact, export or show the annotation store"),
+    "profile": ("instrument", "Summarise a stage profile (TLC_PROFILE)"),
+    "bench": ("bench", "Benchmark the pipeline on synthetic captures"),
+}
+
+# Modules that must not be loaded just by starting a command; the commands
+# that need them import them when they are used
+heavy_modules = ("matplotlib", "skimage", "scipy")
+
+# Import time (ms) above which `tlc startup` reports a command as slow
+startup_budget_ms = 1000
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# Import the module of a command. Scripts that are not valid module names
+# (uvclick1.1.py) are loaded from their file.
+def load(command):
+    name = commands[command][0]
+    if name.isidentifier():
+        return importlib.import_module(name)
+    spec = importlib.util.spec_from_file_location(name.replace(".", "_"), os.path.join(script_dir, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Import each command's module in a fresh interpreter and report its import
+# time and any heavy modules it pulled in. Returns False if a command is
+# slow or loads a heavy module.
+def check_startup(names, budget_ms=startup_budget_ms):
+    probe = ("import sys, time, json; sys.path.insert(0, {dir!r}); start = time.perf_counter(); "
+             "import tlc; tlc.load({command!r}); elapsed = (time.perf_counter() - start) * 1000; "
+             "print(json.dumps([elapsed, [m for m in tlc.heavy_modules if m in sys.modules]]))")
+    ok = True
+    print(f"{'command':15} {'import ms':>10}  heavy modules")
+    for command in names:
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", probe.format(dir=script_dir, command=command)],
+                                capture_output=True, text=True)
+        total_ms = (time.perf_counter() - start) * 1000
+        if result.returncode != 0:
+            print(f"{command:15} {'failed':>10}  {result.stderr.strip().splitlines()[-1]}")
+            ok = False
+            continue
+        elapsed, heavy = json.loads(result.stdout)
+        status = "ok"
+        if heavy or elapsed > budget_ms:
+            status = "SLOW"
+            ok = False
+        print(f"{command:15} {elapsed:10.0f}  {', '.join(heavy) or '-':20} {status} "
+              f"(process {total_ms:.0f} ms)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="tlc", description="TLC capture processing tools.",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="commands:\n" + "\n".join(f"  {name:15} {help_text}"
+                                                                      for name, (_, help_text) in commands.items())
+                                            + "\n  startup         Check the startup time of each command")
+    parser.add_argument("--config", default=None, help="JSON file overriding settings of tlcconfig.py")
+    parser.add_argument("command", choices=list(commands) + ["startup"], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Options of the command (see tlc <command> --help)")
+    args = parser.parse_args()
+
+    # Settings are read when the modules are imported, so the override comes first
+    if args.config:
+        os.environ["TLC_CONFIG"] = os.path.abspath(args.config)
+
+    if args.command == "startup":
+        check = argparse.ArgumentParser(prog="tlc startup")
+        check.add_argument("names", nargs="*", default=list(commands), help="Commands to check (default: all)")
+        check.add_argument("--budget-ms", type=float, default=startup_budget_ms)
+        check_args = check.parse_args(args.args)
+        sys.exit(0 if check_startup(check_args.names, check_args.budget_ms) else 1)
+
+    module = load(args.command)
+    sys.argv = [f"tlc {args.command}"] + args.args
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
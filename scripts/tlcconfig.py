@@ -0,0 +1,47 @@
+# Shared configuration for the TLC scripts.
+# Any setting can be overridden with a JSON file named by the TLC_CONFIG
+# environment variable (or `tlc --config`), e.g. {"pixels_to_cm_uv": 0.045}.
+# Kept free of heavy imports: every command loads this module at startup.
+import os
+import json
+
+# Solvent systems of the six plates, left to right
+plate_names = ["A: 50% DCM in Heptane",
+               "B: 50% EtOAc in Heptane",
+               "C: DCM",
+               "D: 50% EtOAc in DCM",
+               "E: EtOAc",
+               "F: 10% MeOH in DCM"]
+
+# HSV range for detecting low green pixels (TLC plates)
+lower_green = [35, 30, 30]  # Adjust for clearer low green
+upper_green = [85, 255, 255]  # Define the upper boundary for green
+
+# Morphology kernel size used to clean up the plate mask
+morph_kernel_size = 3
+
+# Canny edge detection thresholds
+canny_low = 50
+canny_high = 150
+
+# Mean intensity below which a capture is classified as UV
+uv_threshold = 100  # Adjust based on visual properties of your images
+
+# Conversion factors (pixels to cm)
+pixels_to_cm_uv = 0.046  # Adjust based on UV image calibration
+pixels_to_cm_stain = 0.048  # Adjust based on Stain image calibration
+
+
+# Override settings from a JSON file. Must run before the other modules are
+# imported, since they read these values as defaults at import time.
+def load(path):
+    with open(path) as f:
+        overrides = json.load(f)
+    for key, value in overrides.items():
+        if key.startswith("_") or key not in globals() or callable(globals()[key]) or key in ("os", "json"):
+            raise KeyError(f"Unknown setting in {path}: {key}")
+        globals()[key] = value
+
+
+if os.environ.get("TLC_CONFIG"):
+    load(os.environ["TLC_CONFIG"])
@@ -1,18 +1,25 @@
+import argparse
+
 import cv2
 
+import ratios
+import tlcconfig
+from annotationstore import AnnotationStore
+from segment import segment_plates
+from linedetect import auto_annotate_plate
+from viewer import PyramidViewer, wait_key
+
 # Global variables to store clicked points
 annotations = []
 current_plate = None
 current_annotation_type = None
-plate_names = ["A: 50% DCM in Heptane", 
-               "B: 50% EtOAc in Heptane", 
-               "C: DCM", 
-               "D: 50% EtOAc in DCM", 
-               "E: EtOAc", 
-               "F: 10% MeOH in DCM"]
+auto_annotated = set()  # Annotation types of the current plate filled in automatically
+annotation_store = None  # Journal of every annotation, so a crash does not lose work
+image_key = None  # Name of the image in the annotation store
+plate_names = tlcconfig.plate_names
 
 # Conversion factor (pixels to cm)
-pixels_to_cm = 0.046  # Adjust based on the system's calibration
+pixels_to_cm = tlcconfig.pixels_to_cm_uv  # Set in tlcconfig.py
 
 # Color mapping for annotation types
 annotation_colors = {
@@ -28,75 +35,66 @@ def click_event(event, x, y, flags, param):
     if event == cv2.EVENT_LBUTTONDOWN:  # Left click to select points
         if current_plate is not None and current_annotation_type:
             current_plate[current_annotation_type].append((x, y))
+            if annotation_store is not None:
+                annotation_store.append(image_key, "uv", len(annotations) - 1, current_annotation_type, x, y)
             print(f"{current_annotation_type} point selected for Plate {plate_names[len(annotations) - 1]}: ({x}, {y})")
 
             # Get the color for the current annotation type
             color = annotation_colors.get(current_annotation_type, (255, 255, 255))  # Default to white
 
-            # Draw a small circle with the specified color
-            cv2.circle(param, (x, y), 2, color, -1)  
-            cv2.imshow("Image", param)
-
-def calculate_ratios(annotations):
-    results = []
-
-    for i, plate in enumerate(annotations):
-        baseline = plate.get("baseline")
-        solvent_line = plate.get("solvent_line")
-        spots = plate.get("spots", [])
-
-        if not baseline or not solvent_line:
-            print(f"Error: Plate {i + 1} is missing baseline or solvent line.")
-            continue
-
-        plate_results = {"components": [], "solvent_front_distance_cm": 0}
-
-        # Extract the y-coordinates of the baseline and solvent line
-        baseline_y = baseline[0][1]  # Use the y-coordinate of the baseline point
-        solvent_y = solvent_line[0][1]  # Use the y-coordinate of the solvent line point
-
-        # Calculate solvent front distance in cm
-        solvent_front_distance_px = abs(solvent_y - baseline_y)
-        solvent_front_distance_cm = solvent_front_distance_px * pixels_to_cm
-        plate_results["solvent_front_distance_cm"] = round(solvent_front_distance_cm, 1)
+            # Draw a small circle with the specified color (param is the viewer)
+            param.add_point((x, y), color)
 
-        # Calculate distances and CV (1/Rf) for each spot
-        for j, spot in enumerate(sorted(spots, key=lambda s: s[1])):  # Sort by y-coordinate
-            spot_y = spot[1]  # Use the y-coordinate of the spot
-            spot_to_baseline_px = abs(spot_y - baseline_y)  # Vertical distance from baseline
-            spot_distance_cm = spot_to_baseline_px * pixels_to_cm
+# Draw saved annotations on the image
+def draw_annotations(canvas, plates):
+    for plate in plates:
+        for annotation_type, points in plate.items():
+            for x, y in points:
+                canvas.add_point((int(x), int(y)), annotation_colors[annotation_type])
 
-            if solvent_front_distance_px == 0:
-                print(f"Error: Solvent to baseline distance is zero for Plate {i + 1}.")
-                continue
-
-            rf = spot_to_baseline_px / solvent_front_distance_px
-            cv = 1 / rf if rf != 0 else 0  # CV = 1/Rf
-
-            # Append component details
-            plate_results["components"].append({
-                "component": f"Component {j + 1}",
-                "distance_cm": round(spot_distance_cm, 1),
-                "rf": round(rf, 2),
-                "cv": round(cv, 1)
-            })
-
-        results.append(plate_results)
-
-    return results
+def calculate_ratios(annotations):
+    return ratios.calculate_ratios_single(annotations, pixels_to_cm)
 
 def main():
-    global current_plate, current_annotation_type, annotations
+    global current_plate, current_annotation_type, annotations, auto_annotated, annotation_store, image_key
+
+    parser = argparse.ArgumentParser(description="Annotate the plates of a UV capture and calculate Rf values.")
+    parser.add_argument("image", nargs="?", default="./sorted_images/uv/102038UV.jpg", help="UV capture")
+    parser.add_argument("--fresh", action="store_true", help="Start over instead of resuming the saved annotations")
+    args = parser.parse_args()
 
     # Load the image
-    image_path = "./sorted_images/uv/102038UV.jpg"  # Replace with your image path
+    image_path = args.image
     image = cv2.imread(image_path)
     if image is None:
         print(f"Error: Could not load image at {image_path}")
         return
 
-    # Clone the image to redraw without losing the original
-    clone = image.copy()
+    # Viewer showing a scaled view of the image; clicks arrive in full-resolution coordinates
+    clone = PyramidViewer("Image", image, on_click=click_event)
+
+    # Resume the annotations saved for this image by an earlier session, unless
+    # it was finished with 'q'. A new session replaces them once a plate is started.
+    annotation_store = AnnotationStore()
+    image_key = image_path
+    saved_plates, finished = annotation_store.session(image_key, "uv")
+    reset_pending = finished or (args.fresh and saved_plates > 0)
+    if reset_pending:
+        print("Starting a new session; the saved annotations of this image are replaced.")
+    else:
+        saved = annotation_store.load(image_key, "uv")
+        if saved:
+            print(f"Resuming {len(saved)} saved plate(s) for this image.")
+            annotations.extend(saved)
+            current_plate = annotations[-1]
+            draw_annotations(clone, saved)
+
+    # Detect the plates once so baseline and solvent line can be proposed automatically
+    try:
+        plates = segment_plates(image)
+    except ValueError as e:
+        print(f"Plate detection failed ({e}). Baseline and solvent line must be clicked.")
+        plates = None
 
     # Instructions
     print("Instructions:")
@@ -105,34 +103,57 @@ def main():
     print("3. Press 's' to annotate solvent line for the current plate.")
     print("4. Press 'o' to annotate spots for the current plate.")
     print("5. Press 'q' to finish and calculate ratios.")
+    print("Mouse wheel or '+'/'-' to zoom, right-drag to pan, '0' to fit the image.")
 
     # Display the image and set up the mouse callback
     cv2.startWindowThread()
-    cv2.imshow("Image", image)
-    cv2.setMouseCallback("Image", click_event, param=clone)
+    clone.show()
 
-    plate_index = 0
+    plate_index = len(annotations)
     while True:
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):  # Quit
+        key = wait_key("Image")  # Blocks until a key is pressed
+        if key is None or key == ord('q'):  # Quit (or window closed)
             break
+        elif clone.handle_key(key):  # Zoom keys
+            continue
         elif key == ord('n'):  # Start a new plate
             if plate_index < len(plate_names):
                 print(f"Started annotating Plate {plate_names[plate_index]}.")
+                if reset_pending:
+                    annotation_store.reset(image_key, "uv")
+                    reset_pending = False
                 current_plate = {"baseline": [], "solvent_line": [], "spots": []}
                 annotations.append(current_plate)
+                annotation_store.start_plate(image_key, "uv", plate_index)
+                auto_annotated = set()
+                if plates is not None:
+                    auto_annotated = auto_annotate_plate(image, plates[plate_index], current_plate)
+                    for annotation_type in auto_annotated:
+                        x, y = current_plate[annotation_type][0]
+                        clone.add_point((x, y), annotation_colors[annotation_type])
+                        annotation_store.append(image_key, "uv", plate_index, annotation_type, x, y)
                 plate_index += 1
             else:
                 print("All predefined plates have been annotated.")
         elif key == ord('b'):  # Annotate baseline
             if current_plate:
                 current_annotation_type = "baseline"
+                if "baseline" in auto_annotated:  # The operator overrides the automatic line
+                    clone.remove_point(current_plate["baseline"][0], annotation_colors["baseline"])
+                    current_plate["baseline"].clear()
+                    annotation_store.clear(image_key, "uv", plate_index - 1, "baseline")
+                    auto_annotated.discard("baseline")
                 print(f"Annotating baseline for Plate {plate_names[plate_index - 1]}. Click on the baseline.")
             else:
                 print("Error: Start a plate first ('n').")
         elif key == ord('s'):  # Annotate solvent line
             if current_plate:
                 current_annotation_type = "solvent_line"
+                if "solvent_line" in auto_annotated:  # The operator overrides the automatic line
+                    clone.remove_point(current_plate["solvent_line"][0], annotation_colors["solvent_line"])
+                    current_plate["solvent_line"].clear()
+                    annotation_store.clear(image_key, "uv", plate_index - 1, "solvent_line")
+                    auto_annotated.discard("solvent_line")
                 print(f"Annotating solvent line for Plate {plate_names[plate_index - 1]}. Click on the solvent line.")
             else:
                 print("Error: Start a plate first ('n').")
@@ -143,6 +164,10 @@ def main():
             else:
                 print("Error: Start a plate first ('n').")
 
+    # A session finished with 'q' is not resumed the next time the image is opened
+    if key is not None and not reset_pending:
+        annotation_store.finish(image_key, "uv")
+
     # Calculate and display ratios
     results = calculate_ratios(annotations)
     if results:
@@ -153,6 +178,7 @@ def main():
                 print(f"  {component_data['component']}: Distance: {component_data['distance_cm']} cm, Rf: {component_data['rf']}, CV: {component_data['cv']}")
 
     # Clean up
+    annotation_store.close()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
@@ -1,20 +1,29 @@
+import argparse
+
 import cv2
 
+import ratios
+import tlcconfig
+from annotationstore import AnnotationStore
+from segment import segment_plates
+from linedetect import auto_annotate_plate
+from viewer import PyramidViewer, wait_key
+from register import register, stain_annotations_in_uv, min_correlation
+
 # Global variables to store clicked points
 annotations_uv = []
 annotations_stain = []
 current_plate = None
 current_annotation_type = None
-plate_names = ["A: 50% DCM in Heptane", 
-               "B: 50% EtOAc in Heptane", 
-               "C: DCM", 
-               "D: 50% EtOAc in DCM", 
-               "E: EtOAc", 
-               "F: 10% MeOH in DCM"]
+auto_annotated = set()  # Annotation types of the current plate filled in automatically
+annotation_store = None  # Journal of every annotation, so a crash does not lose work
+image_key = None  # Name of the UV/stain pair in the annotation store
+current_source = "uv"  # Image being annotated: "uv" or "stain"
+plate_names = tlcconfig.plate_names
 
 # Conversion factors
-pixels_to_cm_uv = 0.046  # Adjust based on UV image calibration
-pixels_to_cm_stain = 0.048  # Adjust based on Stain image calibration
+pixels_to_cm_uv = tlcconfig.pixels_to_cm_uv  # Set in tlcconfig.py
+pixels_to_cm_stain = tlcconfig.pixels_to_cm_stain
 
 # Color mapping for annotation types
 annotation_colors = {
@@ -30,97 +39,65 @@ def click_event(event, x, y, flags, param):
     if event == cv2.EVENT_LBUTTONDOWN:  # Left click to select points
         if current_plate is not None and current_annotation_type:
             current_plate[current_annotation_type].append((x, y))
+            if annotation_store is not None:
+                plate_index = len(annotations_uv if current_source == "uv" else annotations_stain) - 1
+                annotation_store.append(image_key, current_source, plate_index, current_annotation_type, x, y)
             print(f"{current_annotation_type} point selected: ({x}, {y})")
 
             # Get the color for the current annotation type
             color = annotation_colors.get(current_annotation_type, (255, 255, 255))  # Default to white
 
-            # Draw a small circle with the specified color
-            cv2.circle(param, (x, y), 2, color, -1)
-            cv2.imshow("Image", param)
-
-# Calculate ratios for UV and Stain annotations
-def calculate_ratios(annotations_uv, annotations_stain):
-    results = []
-
-    for i, (plate_uv, plate_stain) in enumerate(zip(annotations_uv, annotations_stain)):
-        # Get UV annotations
-        baseline_uv = plate_uv.get("baseline")
-        solvent_line_uv = plate_uv.get("solvent_line")
-        spots_uv = plate_uv.get("spots", [])
-
-        if not baseline_uv or not solvent_line_uv:
-            print(f"Error: Plate {i + 1} UV image is missing baseline or solvent line.")
-            continue
-
-        plate_results = {"components": [], "solvent_front_distance_cm": 0}
-
-        # Use UV solvent front for all calculations
-        baseline_y_uv = baseline_uv[0][1]
-        solvent_y_uv = solvent_line_uv[0][1]
-        solvent_front_distance_px_uv = abs(solvent_y_uv - baseline_y_uv)
-        solvent_front_distance_cm = solvent_front_distance_px_uv * pixels_to_cm_uv
-        plate_results["solvent_front_distance_cm"] = round(solvent_front_distance_cm, 1)
-
-        # Combine UV and Stain spots (Stain spots are recalibrated to UV baseline and solvent line)
-        all_spots = spots_uv[:]
-        if plate_stain:
-            baseline_stain = plate_stain.get("baseline")
-            solvent_line_stain = plate_stain.get("solvent_line")
-            spots_stain = plate_stain.get("spots", [])
-
-            if baseline_stain and solvent_line_stain:
-                # Adjust stain spots based on UV baseline and solvent line calibration
-                stain_baseline_to_solvent_px = abs(solvent_line_stain[0][1] - baseline_stain[0][1])
-                if stain_baseline_to_solvent_px > 0:
-                    scaling_factor = solvent_front_distance_px_uv / stain_baseline_to_solvent_px
-                else:
-                    scaling_factor = 1  # Fallback to 1 if the stain baseline-to-solvent distance is invalid
-
-                for spot in spots_stain:
-                    spot_y_adjusted = baseline_y_uv + scaling_factor * (spot[1] - baseline_stain[0][1])
-                    all_spots.append((spot[0], spot_y_adjusted))
-
-        # Deduplicate spots based on y-coordinate proximity (0.1 cm tolerance)
-        unique_spots = []
-        for spot in sorted(all_spots, key=lambda s: s[1]):
-            if not any(abs(spot[1] - unique[1]) <= 2 for unique in unique_spots):
-                unique_spots.append(spot)
-
-        # Calculate distances, Rf, and CV for unique spots and sort by distance_cm
-        calculated_components = []
-        for spot in unique_spots:
-            spot_y = spot[1]
-            spot_to_baseline_px = abs(spot_y - baseline_y_uv)
-            spot_distance_cm = spot_to_baseline_px * pixels_to_cm_uv
+            # Draw a small circle with the specified color (param is the viewer)
+            param.add_point((x, y), color)
 
-            rf = spot_to_baseline_px / solvent_front_distance_px_uv
-            cv = 1 / rf if rf != 0 else 0
-
-            calculated_components.append({
-                "distance_cm": round(spot_distance_cm, 1),
-                "rf": round(rf, 2),
-                "cv": round(cv, 1)
-            })
-
-        # Sort components by distance_cm in ascending order
-        calculated_components = sorted(calculated_components, key=lambda x: x["distance_cm"])
-
-        # Assign component numbers and append to plate results
-        for idx, component in enumerate(calculated_components):
-            component["component"] = f"Component {idx + 1}"
-            plate_results["components"].append(component)
-
-        results.append(plate_results)
+# Detect the plates of an image, or None when they cannot be found
+def find_plates(image, label):
+    try:
+        return segment_plates(image)
+    except ValueError as e:
+        print(f"Plate detection failed on the {label} image ({e}). Baseline and solvent line must be clicked.")
+        return None
 
-    return results
+# Register the stain image onto the UV image, or None when the registration fails
+def find_registration(uv_image, stain_image):
+    try:
+        registration = register(uv_image, stain_image)
+    except (ValueError, cv2.error) as e:
+        print(f"Stain image not registered ({e}). Click the baseline and solvent line on the stain image too.")
+        return None
+    if registration.correlation < min_correlation:
+        print(f"Stain image not registered (correlation {registration.correlation:.2f}). "
+              "Click the baseline and solvent line on the stain image too.")
+        return None
+    print("Stain image registered onto the UV image; on the stain image only the spots need to be clicked.")
+    return registration
+
+# Draw saved annotations on an image
+def draw_annotations(canvas, plates):
+    for plate in plates:
+        for annotation_type, points in plate.items():
+            for x, y in points:
+                canvas.add_point((int(x), int(y)), annotation_colors[annotation_type])
+
+# Calculate ratios for UV and Stain annotations. Stain spots are rescaled onto the
+# UV baseline and solvent line and merged with UV spots within 2 pixels; with
+# merge_cm, components within that distance of the previous one are dropped too.
+def calculate_ratios(annotations_uv, annotations_stain, merge_cm=None):
+    return ratios.calculate_ratios_uv_stain(annotations_uv, annotations_stain, pixels_to_cm_uv, merge_cm=merge_cm)
 
 def main():
-    global current_plate, current_annotation_type, annotations_uv, annotations_stain
+    global current_plate, current_annotation_type, annotations_uv, annotations_stain, auto_annotated
+    global annotation_store, image_key, current_source
+
+    parser = argparse.ArgumentParser(description="Annotate a UV capture and its stain capture and calculate Rf values.")
+    parser.add_argument("uv", nargs="?", default="./sorted_images/uv/102038UV.jpg", help="UV capture")
+    parser.add_argument("stain", nargs="?", default="./sorted_images/stain/102038TAIN.jpg", help="Stain capture")
+    parser.add_argument("--fresh", action="store_true", help="Start over instead of resuming the saved annotations")
+    args = parser.parse_args()
 
     # Load the UV and stain images
-    uv_image_path = "./sorted_images/uv/102038UV.jpg"  # Replace with your UV image path
-    stain_image_path = "./sorted_images/stain/102038TAIN.jpg"  # Replace with your stain image path
+    uv_image_path = args.uv
+    stain_image_path = args.stain
 
     uv_image = cv2.imread(uv_image_path)
     stain_image = cv2.imread(stain_image_path)
@@ -129,9 +106,36 @@ def main():
         print("Error: Could not load UV or stain images.")
         return
 
-    # Clone the images to redraw without losing the original
-    uv_clone = uv_image.copy()
-    stain_clone = stain_image.copy()
+    # Viewers showing scaled views of the images; clicks arrive in full-resolution coordinates
+    uv_clone = PyramidViewer("Image", uv_image, on_click=click_event)
+    stain_clone = PyramidViewer("Image", stain_image, on_click=click_event)
+
+    # Resume the annotations saved for this pair of images by an earlier session,
+    # unless it was finished with 'q'. A new session replaces them once a plate is started.
+    annotation_store = AnnotationStore()
+    image_key = uv_image_path
+    sessions = [annotation_store.session(image_key, source) for source in ("uv", "stain")]
+    finished = any(session_finished for _, session_finished in sessions)
+    reset_pending = finished or (args.fresh and any(saved_plates for saved_plates, _ in sessions))
+    if reset_pending:
+        print("Starting a new session; the saved annotations of these images are replaced.")
+    else:
+        annotations_uv.extend(annotation_store.load(image_key, "uv"))
+        annotations_stain.extend(annotation_store.load(image_key, "stain"))
+    if annotations_uv or annotations_stain:
+        print(f"Resuming {len(annotations_uv)} UV and {len(annotations_stain)} stain plate(s) saved for these images.")
+        draw_annotations(uv_clone, annotations_uv)
+        draw_annotations(stain_clone, annotations_stain)
+        if annotations_uv:
+            current_plate = annotations_uv[-1]
+
+    # Detect the plates once per image so baseline and solvent line can be proposed automatically
+    uv_plates = find_plates(uv_image, "UV")
+    stain_plates = find_plates(stain_image, "stain")
+
+    # Register the stain capture onto the UV capture, so stain spots can be mapped
+    # into UV coordinates without clicking the stain baseline and solvent line
+    registration = find_registration(uv_image, stain_image)
 
     # Instructions
     print("Instructions:")
@@ -141,30 +145,53 @@ def main():
     print("4. Press 'o' to annotate spots for the current plate.")
     print("5. Press 't' to switch to the stain image after annotating all UV images.")
     print("6. Press 'q' to finalize and calculate ratios.")
+    print("Mouse wheel or '+'/'-' to zoom, right-drag to pan, '0' to fit the image.")
 
     # Display the UV image and set up the mouse callback
-    cv2.imshow("Image", uv_image)
-    cv2.setMouseCallback("Image", click_event, param=uv_clone)
+    uv_clone.show()
+    viewer = uv_clone
 
-    plate_index = 0
-    uv_annotation_done = False
+    plate_index = len(annotations_uv)
+    uv_annotation_done = plate_index == len(plate_names)
     using_stain = False
 
     while True:
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q') and uv_annotation_done:  # Quit after UV and stain annotations
+        key = wait_key("Image")  # Blocks until a key is pressed
+        if key is None or (key == ord('q') and uv_annotation_done):  # Quit after UV and stain annotations (or window closed)
             print("Finalizing and calculating results...")
             break
+        elif viewer.handle_key(key):  # Zoom keys
+            continue
         elif key == ord('n'):  # Start a new plate
+            if reset_pending and plate_index < len(plate_names):
+                annotation_store.reset(image_key, "uv")
+                annotation_store.reset(image_key, "stain")
+                reset_pending = False
             if not using_stain and plate_index < len(plate_names):
                 print(f"Started annotating Plate {plate_names[plate_index]} (UV).")
                 current_plate = {"baseline": [], "solvent_line": [], "spots": []}
                 annotations_uv.append(current_plate)
+                annotation_store.start_plate(image_key, "uv", plate_index)
+                auto_annotated = set()
+                if uv_plates is not None:
+                    auto_annotated = auto_annotate_plate(uv_image, uv_plates[plate_index], current_plate)
+                    for annotation_type in auto_annotated:
+                        x, y = current_plate[annotation_type][0]
+                        uv_clone.add_point((x, y), annotation_colors[annotation_type])
+                        annotation_store.append(image_key, "uv", plate_index, annotation_type, x, y)
                 plate_index += 1
             elif using_stain and plate_index < len(plate_names):
                 print(f"Started annotating Plate {plate_names[plate_index]} (Stain).")
                 current_plate = {"baseline": [], "solvent_line": [], "spots": []}
                 annotations_stain.append(current_plate)
+                annotation_store.start_plate(image_key, "stain", plate_index)
+                auto_annotated = set()
+                if stain_plates is not None:
+                    auto_annotated = auto_annotate_plate(stain_image, stain_plates[plate_index], current_plate)
+                    for annotation_type in auto_annotated:
+                        x, y = current_plate[annotation_type][0]
+                        stain_clone.add_point((x, y), annotation_colors[annotation_type])
+                        annotation_store.append(image_key, "stain", plate_index, annotation_type, x, y)
                 plate_index += 1
             else:
                 if not using_stain:
@@ -175,12 +202,22 @@ def main():
         elif key == ord('b'):  # Annotate baseline
             if current_plate:
                 current_annotation_type = "baseline"
+                if "baseline" in auto_annotated:  # The operator overrides the automatic line
+                    viewer.remove_point(current_plate["baseline"][0], annotation_colors["baseline"])
+                    current_plate["baseline"].clear()
+                    annotation_store.clear(image_key, current_source, plate_index - 1, "baseline")
+                    auto_annotated.discard("baseline")
                 print("Annotating baseline. Click on the baseline.")
             else:
                 print("Error: Start a plate first ('n').")
         elif key == ord('s'):  # Annotate solvent line
             if current_plate:
                 current_annotation_type = "solvent_line"
+                if "solvent_line" in auto_annotated:  # The operator overrides the automatic line
+                    viewer.remove_point(current_plate["solvent_line"][0], annotation_colors["solvent_line"])
+                    current_plate["solvent_line"].clear()
+                    annotation_store.clear(image_key, current_source, plate_index - 1, "solvent_line")
+                    auto_annotated.discard("solvent_line")
                 print("Annotating solvent line. Click on the solvent line.")
             else:
                 print("Error: Start a plate first ('n').")
@@ -192,32 +229,36 @@ def main():
                 print("Error: Start a plate first ('n').")
         elif key == ord('t') and uv_annotation_done:  # Switch to stain image
             print("Switched to stain image. Annotate stain images now.")
-            plate_index = 0
+            plate_index = len(annotations_stain)  # Continue after the stain plates of a resumed session
             current_plate = None
             using_stain = True
-            cv2.imshow("Image", stain_image)
-            cv2.setMouseCallback("Image", click_event, param=stain_clone)
+            current_source = "stain"
+            stain_clone.show()
+            viewer = stain_clone
+
+    # A session finished with 'q' is not resumed the next time the images are opened
+    if key is not None and not reset_pending:
+        annotation_store.finish(image_key, "uv")
+        annotation_store.finish(image_key, "stain")
 
     # Calculate and display ratios
     try:
-        results = calculate_ratios(annotations_uv, annotations_stain)
+        # Components within 0.1 cm of each other are reported once
+        stain_for_ratios = annotations_stain
+        if registration is not None:
+            stain_for_ratios = stain_annotations_in_uv(annotations_uv, annotations_stain, registration.stain_to_uv)
+        results = calculate_ratios(annotations_uv, stain_for_ratios, merge_cm=0.1)
     except Exception as e:
         print(f"Error during ratio calculation: {e}")
         results = []
 
     if not results:
         print("No annotations were made. Please ensure all plates are annotated.")
+        annotation_store.close()
         cv2.destroyAllWindows()
         return
 
-    # Deduplicate results and display
-    for plate_data in results:
-        unique_spots = []
-        for component in plate_data["components"]:
-            if not any(abs(component["distance_cm"] - unique["distance_cm"]) <= 0.1 for unique in unique_spots):
-                unique_spots.append(component)
-        plate_data["components"] = unique_spots
-
+    # Display results
     for i, plate_data in enumerate(results):
         print(f"\nPlate {plate_names[i]}:")
         print(f"  Solvent Front Distance: {plate_data['solvent_front_distance_cm']} cm")
@@ -225,6 +266,7 @@ def main():
             print(f"  {component_data['component']}: Distance: {component_data['distance_cm']} cm, Rf: {component_data['rf']}, CV: {component_data['cv']}")
 
     # Clean up
+    annotation_store.close()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
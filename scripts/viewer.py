@@ -0,0 +1,152 @@
+import cv2
+import numpy as np
+
+# Largest window size (width, height); larger images are shown scaled down
+view_size = (1280, 800)
+
+# Zoom limits (display pixels per image pixel) and the step of one wheel notch or key press
+max_zoom = 8.0
+zoom_step = 1.25
+
+# Radius of the annotation markers in display pixels
+marker_radius = 2
+
+
+# Image viewer for annotating large captures. The window shows a view of at
+# most view_size pixels, drawn from the nearest level of an image pyramid,
+# so zooming, panning and clicking cost the same on a 20 MP capture as on a
+# small one. Clicks are mapped back to full-resolution pixel coordinates
+# before they are passed on, so annotations are unaffected by the zoom.
+#
+# Mouse: left click annotates, wheel zooms around the cursor, right-drag pans.
+# Keys (see handle_key): '+' / '-' zoom, '0' fits the image to the window.
+class PyramidViewer:
+    def __init__(self, window, image, on_click=None):
+        self.window = window
+        # Called as on_click(event, x, y, flags, viewer) with full-resolution x, y,
+        # like an OpenCV mouse callback whose param is the viewer
+        self.on_click = on_click
+        self.height, self.width = image.shape[:2]
+
+        # Level k is the image downscaled by 2**k; stop once a level fits the view
+        self.levels = [image]
+        while self.levels[-1].shape[1] > view_size[0] or self.levels[-1].shape[0] > view_size[1]:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+
+        self.points = []  # (x, y, color) in full-resolution coordinates
+        self.view = None
+        self.fit_zoom = min(1.0, view_size[0] / self.width, view_size[1] / self.height)
+        self.zoom = self.fit_zoom
+        self.origin = (0.0, 0.0)  # Full-resolution coordinates of the view's top-left pixel
+        self.drag_start = None
+
+    # Show the image in the window and take over its mouse events
+    def show(self):
+        cv2.namedWindow(self.window, cv2.WINDOW_AUTOSIZE)
+        cv2.setMouseCallback(self.window, self._mouse)
+        self.render()
+
+    # Full-resolution pixel under a display pixel
+    def to_image(self, u, v):
+        x = int(round(self.origin[0] + u / self.zoom))
+        y = int(round(self.origin[1] + v / self.zoom))
+        return min(max(x, 0), self.width - 1), min(max(y, 0), self.height - 1)
+
+    # Display pixel of a full-resolution point
+    def to_view(self, x, y):
+        return int(round((x - self.origin[0]) * self.zoom)), int(round((y - self.origin[1]) * self.zoom))
+
+    # Add an annotation marker; only the marker is drawn onto the current view
+    def add_point(self, point, color):
+        x, y = point
+        self.points.append((x, y, color))
+        if self.view is not None:
+            cv2.circle(self.view, self.to_view(x, y), marker_radius, color, -1)
+            cv2.imshow(self.window, self.view)
+
+    # Remove an annotation marker (e.g. an automatic line the operator clicks
+    # again) and redraw the view
+    def remove_point(self, point, color):
+        x, y = point
+        if (x, y, color) in self.points:
+            self.points.remove((x, y, color))
+            if self.view is not None:
+                self.render()
+
+    # Redraw the whole view (after a zoom or pan)
+    def render(self):
+        view_w = min(view_size[0], int(round(self.width * self.zoom)))
+        view_h = min(view_size[1], int(round(self.height * self.zoom)))
+        self._clamp_origin(view_w, view_h)
+
+        # Pyramid level with at least the view's resolution, mapped onto the view with one affine warp
+        k = 0
+        while k + 1 < len(self.levels) and self.zoom <= 0.5 ** (k + 1):
+            k += 1
+        level = self.levels[k]
+        scale = self.zoom * 2 ** k  # Display pixels per level pixel
+        matrix = np.float32([[scale, 0, -self.origin[0] / 2 ** k * scale],
+                             [0, scale, -self.origin[1] / 2 ** k * scale]])
+        interpolation = cv2.INTER_NEAREST if scale >= 1 else cv2.INTER_LINEAR
+        self.view = cv2.warpAffine(level, matrix, (view_w, view_h), flags=interpolation)
+
+        for x, y, color in self.points:
+            u, v = self.to_view(x, y)
+            if -marker_radius <= u < view_w + marker_radius and -marker_radius <= v < view_h + marker_radius:
+                cv2.circle(self.view, (u, v), marker_radius, color, -1)
+        cv2.imshow(self.window, self.view)
+
+    def _clamp_origin(self, view_w, view_h):
+        max_x = max(0.0, self.width - view_w / self.zoom)
+        max_y = max(0.0, self.height - view_h / self.zoom)
+        self.origin = (min(max(self.origin[0], 0.0), max_x), min(max(self.origin[1], 0.0), max_y))
+
+    # Zoom by `factor` keeping the image point under display pixel (u, v) in place
+    def zoom_at(self, factor, u, v):
+        x = self.origin[0] + u / self.zoom
+        y = self.origin[1] + v / self.zoom
+        self.zoom = min(max(self.zoom * factor, self.fit_zoom), max_zoom)
+        self.origin = (x - u / self.zoom, y - v / self.zoom)
+        self.render()
+
+    # Handle the viewer's keys; returns True when the key was used
+    def handle_key(self, key):
+        if self.view is None:
+            return False
+        center = (self.view.shape[1] / 2, self.view.shape[0] / 2)
+        if key in (ord('+'), ord('=')):
+            self.zoom_at(zoom_step, *center)
+        elif key == ord('-'):
+            self.zoom_at(1 / zoom_step, *center)
+        elif key == ord('0'):
+            self.zoom = self.fit_zoom
+            self.origin = (0.0, 0.0)
+            self.render()
+        else:
+            return False
+        return True
+
+    def _mouse(self, event, u, v, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            if self.on_click is not None:
+                x, y = self.to_image(u, v)
+                self.on_click(event, x, y, flags, self)
+        elif event == cv2.EVENT_MOUSEWHEEL:
+            self.zoom_at(zoom_step if cv2.getMouseWheelDelta(flags) > 0 else 1 / zoom_step, u, v)
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            self.drag_start = (u, v, self.origin)
+        elif event == cv2.EVENT_RBUTTONUP:
+            self.drag_start = None
+        elif event == cv2.EVENT_MOUSEMOVE and self.drag_start is not None and flags & cv2.EVENT_FLAG_RBUTTON:
+            u0, v0, (x0, y0) = self.drag_start
+            self.origin = (x0 - (u - u0) / self.zoom, y0 - (v - v0) / self.zoom)
+            self.render()
+
+
+# Block until a key is pressed (no polling). Returns the key code, or None
+# when the window has been closed.
+def wait_key(window):
+    key = cv2.waitKey(0)
+    if key == -1 or cv2.getWindowProperty(window, cv2.WND_PROP_VISIBLE) < 1:
+        return None
+    return key & 0xFF
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import signal
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import foldersort
+
+# inotify is used when available to wake up as soon as a file is written;
+# otherwise the input folder is polled
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+# Seconds between scans of the input folder
+poll_interval = 0.5
+
+# A file is considered complete once its size and mtime are unchanged for this long
+settle_time = 1.0
+
+# Maximum number of images handed to the workers at once, per worker
+queue_per_worker = 2
+
+# Number of recent latencies kept for the statistics
+latency_window = 1000
+
+# Status file with the latest statistics, rewritten periodically
+status_path = "./sorted_images/watch_status.json"
+status_interval = 5.0
+
+
+# Worker task: classify an image and move it to its sorted folder.
+# Returns (path, hash, mean, label, target path, error).
+def sort_image(image_path, threshold):
+    digest, avg_intensity, error = foldersort.measure_image(image_path)
+    if error is not None:
+        return image_path, digest, None, None, None, error
+    label = foldersort.classify(avg_intensity, threshold)
+    target_path = foldersort.move_image(image_path, label)
+    return image_path, digest, avg_intensity, label, target_path, None
+
+
+# Tracks files in the input folder until they have finished writing. Files
+# that could not be sorted are left in place and not offered again until
+# their size or mtime changes (e.g. the capture is rewritten).
+class FolderWatcher:
+    def __init__(self, folder, settle=settle_time):
+        self.folder = folder
+        self.settle = settle
+        self.candidates = {}  # path -> (size, mtime, time the state was first seen)
+        self.closed = set()   # paths reported complete by inotify
+        self.failed = {}      # path -> (size, mtime) of files that could not be sorted
+        self.inotify = None
+        if INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(folder, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+
+    # Block until something may have changed in the folder
+    def wait(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            self.closed.add(os.path.join(self.folder, event.name))
+
+    # Return the files that are ready, leaving out the paths in `exclude`
+    def ready(self, exclude):
+        now = time.monotonic()
+        seen = set()
+        ready = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or not entry.name.lower().endswith(foldersort.image_extensions):
+                continue
+            seen.add(entry.path)
+            if entry.path in exclude:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            state = (stat.st_size, stat.st_mtime)
+            if self.failed.get(entry.path) == state:
+                continue
+            self.failed.pop(entry.path, None)
+            previous = self.candidates.get(entry.path)
+            if previous is None or previous[:2] != state:
+                self.candidates[entry.path] = state + (now,)
+                previous = self.candidates[entry.path]
+            if entry.path in self.closed or (stat.st_size > 0 and now - previous[2] >= self.settle):
+                ready.append((entry.path, stat.st_mtime))
+
+        # Forget files that disappeared from the folder
+        for path in list(self.candidates):
+            if path not in seen:
+                del self.candidates[path]
+        self.closed &= seen
+        for path in list(self.failed):
+            if path not in seen:
+                del self.failed[path]
+
+        # Oldest captures first
+        ready.sort(key=lambda item: item[1])
+        return ready
+
+    def forget(self, path):
+        self.candidates.pop(path, None)
+        self.closed.discard(path)
+
+    # Remember a file that could not be sorted, in the state it was submitted in
+    def fail(self, path):
+        state = self.candidates.get(path)
+        if state is not None:
+            self.failed[path] = state[:2]
+        self.forget(path)
+
+
+# Capture-to-sorted latency statistics over a sliding window
+class LatencyStats:
+    def __init__(self, window=latency_window):
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.failed = 0
+
+    def add(self, latency):
+        self.latencies.append(latency)
+        self.count += 1
+
+    def summary(self):
+        values = sorted(self.latencies)
+        if not values:
+            return {"count": self.count, "failed": self.failed}
+        return {
+            "count": self.count,
+            "failed": self.failed,
+            "latency_p50_s": round(values[len(values) // 2], 3),
+            "latency_p95_s": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+            "latency_max_s": round(values[-1], 3),
+        }
+
+
+# Write the status file atomically so readers never see a partial file
+def write_status(path, status):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder and sort TLC images into UV and stain folders as they arrive.")
+    parser.add_argument("--input", default=foldersort.input_folder, help="Folder to watch")
+    parser.add_argument("--threshold", type=float, default=foldersort.uv_threshold, help="Mean intensity below which an image is UV")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--manifest", default=foldersort.manifest_path, help="Manifest of classified images")
+    parser.add_argument("--status", default=status_path, help="Status file with latency and queue statistics")
+    args = parser.parse_args()
+
+    os.makedirs(args.input, exist_ok=True)
+    os.makedirs(foldersort.uv_folder, exist_ok=True)
+    os.makedirs(foldersort.stain_folder, exist_ok=True)
+    os.makedirs(os.path.dirname(args.status) or ".", exist_ok=True)
+
+    # Stop cleanly on Ctrl+C or SIGTERM, finishing the images in flight
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    workers = args.workers or os.cpu_count() or 1
+    max_in_flight = workers * queue_per_worker
+    watcher = FolderWatcher(args.input)
+    stats = LatencyStats()
+    in_flight = {}  # future -> (path, capture time)
+    last_status = 0.0
+
+    print(f"Watching {args.input} with {workers} workers (queue size {max_in_flight}). Press Ctrl+C to stop.")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(args.manifest, "a") as manifest:
+        while running or in_flight:
+            # Only hand out as many images as the queue has room for; the rest
+            # stay on disk until a worker frees up (backpressure)
+            backlog = 0
+            if running:
+                in_flight_paths = {path for path, _ in in_flight.values()}
+                ready = watcher.ready(in_flight_paths)
+                room = max_in_flight - len(in_flight)
+                for image_path, capture_time in ready[:room]:
+                    future = pool.submit(sort_image, image_path, args.threshold)
+                    in_flight[future] = (image_path, capture_time)
+                backlog = max(0, len(ready) - room)
+
+            if in_flight:
+                done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                done = ()
+                watcher.wait(poll_interval)
+
+            for future in done:
+                image_path, capture_time = in_flight.pop(future)
+                filename = os.path.basename(image_path)
+                try:
+                    _, digest, avg_intensity, label, target_path, error = future.result()
+                except Exception as e:
+                    error = f"error sorting ({e})"
+                if error is not None:
+                    watcher.fail(image_path)
+                    stats.failed += 1
+                    print(f"{filename}: {error}. Skipping until the file changes...")
+                    continue
+                watcher.forget(image_path)
+
+                # Latency from the end of the capture write to the move
+                latency = time.time() - capture_time
+                stats.add(latency)
+                stat = os.stat(target_path)
+                foldersort.append_manifest(manifest, {
+                    "path": target_path,
+                    "size": stat.st_size,
+                    "mtime": capture_time,
+                    "hash": digest,
+                    "mean": avg_intensity,
+                    "label": label,
+                })
+                print(f"{filename} classified as {label.upper()} and moved to {os.path.dirname(target_path)} ({latency:.2f} s)")
+
+            now = time.monotonic()
+            if now - last_status >= status_interval or not (running or in_flight):
+                status = stats.summary()
+                status.update({"in_flight": len(in_flight), "backlog": backlog, "updated": time.time()})
+                write_status(args.status, status)
+                last_status = now
+
+    print(f"Stopped. {json.dumps(stats.summary())}")
+
+
+if __name__ == "__main__":
+    main()
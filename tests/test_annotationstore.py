@@ -0,0 +1,42 @@
+from annotationstore import AnnotationStore
+
+
+def test_resume_keeps_empty_plates(tmp_path):
+    store = AnnotationStore(str(tmp_path))
+    store.start_plate("a.jpg", "uv", 0)
+    store.append("a.jpg", "uv", 0, "baseline", 10, 200)
+    store.start_plate("a.jpg", "uv", 1)
+    store.close()
+
+    store = AnnotationStore(str(tmp_path))
+    assert store.session("a.jpg", "uv") == (2, False)
+    plates = store.load("a.jpg", "uv")
+    assert len(plates) == 2
+    assert plates[0]["baseline"] == [(10, 200)]
+    assert plates[1] == {"baseline": [], "solvent_line": [], "spots": []}
+    # The same after compaction
+    store.compact()
+    assert store.load("a.jpg", "uv") == plates
+    assert store.session("a.jpg", "uv") == (2, False)
+    store.close()
+
+
+def test_finished_session_and_reset(tmp_path):
+    store = AnnotationStore(str(tmp_path))
+    store.start_plate("a.jpg", "uv", 0)
+    store.append("a.jpg", "uv", 0, "spots", 5, 6)
+    store.start_plate("a.jpg", "stain", 0)
+    store.append("a.jpg", "stain", 0, "spots", 7, 8)
+    store.finish("a.jpg", "uv")
+    store.compact()
+    assert store.session("a.jpg", "uv") == (1, True)
+    assert store.session("a.jpg", "stain") == (1, False)
+
+    # A new session over the finished one starts empty; the other source is kept
+    store.reset("a.jpg", "uv")
+    assert store.load("a.jpg", "uv") == []
+    assert store.session("a.jpg", "uv") == (0, False)
+    store.compact()
+    assert store.load("a.jpg", "uv") == []
+    assert store.load("a.jpg", "stain")[0]["spots"] == [(7, 8)]
+    store.close()
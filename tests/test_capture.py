@@ -0,0 +1,38 @@
+import io
+import json
+
+import cv2
+
+import capture
+import synthtlc
+
+
+def test_replay_with_resized_stain_frame(tmp_path):
+    synthtlc.write_dataset(str(tmp_path), 3)
+    # A stain frame of another size and aspect ratio cannot be registered
+    path = str(tmp_path / "stain_00001.jpg")
+    cv2.imwrite(path, cv2.resize(cv2.imread(path), (900, 610)))
+
+    out = io.StringIO()
+    capture.run(capture.DirectorySource(str(tmp_path), 0), out)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(records) == 3
+    assert all("error" not in record for record in records)
+    assert [bool(record.get("registration_failed")) for record in records] == [False, True, False]
+    assert all(len(record["stain"]) == len(record["uv"]) for record in records)
+
+
+def test_replay_continues_after_failed_pair(tmp_path, monkeypatch):
+    synthtlc.write_dataset(str(tmp_path), 3)
+    process_pair = capture.process_pair
+
+    def failing_process_pair(buffer, threshold, save=False):
+        if "00001" in buffer.names[0]:
+            raise RuntimeError("frame lost")
+        return process_pair(buffer, threshold, save)
+
+    monkeypatch.setattr(capture, "process_pair", failing_process_pair)
+    out = io.StringIO()
+    capture.run(capture.DirectorySource(str(tmp_path), 0), out)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [record.get("error") for record in records] == [None, "frame lost", None]
@@ -0,0 +1,62 @@
+import io
+import os
+import json
+
+import cv2
+import numpy as np
+
+import pipeline
+import synthtlc
+
+
+def test_header_size_matches_decode(tmp_path):
+    image = np.zeros((61, 100, 3), np.uint8)
+    for extension in (".png", ".jpg", ".bmp"):
+        path = str(tmp_path / ("frame" + extension))
+        cv2.imwrite(path, image)
+        assert pipeline.header_size(path) == (100, 61)
+
+
+def test_pairs_measure_stain_on_uv_plates(tmp_path):
+    synthtlc.write_dataset(str(tmp_path), 2, misalign=True)
+    with open(tmp_path / "truth.jsonl") as f:
+        truth = {record["image"]: record for record in map(json.loads, f)}
+    paths = sorted(str(path) for path in tmp_path.glob("*.jpg"))
+
+    out = io.StringIO()
+    assert pipeline.run(paths, out, workers=2, lanes=True) == 4
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(records) == 2
+    for record in records:
+        assert [os.path.basename(path)[:2] for path in record["pair"]] == ["uv", "st"]
+        assert "stain_to_uv" in record
+        assert len(record["densitometry"]) == len(record["stain_densitometry"]) == len(record["uv"])
+        # Stain spots are in UV coordinates, so they match the UV ground truth
+        plates_truth = truth[os.path.basename(record["image"])[3:8]]["uv"]
+        found = total = 0
+        for plate, plate_truth in zip(record["stain"], plates_truth):
+            for x, y in plate_truth["spots"]:
+                total += 1
+                found += any(np.hypot(x - sx, y - sy) <= 10 for sx, sy in plate["spots"])
+        assert found >= 0.8 * total
+        # Stain lane peaks, like the stain spots, sit on the true spot rows
+        for plate, plate_truth in zip(record["stain_densitometry"], plates_truth):
+            rows = [y for _, y in plate_truth["spots"]]
+            assert plate["peaks"]
+            assert all(any(abs(peak["y"] - y) <= 10 for y in rows) for peak in plate["peaks"])
+
+
+def test_mixed_capture_sizes(tmp_path):
+    # A small capture sorts first; the larger ones must still fit a slot
+    small, _, _ = synthtlc.generate_pair(5, width=800, height=500)
+    cv2.imwrite(str(tmp_path / "a_small_uv.jpg"), small)
+    large, _, _ = synthtlc.generate_pair(6)
+    cv2.imwrite(str(tmp_path / "b_large_uv.jpg"), large)
+    synthtlc.write_dataset(str(tmp_path), 1, seed=7)
+    paths = sorted(str(path) for path in tmp_path.glob("*.jpg"))
+
+    out = io.StringIO()
+    assert pipeline.run(paths, out, workers=2) == 4
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(os.path.basename(record["image"]) for record in records) == \
+        ["a_small_uv.jpg", "b_large_uv.jpg", "uv_00000.jpg"]
@@ -0,0 +1,117 @@
+import random
+
+import pytest
+
+import ratios
+
+pixels_to_cm = 0.046
+
+
+# calculate_ratios of uvclick.py before the ratio engine (reference)
+def loop_ratios_single(annotations):
+    results = []
+    for i, plate in enumerate(annotations):
+        baseline = plate.get("baseline")
+        solvent_line = plate.get("solvent_line")
+        spots = plate.get("spots", [])
+        if not baseline or not solvent_line:
+            continue
+        plate_results = {"components": [], "solvent_front_distance_cm": 0}
+        baseline_y = baseline[0][1]
+        solvent_y = solvent_line[0][1]
+        solvent_front_distance_px = abs(solvent_y - baseline_y)
+        plate_results["solvent_front_distance_cm"] = round(solvent_front_distance_px * pixels_to_cm, 1)
+        for j, spot in enumerate(sorted(spots, key=lambda s: s[1])):
+            spot_to_baseline_px = abs(spot[1] - baseline_y)
+            if solvent_front_distance_px == 0:
+                continue
+            rf = spot_to_baseline_px / solvent_front_distance_px
+            cv = 1 / rf if rf != 0 else 0
+            plate_results["components"].append({
+                "component": f"Component {j + 1}",
+                "distance_cm": round(spot_to_baseline_px * pixels_to_cm, 1),
+                "rf": round(rf, 2),
+                "cv": round(cv, 1)
+            })
+        results.append(plate_results)
+    return results
+
+
+# calculate_ratios of uvclick1.1.py before the ratio engine (reference)
+def loop_ratios_uv_stain(annotations_uv, annotations_stain):
+    results = []
+    for plate_uv, plate_stain in zip(annotations_uv, annotations_stain):
+        baseline_uv = plate_uv.get("baseline")
+        solvent_line_uv = plate_uv.get("solvent_line")
+        if not baseline_uv or not solvent_line_uv:
+            continue
+        plate_results = {"components": [], "solvent_front_distance_cm": 0}
+        baseline_y_uv = baseline_uv[0][1]
+        solvent_front_distance_px_uv = abs(solvent_line_uv[0][1] - baseline_y_uv)
+        plate_results["solvent_front_distance_cm"] = round(solvent_front_distance_px_uv * pixels_to_cm, 1)
+
+        all_spots = plate_uv.get("spots", [])[:]
+        if plate_stain:
+            baseline_stain = plate_stain.get("baseline")
+            solvent_line_stain = plate_stain.get("solvent_line")
+            if baseline_stain and solvent_line_stain:
+                stain_px = abs(solvent_line_stain[0][1] - baseline_stain[0][1])
+                scaling_factor = solvent_front_distance_px_uv / stain_px if stain_px > 0 else 1
+                for spot in plate_stain.get("spots", []):
+                    all_spots.append((spot[0], baseline_y_uv + scaling_factor * (spot[1] - baseline_stain[0][1])))
+
+        unique_spots = []
+        for spot in sorted(all_spots, key=lambda s: s[1]):
+            if not any(abs(spot[1] - unique[1]) <= 2 for unique in unique_spots):
+                unique_spots.append(spot)
+
+        components = []
+        for spot in unique_spots:
+            spot_to_baseline_px = abs(spot[1] - baseline_y_uv)
+            rf = spot_to_baseline_px / solvent_front_distance_px_uv
+            cv = 1 / rf if rf != 0 else 0
+            components.append({"distance_cm": round(spot_to_baseline_px * pixels_to_cm, 1),
+                               "rf": round(rf, 2), "cv": round(cv, 1)})
+        for idx, component in enumerate(sorted(components, key=lambda x: x["distance_cm"])):
+            component["component"] = f"Component {idx + 1}"
+            plate_results["components"].append(component)
+        results.append(plate_results)
+    return results
+
+
+# Random plate annotations; spots are crowded near each other so the
+# duplicate filter and rounding ties are exercised
+def random_plate(rng, allow_zero_front=True):
+    plate = {"baseline": [], "solvent_line": [], "spots": []}
+    if rng.random() < 0.9:
+        plate["baseline"] = [(rng.randint(0, 300), rng.randint(300, 900))]
+    if rng.random() < 0.9:
+        low = 0 if allow_zero_front else 1
+        plate["solvent_line"] = [(rng.randint(0, 300), plate["baseline"][0][1] - rng.randint(low, 300)
+                                  if plate["baseline"] else rng.randint(0, 600))]
+    centre = rng.randint(0, 900)
+    plate["spots"] = [(rng.randint(0, 300), centre + rng.randint(-20, 20)) for _ in range(rng.randint(0, 6))]
+    return plate
+
+
+def test_single_matches_loop():
+    rng = random.Random(6)
+    for _ in range(20000):
+        annotations = [random_plate(rng) for _ in range(rng.randint(0, 6))]
+        assert ratios.calculate_ratios_single(annotations, pixels_to_cm) == loop_ratios_single(annotations)
+
+
+def test_uv_stain_matches_loop():
+    rng = random.Random(7)
+    for _ in range(20000):
+        count = rng.randint(0, 6)
+        annotations_uv = [random_plate(rng, allow_zero_front=False) for _ in range(count)]
+        annotations_stain = [random_plate(rng) if rng.random() < 0.8 else {} for _ in range(rng.randint(0, count))]
+        assert (ratios.calculate_ratios_uv_stain(annotations_uv, annotations_stain, pixels_to_cm)
+                == loop_ratios_uv_stain(annotations_uv, annotations_stain))
+
+
+def test_uv_stain_zero_front_raises():
+    plate = {"baseline": [(0, 500)], "solvent_line": [(0, 500)], "spots": [(0, 400)]}
+    with pytest.raises(ZeroDivisionError):
+        ratios.calculate_ratios_uv_stain([plate], [{}], pixels_to_cm)
@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+import pytest
+
+import synthtlc
+from register import register, transform_points, min_correlation
+
+
+# Largest distance (pixels) between points mapped with two transforms
+def mapping_error(points, estimated, expected):
+    return np.abs(transform_points(points, estimated) - transform_points(points, expected)).max()
+
+
+def test_register_misaligned_pair():
+    uv, stain, truth = synthtlc.generate_pair(1, misalign=True)
+    registration = register(uv, stain)
+    assert registration.correlation >= min_correlation
+    corners = [(0, 0), (1007, 0), (0, 609), (1007, 609)]
+    assert mapping_error(corners, registration.stain_to_uv, np.array(truth["stain_to_uv"])) <= 2
+
+
+def test_register_different_resolutions():
+    uv, stain, truth = synthtlc.generate_pair(2, width=2016, height=1220, misalign=True)
+    stain = cv2.resize(stain, None, fx=2, fy=2, interpolation=cv2.INTER_LINEAR)
+    registration = register(uv, stain)
+    assert registration.correlation >= min_correlation
+    # Stain pixels of the 2x capture map to UV through the truth after halving
+    expected = np.array(truth["stain_to_uv"]) @ np.diag([0.5, 0.5, 1.0])
+    corners = [(0, 0), (4031, 0), (0, 2439), (4031, 2439)]
+    assert mapping_error(corners, registration.stain_to_uv, expected) <= 4
+
+
+def test_register_rejects_different_aspect_ratios():
+    uv, stain, _ = synthtlc.generate_pair(3)
+    with pytest.raises(ValueError):
+        register(uv, stain[:400])
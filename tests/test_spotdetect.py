@@ -0,0 +1,73 @@
+import os
+
+import cv2
+import numpy as np
+
+import synthtlc
+import spotdetect
+
+# Detections further than this from every true spot (pixels) are false
+match_distance = 10
+
+
+# Detected spots matched greedily to the true spots of one plate. Returns
+# (true spots found, detections without a true spot).
+def match_spots(detected, truth):
+    detected = list(detected)
+    found = 0
+    for x, y in truth:
+        if not detected:
+            break
+        distances = [np.hypot(x - dx, y - dy) for dx, dy in detected]
+        nearest = int(np.argmin(distances))
+        if distances[nearest] <= match_distance:
+            detected.pop(nearest)
+            found += 1
+    return found, len(detected)
+
+
+def annotate_pairs(seeds):
+    for seed in seeds:
+        uv, _, truth = synthtlc.generate_pair(seed)
+        plates, annotations = spotdetect.annotate_image(uv)
+        yield plates, annotations, truth
+
+
+def test_spots_match_ground_truth():
+    total = found = false = 0
+    for plates, annotations, truth in annotate_pairs(range(8)):
+        assert len(plates) == len(truth["uv"])
+        for plate_annotations, plate_truth in zip(annotations, truth["uv"]):
+            plate_found, plate_false = match_spots(plate_annotations["spots"], plate_truth["spots"])
+            total += len(plate_truth["spots"])
+            found += plate_found
+            false += plate_false
+    # Overlapping true spots merge into one detection, so recall stays below 1
+    assert found >= 0.8 * total
+    assert false <= 0.05 * (found + false)
+
+
+def test_no_spots_on_plate_sides():
+    for plates, annotations, _ in annotate_pairs(range(4)):
+        for plate, plate_annotations in zip(plates, annotations):
+            for x, _ in plate_annotations["spots"]:
+                assert plate.x < x < plate.x + plate.w - 1
+
+
+def test_no_spots_on_plate_sides_of_real_capture():
+    image = cv2.imread(os.path.join(os.path.dirname(__file__), "..", "images", "TLC1.png"))
+    plates, annotations = spotdetect.annotate_image(image)
+    assert len(plates) == 6
+    for plate, plate_annotations in zip(plates, annotations):
+        for x, _ in plate_annotations["spots"]:
+            assert plate.x + 3 < x < plate.x + plate.w - 4
+    # The spots of plate F (lines found with full confidence) are kept
+    assert len(annotations[5]["spots"]) >= 3
+
+
+def test_lines_match_ground_truth():
+    for _, annotations, truth in annotate_pairs(range(4)):
+        for plate_annotations, plate_truth in zip(annotations, truth["uv"]):
+            assert "low_confidence" not in plate_annotations
+            assert abs(plate_annotations["baseline"][0][1] - plate_truth["baseline"][0][1]) <= 3
+            assert abs(plate_annotations["solvent_line"][0][1] - plate_truth["solvent_line"][0][1]) <= 3